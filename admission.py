@@ -0,0 +1,134 @@
+"""
+Контроль допуска к тяжёлым операциям рендеринга.
+
+Ограничения действуют на весь узел (все воркеры gunicorn): слоты реализованы
+как файловые блокировки flock в общей директории. Блокировка снимается ядром
+при завершении процесса, поэтому упавший воркер не "съедает" слот.
+
+Порядок захвата:
+1. слот пользователя — без ожидания; если все заняты, запрос отклоняется
+   (один пользователь не может занять очередь своими запросами);
+2. общий слот — при занятости запрос встаёт в ограниченную очередь
+   и ждёт не дольше queue_timeout секунд.
+"""
+import os
+import time
+import fcntl
+import tempfile
+from contextlib import contextmanager
+import metrics
+
+metrics.describe('render_in_flight', 'Renders currently running in this process')
+metrics.describe('render_queue_depth', 'Requests of this process waiting for a render slot')
+metrics.describe('render_admitted_total', 'Requests admitted to rendering')
+metrics.describe('render_rejected_total', 'Requests rejected with 429, by reason')
+
+
+class AdmissionRejected(Exception):
+    """Запрос отклонён: лимиты исчерпаны"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Render admission rejected: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Слоты рендеринга: общий лимит, лимит на пользователя и очередь ожидания"""
+
+    def __init__(self, lock_dir=None, global_limit=2, per_user_limit=1,
+                 queue_size=4, queue_timeout=10.0, retry_after=5, poll_interval=0.05):
+        self.lock_dir = lock_dir or os.path.join(tempfile.gettempdir(), 'docx-admission')
+        self.global_limit = max(1, int(global_limit))
+        self.per_user_limit = max(1, int(per_user_limit))
+        self.queue_size = max(0, int(queue_size))
+        self.queue_timeout = float(queue_timeout)
+        self.retry_after = int(retry_after)
+        self.poll_interval = poll_interval
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    def _try_acquire(self, prefix, limit):
+        """Захват любого свободного слота из limit без ожидания; None если все заняты"""
+        for i in range(limit):
+            lock_file = open(os.path.join(self.lock_dir, f"{prefix}-{i}.lock"), 'a+')
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_file
+            except BlockingIOError:
+                lock_file.close()
+        return None
+
+    @staticmethod
+    def _release(lock_file):
+        if lock_file is not None:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            finally:
+                lock_file.close()
+
+    def _reject(self, reason):
+        metrics.inc('render_rejected_total', labels={'reason': reason})
+        return AdmissionRejected(reason, self.retry_after)
+
+    def _acquire_global(self):
+        """Общий слот: сразу или через ограниченную очередь"""
+        slot = self._try_acquire('global', self.global_limit)
+        if slot is not None:
+            return slot
+
+        queue_slot = self._try_acquire('queue', self.queue_size) if self.queue_size else None
+        if queue_slot is None:
+            raise self._reject('queue_full')
+
+        metrics.add_gauge('render_queue_depth', 1)
+        try:
+            deadline = time.monotonic() + self.queue_timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                slot = self._try_acquire('global', self.global_limit)
+                if slot is not None:
+                    return slot
+            raise self._reject('queue_timeout')
+        finally:
+            metrics.add_gauge('render_queue_depth', -1)
+            self._release(queue_slot)
+
+    def acquire(self, user_id):
+        """
+        Захват слотов пользователя и общего.
+
+        Returns:
+            tuple: токен для release()
+
+        Raises:
+            AdmissionRejected: лимит пользователя исчерпан, очередь полна или истёк таймаут
+        """
+        user_slot = self._try_acquire(f"user-{user_id}", self.per_user_limit)
+        if user_slot is None:
+            raise self._reject('user_limit')
+
+        try:
+            global_slot = self._acquire_global()
+        except BaseException:
+            self._release(user_slot)
+            raise
+
+        metrics.inc('render_admitted_total')
+        metrics.add_gauge('render_in_flight', 1)
+        return user_slot, global_slot
+
+    def release(self, token):
+        """Освобождение слотов, полученных acquire()"""
+        user_slot, global_slot = token
+        metrics.add_gauge('render_in_flight', -1)
+        self._release(global_slot)
+        self._release(user_slot)
+
+    @contextmanager
+    def slot(self, user_id):
+        """Контекст выполнения рендеринга (см. acquire)"""
+        token = self.acquire(user_id)
+        try:
+            yield
+        finally:
+            self.release(token)
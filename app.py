@@ -1,40 +1,54 @@
 """
 Flask приложение для заполнения DOCX шаблонов
+
+Приложение собирается фабрикой create_app(). Импорт модуля не обращается
+к сети: S3 клиент создаётся при первом использовании, тяжёлые библиотеки
+(docxtpl, python-docx, boto3, Pillow) импортируются внутри обработчиков,
+а схема БД создаётся отдельной командой:
+
+    flask --app app init-db
 """
 import os
-import json
-import re
+import hmac
 import uuid
+import hashlib
+import ipaddress
 import zipfile
+import threading
+import click
 from datetime import datetime
+from functools import wraps
 from io import BytesIO
 from pathlib import Path
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, flash, after_this_request
+from flask import (Flask, Blueprint, current_app, render_template, request, jsonify, send_file,
+                   redirect, url_for, flash, after_this_request)
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from markupsafe import escape
+from werkzeug.http import http_date
+from werkzeug.local import LocalProxy
 from werkzeug.utils import secure_filename
-from docxtpl import DocxTemplate
-from docx import Document
-from s3_client import S3Client
 import db
+import download_offload
+import json_patch
+import metrics
+import render_pool
+import serialization
+import warmup
+from admission import AdmissionController, AdmissionRejected
+from local_cache import LocalFileCache
+from document_store import TieredDocumentStore
+from session_store import SessionTemplateStore, InvalidSessionToken, make_token, parse_token
+from template_variables import VARIABLES_META
 from models import User
 
-app = Flask(__name__)
-
-# Конфигурация
-app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10 MB максимум
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['OUTPUT_FOLDER'] = 'output'
-app.config['ALLOWED_EXTENSIONS'] = {'docx'}
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+bp = Blueprint('main', __name__)
 
-# Создание необходимых директорий
-for folder in [app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER']]:
-    Path(folder).mkdir(exist_ok=True)
+metrics.describe('image_variant_hits_total', 'Image variants served from the local cache')
+metrics.describe('image_variant_misses_total', 'Image variants resized in the render pool')
 
 # Инициализация Flask-Login
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'main.login'
 login_manager.login_message = 'Please log in to access this page.'
 
 
@@ -44,16 +58,334 @@ def load_user(user_id):
     return User.get(int(user_id))
 
 
-# Инициализация S3 клиента и базы данных
-s3_client = S3Client()
-db.init_db()
-db.migrate_db()
+_s3_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    """
+    Ленивое создание хранилища объектов (одно на приложение): S3 или
+    локальная файловая система по STORAGE_BACKEND (storage.create_storage).
+    boto3 импортируется и bucket проверяется только при первом обращении.
+    """
+    extensions = current_app.extensions
+    if 's3_client' not in extensions:
+        with _s3_client_lock:
+            if 's3_client' not in extensions:
+                from storage import create_storage
+                extensions['s3_client'] = create_storage()
+    return extensions['s3_client']
+
+
+# Прокси сохраняет прежний интерфейс s3_client.upload_file(...) в обработчиках
+s3_client = LocalProxy(get_s3_client)
+
+
+def get_admission():
+    """Контроллер допуска к рендерингу (один на приложение)"""
+    extensions = current_app.extensions
+    if 'admission' not in extensions:
+        config = current_app.config
+        extensions['admission'] = AdmissionController(
+            lock_dir=config['ADMISSION_LOCK_DIR'],
+            global_limit=config['RENDER_MAX_CONCURRENCY'],
+            per_user_limit=config['RENDER_MAX_PER_USER'],
+            queue_size=config['RENDER_QUEUE_SIZE'],
+            queue_timeout=config['RENDER_QUEUE_TIMEOUT'],
+            retry_after=config['RENDER_RETRY_AFTER'],
+        )
+    return extensions['admission']
+
+
+def get_file_cache():
+    """Локальный кэш шаблонов и фрагментов из S3 (один на приложение)"""
+    extensions = current_app.extensions
+    if 'file_cache' not in extensions:
+        extensions['file_cache'] = LocalFileCache(
+            current_app.config['CACHE_FOLDER'],
+            max_bytes=current_app.config['CACHE_MAX_MB'] * 1024 * 1024,
+        )
+    return extensions['file_cache']
+
+
+def get_document_store():
+    """Сгенерированные документы: горячий уровень на диске узла + хранилище объектов"""
+    extensions = current_app.extensions
+    if 'document_store' not in extensions:
+        config = current_app.config
+        hot_cache = LocalFileCache(
+            config['DOCUMENTS_HOT_FOLDER'] or os.path.join(config['OUTPUT_FOLDER'], 'hot'),
+            max_bytes=config['DOCUMENTS_HOT_MAX_MB'] * 1024 * 1024,
+            ttl=config['DOCUMENTS_HOT_TTL_HOURS'] * 3600,
+        )
+        extensions['document_store'] = TieredDocumentStore(get_s3_client(), hot_cache)
+    return extensions['document_store']
+
+
+def get_session_store():
+    """Общее хранилище шаблонов сессии (S3 + локальный кэш)"""
+    extensions = current_app.extensions
+    if 'session_store' not in extensions:
+        extensions['session_store'] = SessionTemplateStore(get_s3_client(), get_file_cache())
+    return extensions['session_store']
+
+
+def render_admission(view):
+    """
+    Декоратор для тяжёлых endpoint'ов: ограничивает число одновременных
+    рендерингов на пользователя и на узел. При перегрузке — 429 с Retry-After.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        admission = get_admission()
+        try:
+            token = admission.acquire(current_user.id)
+        except AdmissionRejected as e:
+            current_app.logger.warning(f"Render rejected for user {current_user.id}: {e.reason}")
+            response = jsonify({'error': 'Server is busy, please retry shortly', 'reason': e.reason})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+        try:
+            return view(*args, **kwargs)
+        finally:
+            admission.release(token)
+    return wrapper
+
+
+def conditional_listing(resource):
+    """
+    Декоратор для списков (шаблоны, фрагменты, история): слабый ETag из версии
+    данных пользователя. Если версия не менялась, ответ 304 отдаётся без
+    выполнения запроса списка. Версия читается до запроса, поэтому запись,
+    попавшая между ними, только сделает следующий ответ полным.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            version = db.get_data_version(current_user.id, resource)
+            variant = hashlib.sha256(request.full_path.encode('utf-8')).hexdigest()[:12]
+            etag = f"{resource}-{current_user.id}-{version}-{db.LATEST_SCHEMA_VERSION}-{variant}"
+
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            # Браузер хранит ответ, но всегда переспрашивает сервер
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+def s3_etag(s3_key):
+    """Сильный ETag для неизменяемого объекта S3 (ключ содержит uuid)"""
+    return hashlib.sha256(s3_key.encode('utf-8')).hexdigest()[:32]
+
+
+def s3_not_modified(s3_key, immutable=False):
+    """Ответ 304, если у клиента уже есть этот объект, иначе None"""
+    etag = s3_etag(s3_key)
+    if not request.if_none_match.contains(etag):
+        return None
+    response = current_app.response_class(status=304)
+    return s3_cache_headers(response, s3_key, immutable)
+
+
+def s3_cache_headers(response, s3_key, immutable=False):
+    """
+    ETag и кэширование ответа с содержимым объекта S3.
+    immutable — URL всегда указывает на один и тот же объект (история);
+    иначе (фрагменты: файл по тому же URL можно заменить) — с перепроверкой.
+    """
+    response.set_etag(s3_etag(s3_key))
+    response.cache_control.public = False
+    response.cache_control.private = True
+    if immutable:
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = None
+        response.cache_control.no_cache = True
+    return response
+
+
+def offload_enabled():
+    """Байты файлов отдаёт nginx (DOWNLOAD_OFFLOAD=nginx)"""
+    return current_app.config['DOWNLOAD_OFFLOAD'] == 'nginx'
+
+
+def send_download(path, mimetype, download_name=None, as_attachment=False, **send_file_options):
+    """
+    Отдача локального файла: через nginx (X-Accel-Redirect), если включено
+    и файл лежит в директории с internal-location, иначе send_file.
+    """
+    if offload_enabled():
+        config = current_app.config
+        uri = download_offload.accel_uri(path, {
+            'output': config['OUTPUT_FOLDER'],
+            'cache': config['CACHE_FOLDER'],
+            'hot': config['DOCUMENTS_HOT_FOLDER'],
+        }, config['X_ACCEL_PREFIX'])
+        if uri is not None:
+            return download_offload.accel_response(
+                current_app.response_class, uri, mimetype, download_name, as_attachment
+            )
+        current_app.logger.warning(f"No X-Accel location for {path}, sending through the app")
+    return send_file(path, mimetype=mimetype, as_attachment=as_attachment, download_name=download_name,
+                     **send_file_options)
+
+
+def send_stored_object(s3_key, mimetype, download_name=None, as_attachment=True):
+    """
+    Отдача объекта хранилища через nginx без скачивания в приложение: файл
+    бэкенда filesystem или прокси в MinIO по подписанной ссылке.
+
+    Returns:
+        Ответ с X-Accel-Redirect или None (выгрузка выключена или недоступна)
+    """
+    if not offload_enabled():
+        return None
+    config = current_app.config
+    storage = get_s3_client()
+    path = storage.local_path(s3_key)
+    if path is not None:
+        uri = download_offload.accel_uri(path, {'storage': getattr(storage, 'root', None)}, config['X_ACCEL_PREFIX'])
+    else:
+        url = storage.presigned_url(
+            s3_key, expires=config['X_ACCEL_URL_EXPIRES'], content_type=mimetype,
+            content_disposition=download_offload.content_disposition(download_name, as_attachment),
+        )
+        uri = download_offload.s3_accel_uri(url, config['X_ACCEL_PREFIX']) if url else None
+    if uri is None:
+        return None
+    return download_offload.accel_response(current_app.response_class, uri, mimetype, download_name, as_attachment)
+
+
+def create_app(config=None):
+    """
+    Фабрика приложения.
+
+    Args:
+        config: Словарь с переопределением конфигурации (например, для тестов)
+
+    Returns:
+        Flask: настроенное приложение
+    """
+    app = Flask(__name__)
+    # orjson для jsonify и request.get_json (если установлен)
+    app.json = serialization.FastJSONProvider(app)
+
+    # Конфигурация
+    app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10 MB максимум
+    app.config['UPLOAD_FOLDER'] = 'uploads'
+    app.config['OUTPUT_FOLDER'] = 'output'
+    app.config['ALLOWED_EXTENSIONS'] = {'docx'}
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+
+    # Контроль допуска к рендерингу (/generate, /parse-template)
+    app.config['RENDER_MAX_CONCURRENCY'] = int(os.environ.get('RENDER_MAX_CONCURRENCY', 2))
+    app.config['RENDER_MAX_PER_USER'] = int(os.environ.get('RENDER_MAX_PER_USER', 1))
+    app.config['RENDER_QUEUE_SIZE'] = int(os.environ.get('RENDER_QUEUE_SIZE', 4))
+    app.config['RENDER_QUEUE_TIMEOUT'] = float(os.environ.get('RENDER_QUEUE_TIMEOUT', 10))
+    app.config['RENDER_RETRY_AFTER'] = int(os.environ.get('RENDER_RETRY_AFTER', 5))
+    app.config['ADMISSION_LOCK_DIR'] = os.environ.get('ADMISSION_LOCK_DIR')
+
+    # Локальный кэш объектов S3 и прогрев воркера после старта
+    app.config['CACHE_FOLDER'] = os.environ.get('CACHE_FOLDER', 'cache')
+    app.config['CACHE_MAX_MB'] = int(os.environ.get('CACHE_MAX_MB', 512))
+    app.config['WARMUP_TEMPLATES'] = int(os.environ.get('WARMUP_TEMPLATES', 10))
+    app.config['WARMUP_SNIPPETS'] = int(os.environ.get('WARMUP_SNIPPETS', 20))
+    app.config['WARMUP_BUDGET'] = float(os.environ.get('WARMUP_BUDGET', 30))
+
+    # HTML-превью (/generate?preview=1): длина страницы в блоках и предел числа страниц
+    app.config['PREVIEW_BLOCKS_PER_PAGE'] = int(os.environ.get('PREVIEW_BLOCKS_PER_PAGE', 40))
+    app.config['PREVIEW_MAX_PAGES'] = int(os.environ.get('PREVIEW_MAX_PAGES', 30))
+
+    # Контекст генерации в файловой части data может быть сжат gzip: предел после распаковки
+    app.config['JSON_MAX_DECOMPRESSED_MB'] = int(os.environ.get('JSON_MAX_DECOMPRESSED_MB', 50))
+
+    # Изображения в контексте: предел загрузки и разрешение вариантов на странице
+    app.config['IMAGE_MAX_MB'] = int(os.environ.get('IMAGE_MAX_MB', 5))
+    app.config['IMAGE_MAX_PIXELS'] = int(os.environ.get('IMAGE_MAX_PIXELS', 40_000_000))
+    app.config['IMAGE_DPI'] = int(os.environ.get('IMAGE_DPI', 200))
+
+    # Горячий уровень сгенерированных документов (по умолчанию output/hot): бюджет и срок
+    app.config['DOCUMENTS_HOT_FOLDER'] = os.environ.get('DOCUMENTS_HOT_FOLDER')
+    app.config['DOCUMENTS_HOT_MAX_MB'] = int(os.environ.get('DOCUMENTS_HOT_MAX_MB', 1024))
+    app.config['DOCUMENTS_HOT_TTL_HOURS'] = float(os.environ.get('DOCUMENTS_HOT_TTL_HOURS', 72))
+
+    # Отдача файлов через nginx (X-Accel-Redirect): 'nginx' или пусто — через приложение
+    app.config['DOWNLOAD_OFFLOAD'] = os.environ.get('DOWNLOAD_OFFLOAD', '').strip().lower()
+    app.config['X_ACCEL_PREFIX'] = os.environ.get('X_ACCEL_PREFIX', '/_protected')
+    # Срок подписанной ссылки на объект S3 для прокси nginx, секунд
+    app.config['X_ACCEL_URL_EXPIRES'] = int(os.environ.get('X_ACCEL_URL_EXPIRES', 60))
+
+    # /metrics: токен (Authorization: Bearer ...) или прямой запрос с разрешённых адресов/сетей
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')
+    app.config['METRICS_ALLOWED_IPS'] = os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1')
+    if config:
+        app.config.update(config)
+
+    # Создание необходимых директорий
+    for folder in [app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER']]:
+        Path(folder).mkdir(exist_ok=True)
+
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+    # Прогрев запускает gunicorn (post_worker_init) или __main__, не фабрика
+    app.extensions['warmup'] = warmup.WarmupState()
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Создание и миграция схемы БД (однократно при деплое, не в каждом воркере)"""
+        applied = db.migrate_db()
+        if applied:
+            print(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+        print(f'Database schema is up to date (version {db.LATEST_SCHEMA_VERSION})')
+
+    @app.cli.command('reindex-snippets')
+    @click.option('--batch-size', default=100, show_default=True)
+    def reindex_snippets_command(batch_size):
+        """Извлечение текста фрагментов, загруженных до появления поиска"""
+        cache = get_file_cache()
+        indexed = failed = 0
+        last_id = 0
+        while True:
+            batch = db.get_snippets_without_content(after_id=last_id, limit=batch_size)
+            if not batch:
+                break
+            for snippet in batch:
+                last_id = snippet['id']
+                path = cache.fetch(snippet['s3_key'], get_s3_client().download_file)
+                content_text = extract_snippet_text(path) if path else None
+                if content_text is None:
+                    failed += 1
+                    continue
+                db.set_snippet_content(snippet['id'], content_text)
+                indexed += 1
+        print(f'Indexed snippets: {indexed}, failed: {failed}')
+
+    @app.cli.command('cleanup-sessions')
+    @click.option('--max-age-hours', default=24, show_default=True,
+                  help='Удалить шаблоны сессии старше указанного возраста')
+    def cleanup_sessions_command(max_age_hours):
+        """Удаление устаревших шаблонов сессии из общего хранилища (для cron)"""
+        # Шаблоны документов из истории остаются: по ним работает перегенерация
+        removed = get_session_store().cleanup(max_age_hours * 3600, keep=db.get_referenced_template_hashes())
+        print(f'Removed session templates: {removed}')
+
+    return app
 
 
 def allowed_file(filename):
     """Проверка допустимого расширения файла"""
     return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+           filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
 
 
 def validate_file_path(base_dir, filename):
@@ -149,7 +481,7 @@ def cleanup_old_files():
     current_time = datetime.now().timestamp()
     max_age = 3600  # 1 час
 
-    for folder in [app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER']]:
+    for folder in [current_app.config['UPLOAD_FOLDER'], current_app.config['OUTPUT_FOLDER']]:
         for file_path in Path(folder).glob('*'):
             if file_path.is_file():
                 file_age = current_time - file_path.stat().st_mtime
@@ -157,193 +489,28 @@ def cleanup_old_files():
                     try:
                         file_path.unlink()
                     except Exception as e:
-                        app.logger.error(f"Failed to delete old file {file_path}: {e}")
+                        current_app.logger.error(f"Failed to delete old file {file_path}: {e}")
 
 
 def extract_template_variables(doc_path):
-    """Извлечение всех Jinja2 переменных из DOCX шаблона"""
+    """Извлечение всех Jinja2 переменных из DOCX шаблона (в пуле рендеринга)"""
     try:
-        doc = Document(doc_path)
-        text_content = []
-
-        # Извлечение текста из параграфов
-        for paragraph in doc.paragraphs:
-            text_content.append(paragraph.text)
-
-        # Извлечение текста из таблиц
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    text_content.append(cell.text)
-
-        # Объединение всего текста
-        full_text = ' '.join(text_content)
-
-        # Поиск простых переменных {{variable}} (с поддержкой кириллицы) с позициями
-        simple_pattern = r'\{\{\s*([a-zA-Zа-яА-ЯёЁ_][a-zA-Zа-яА-ЯёЁ0-9_\.]*?)\s*(?:\|[^}]*)?\}\}'
-        simple_matches = [(m.group(1), m.start()) for m in re.finditer(simple_pattern, full_text)]
-
-        # Поиск переменных в циклах {% for item in items %} с позициями
-        loop_pattern = r'\{%\s*for\s+[a-zA-Zа-яА-ЯёЁ_][a-zA-Zа-яА-ЯёЁ0-9_]*\s+in\s+([a-zA-Zа-яА-ЯёЁ_][a-zA-Zа-яА-ЯёЁ0-9_]*)\s*%\}'
-        loop_matches = [(m.group(1), m.start()) for m in re.finditer(loop_pattern, full_text)]
-
-        # Поиск переменных в условиях {% if variable %} с позициями
-        if_pattern = r'\{%\s*if\s+([a-zA-Zа-яА-ЯёЁ_][a-zA-Zа-яА-ЯёЁ0-9_]*)\s*%\}'
-        if_matches = [(m.group(1), m.start()) for m in re.finditer(if_pattern, full_text)]
-
-        # Поиск SNIPPET-меток {{SNIPPET:name}}
-        snippet_pattern = r'\{\{\s*SNIPPET\s*:\s*([a-zA-Zа-яА-ЯёЁ0-9_]+)\s*\}\}'
-        snippet_matches = [(m.group(1), m.start()) for m in re.finditer(snippet_pattern, full_text)]
-
-        # Создаем словарь позиций (первое вхождение каждой переменной)
-        var_positions = {}
-        for var, pos in simple_matches + loop_matches + if_matches:
-            if var not in var_positions:
-                var_positions[var] = pos
-
-        # Списки переменных (для определения типов)
-        simple_vars = [m[0] for m in simple_matches]
-        loop_vars = [m[0] for m in loop_matches]
-        if_vars = [m[0] for m in if_matches]
-
-        # Объединение всех переменных
-        all_vars = set(simple_vars + loop_vars + if_vars)
-
-        # Имена SNIPPET-меток (исключаем из обычных переменных)
-        snippet_names = set(m[0] for m in snippet_matches)
-        all_vars = all_vars - snippet_names
-
-        # Разделение на простые переменные и вложенные объекты
-        fields = {}
-        arrays = set()
-
-        for var in all_vars:
-            # Пропускаем переменные цикла (loop.index и т.д.)
-            if var.startswith('loop.'):
-                continue
-
-            # Проверяем, является ли это вложенным объектом
-            if '.' in var:
-                parts = var.split('.')
-                root = parts[0]
-
-                # Если корневая переменная в циклах, это массив объектов
-                if root in loop_vars:
-                    arrays.add(root)
-                    if root not in fields:
-                        fields[root] = {'type': 'array', 'fields': set(), 'position': var_positions.get(root, 9999)}
-                    # Добавляем поле объекта
-                    fields[root]['fields'].add(parts[1])
-                else:
-                    # Простой вложенный объект
-                    if root not in fields:
-                        fields[root] = {'type': 'object', 'fields': set(), 'position': var_positions.get(root, 9999)}
-                    fields[root]['fields'].add('.'.join(parts[1:]))
-            else:
-                # Определяем тип переменной
-                if var in loop_vars:
-                    arrays.add(var)
-                    if var not in fields:
-                        fields[var] = {'type': 'array', 'fields': set(), 'position': var_positions.get(var, 9999)}
-                elif var in if_vars:
-                    # Условная переменная - вероятно boolean
-                    if var not in fields:
-                        fields[var] = {'type': 'boolean', 'position': var_positions.get(var, 9999)}
-                else:
-                    # Простая переменная
-                    if var not in fields:
-                        fields[var] = {'type': 'simple', 'position': var_positions.get(var, 9999)}
-
-        # Преобразуем sets в lists для JSON
-        result = {}
-        for key, value in fields.items():
-            if isinstance(value, dict):
-                if 'fields' in value and isinstance(value['fields'], set):
-                    value['fields'] = sorted(list(value['fields']))
-                result[key] = value
-            else:
-                result[key] = value
-
-        # Добавляем SNIPPET-метки
-        snippets_list = []
-        for name, pos in snippet_matches:
-            if name not in [s['name'] for s in snippets_list]:
-                snippets_list.append({'name': name, 'position': pos})
-        result['__snippets__'] = snippets_list
-
-        return result
-
-    except Exception as e:
-        app.logger.error(f"Error extracting variables: {e}")
+        return render_pool.run('extract_variables', doc_path)
+    except render_pool.RenderError as e:
+        current_app.logger.error(f"Error extracting variables: {e}")
         return {}
 
 
-def insert_snippet_into_doc(doc_path, snippet_marker, snippet_doc_path):
-    """
-    Вставляет содержимое DOCX-фрагмента на место метки в документе.
-    Метка: {{SNIPPET:name}} — заменяется всеми параграфами и таблицами из фрагмента.
-    """
-    from docx.oxml.ns import qn
-    from copy import deepcopy
-
-    doc = Document(doc_path)
-    snippet_doc = Document(snippet_doc_path)
-    marker_text = '{{SNIPPET:' + snippet_marker + '}}'
-    found = False
-
-    for i, paragraph in enumerate(doc.paragraphs):
-        if marker_text in paragraph.text:
-            found = True
-            # Получаем родительский элемент и позицию
-            parent = paragraph._element.getparent()
-            idx = list(parent).index(paragraph._element)
-
-            # Вставляем элементы из фрагмента
-            insert_idx = idx
-            for element in snippet_doc.element.body:
-                tag = element.tag.split('}')[-1] if '}' in element.tag else element.tag
-                if tag in ('p', 'tbl'):
-                    new_element = deepcopy(element)
-                    parent.insert(insert_idx + 1, new_element)
-                    insert_idx += 1
-
-            # Удаляем параграф с меткой
-            parent.remove(paragraph._element)
-            break
-
-    if not found:
-        # Проверяем таблицы (метка может быть внутри ячейки)
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for paragraph in cell.paragraphs:
-                        if marker_text in paragraph.text:
-                            found = True
-                            parent = paragraph._element.getparent()
-                            idx = list(parent).index(paragraph._element)
-
-                            insert_idx = idx
-                            for element in snippet_doc.element.body:
-                                tag = element.tag.split('}')[-1] if '}' in element.tag else element.tag
-                                if tag in ('p', 'tbl'):
-                                    new_element = deepcopy(element)
-                                    parent.insert(insert_idx + 1, new_element)
-                                    insert_idx += 1
-
-                            parent.remove(paragraph._element)
-                            break
-                    if found:
-                        break
-                if found:
-                    break
-            if found:
-                break
-
-    doc.save(doc_path)
-    return found
+def extract_snippet_text(doc_path):
+    """Текст фрагмента для поиска (в пуле рендеринга); None — проиндексировать позже"""
+    try:
+        return render_pool.run('extract_text', os.path.abspath(doc_path))
+    except render_pool.RenderError as e:
+        current_app.logger.error(f"Error extracting snippet text: {e}")
+        return None
 
 
-@app.route('/')
+@bp.route('/')
 @login_required
 def index():
     """Главная страница"""
@@ -351,22 +518,23 @@ def index():
     return render_template('index.html')
 
 
-@app.route('/my-templates')
+@bp.route('/my-templates')
 @login_required
 def my_templates_page():
     """Страница библиотеки шаблонов"""
     return render_template('my_templates.html')
 
 
-@app.route('/history-page')
+@bp.route('/history-page')
 @login_required
 def history_page():
     """Страница истории сгенерированных документов"""
     return render_template('history.html')
 
 
-@app.route('/parse-template', methods=['POST'])
+@bp.route('/parse-template', methods=['POST'])
 @login_required
+@render_admission
 def parse_template():
     """Парсинг шаблона и извлечение переменных"""
     try:
@@ -386,23 +554,30 @@ def parse_template():
         try:
             validate_docx_file(file.stream)
         except ValueError as e:
-            app.logger.warning(f"File validation failed: {e}")
+            current_app.logger.warning(f"File validation failed: {e}")
             return jsonify({'error': f'Invalid file: {str(e)}'}), 400
 
         # Сохранение временного файла
         filename = secure_filename(file.filename)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"temp_{timestamp}_{filename}")
+        temp_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f"temp_{uuid.uuid4().hex}_{filename}")
         file.save(temp_path)
 
-        # Извлечение переменных
-        variables = extract_template_variables(temp_path)
+        # Конвертация старого синтаксиса {var} → {{var}} (с сохранением форматирования)
+        from convert_brackets_final import convert_docx
+        converted_count, converted_names = convert_docx(temp_path)
+        if converted_count:
+            current_app.logger.info(f"Converted {len(converted_names)} legacy single-brace variables in {filename}")
 
-        # Сохраняем путь к файлу для последующего использования
-        # (файл будет использован при генерации)
-        session_filename = f"session_{timestamp}_{filename}"
-        session_path = os.path.join(app.config['UPLOAD_FOLDER'], session_filename)
-        os.rename(temp_path, session_path)
+        # Шаблон сессии — в общее хранилище по хешу содержимого,
+        # чтобы /generate мог обслужить любой узел
+        store = get_session_store()
+        session_token = store.put(temp_path, filename)
+
+        # Извлечение переменных (для уже загружавшегося содержимого — из кэша)
+        variables = store.get_variables(session_token)
+        if variables is None:
+            variables = extract_template_variables(store.get_path(session_token))
+            store.set_variables(session_token, variables)
 
         # Разделяем SNIPPET-метки от обычных переменных
         snippets_info = variables.pop('__snippets__', [])
@@ -411,20 +586,223 @@ def parse_template():
             'success': True,
             'variables': variables,
             'snippets': snippets_info,
-            'template_file': session_filename,
-            'filename': filename
+            'template_file': session_token,
+            'filename': filename,
+            'converted_variables': converted_names
         })
 
     except Exception as e:
-        app.logger.error(f"Error parsing template: {e}")
+        current_app.logger.error(f"Error parsing template: {e}")
         # Очистка временного файла при ошибке
         if 'temp_path' in locals() and os.path.exists(temp_path):
             os.remove(temp_path)
         return jsonify({'error': f'Error parsing template: {str(e)}'}), 500
 
 
-@app.route('/generate', methods=['POST'])
+def _read_snippet_selection(data):
+    """Выбор фрагментов из запроса: {метка: id фрагмента или None — "Не вставлять"}"""
+    return {marker_name: int(snippet_id) if snippet_id else None for marker_name, snippet_id in data.items()}
+
+
+def _resolve_snippets(snippet_selection):
+    """
+    Файлы фрагментов для SNIPPET-меток (локальный кэш, при промахе — S3).
+
+    Returns:
+        tuple: ({метка: путь к файлу или None}, id использованных фрагментов)
+    """
+    snippets = {}
+    used_snippet_ids = []
+    for marker_name, snippet_id in snippet_selection.items():
+        if snippet_id is None:
+            # "Не вставлять" — удаляем метку
+            snippets[marker_name] = None
+            continue
+
+        # Получаем фрагмент из БД
+        snippet = db.get_snippet(snippet_id, user_id=current_user.id)
+        if not snippet:
+            continue
+
+        snippet_path = get_file_cache().fetch(snippet['s3_key'], s3_client.download_file)
+        if snippet_path:
+            snippets[marker_name] = os.path.abspath(snippet_path)
+            used_snippet_ids.append(snippet['id'])
+    return snippets, used_snippet_ids
+
+
+def _image_variant(image, width_mm, height_mm):
+    """
+    Вариант изображения под размер на странице: из локального кэша,
+    при промахе — уменьшение оригинала в пуле (один раз на размер).
+
+    Returns:
+        tuple: (путь к варианту, (width_mm, height_mm))
+    """
+    import media
+
+    pixels, size_mm = media.fit((image['width'], image['height']), width_mm, height_mm, current_app.config['IMAGE_DPI'])
+    extension = media.variant_extension(image['content_type'].split('/')[-1].upper())
+    key = media.variant_key(image['content_hash'], pixels, extension)
+
+    cache = get_file_cache()
+    path = cache.get(key)
+    if path is not None:
+        metrics.inc('image_variant_hits_total')
+        return path, size_mm
+
+    original_path = cache.fetch(image['s3_key'], s3_client.download_file)
+    if not original_path:
+        raise media.InvalidImage(f"Image {image['id']} is not available in storage")
+
+    metrics.inc('image_variant_misses_total')
+    temp_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f"image_{uuid.uuid4().hex}{extension}")
+    try:
+        render_pool.run('resize_image', os.path.abspath(original_path), os.path.abspath(temp_path), pixels)
+        return cache.put(key, temp_path), size_mm
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _resolve_images(context):
+    """
+    Ссылки {"$image": id, ...} в контексте → варианты изображений.
+
+    Returns:
+        tuple: (контекст для рендеринга, есть ли в нём изображения)
+
+    Raises:
+        media.InvalidImage: некорректная ссылка или изображение не найдено
+        render_pool.RenderError: ошибка уменьшения изображения
+    """
+    import media
+
+    refs = media.find_image_refs(context)
+    if not refs:
+        return context, False
+
+    images = db.get_images_by_ids({ref[0] for ref in refs}, current_user.id)
+    resolved = {}
+    for ref in refs:
+        image = images.get(ref[0])
+        if image is None:
+            raise media.InvalidImage(f"Image not found: {ref[0]}")
+        resolved[ref] = _image_variant(image, ref[1], ref[2])
+    return media.substitute_images(context, resolved), True
+
+
+def _render_document(upload_path, filename, context, context_json, snippet_selection, template_hash, preview=False):
+    """
+    Рендеринг шаблона с данными и фрагментами, сохранение результата в историю
+    (общая часть /generate и /history/<id>/regenerate).
+
+    Args:
+        context_json: Исходный JSON-текст context (сохраняется в историю как есть)
+        template_hash: sha256 шаблона в хранилище сессий или None
+        preview: Вернуть HTML-превью без сохранения файла, S3 и истории
+
+    Returns:
+        Flask response
+    """
+    import media
+
+    # SNIPPET-метки: фрагменты берутся из локального кэша (I/O), вставка — в пуле рендеринга
+    snippets = {}
+    used_snippet_ids = []
+    try:
+        snippets, used_snippet_ids = _resolve_snippets(snippet_selection)
+    except Exception as e:
+        current_app.logger.error(f"Error processing snippets: {e}")
+
+    # Изображения: в историю сохраняется контекст со ссылками, в рендеринг — с вариантами
+    try:
+        render_context, has_images = _resolve_images(context)
+    except media.InvalidImage as e:
+        return jsonify({'error': str(e)}), 400
+    except render_pool.RenderError as e:
+        return jsonify({'error': f'Image processing error: {str(e)}'}), 500
+
+    if preview:
+        try:
+            result = render_pool.preview(
+                os.path.abspath(upload_path), render_context, snippets,
+                current_app.config['PREVIEW_BLOCKS_PER_PAGE'], current_app.config['PREVIEW_MAX_PAGES'],
+                images=has_images, label=filename
+            )
+        except render_pool.RenderTooLarge as e:
+            return jsonify({'error': str(e)}), 413
+        except render_pool.RenderError as e:
+            return jsonify({'error': f'Template processing error: {str(e)}'}), 500
+        return jsonify({
+            'success': True,
+            'pages': result['pages'],
+            'page_count': len(result['pages']),
+            'truncated': result['truncated'],
+        })
+
+    try:
+        db.record_snippet_use(used_snippet_ids)
+    except Exception as e:
+        current_app.logger.warning(f"Failed to record snippet usage: {e}")
+
+    # Генерация имени выходного файла
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    # Суффикс uuid: одинаковые имена в одну секунду не перезаписывают друг друга
+    output_filename = f"filled_{timestamp}_{uuid.uuid4().hex[:8]}_{filename}"
+    output_path = os.path.join(current_app.config['OUTPUT_FOLDER'], output_filename)
+
+    # Обработка шаблона (рендеринг, вставка фрагментов, сохранение — в пуле процессов)
+    try:
+        render_pool.render(
+            os.path.abspath(upload_path), render_context, snippets, os.path.abspath(output_path),
+            images=has_images, label=filename
+        )
+    except render_pool.RenderTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except render_pool.RenderError as e:
+        return jsonify({'error': f'Template processing error: {str(e)}'}), 500
+
+    # Сохранение в историю (MinIO + БД)
+    doc_id = None
+    try:
+        # Генерируем уникальный ключ для S3
+        s3_key = f"generated/{uuid.uuid4()}_{output_filename}"
+
+        # В хранилище объектов и на горячий уровень (недавние документы скачиваются с диска)
+        if get_document_store().put(s3_key, output_path):
+            # Получаем размер файла
+            file_size = os.path.getsize(output_path)
+
+            # Сохраняем метаданные в БД
+            doc_id = db.add_generated_document(
+                template_name=filename,
+                output_filename=output_filename,
+                s3_key=s3_key,
+                json_data=context,
+                json_text=context_json,
+                file_size=file_size,
+                user_id=current_user.id,
+                template_hash=template_hash,
+                snippet_selection=snippet_selection
+            )
+
+            current_app.logger.info(f"Document saved to history: ID={doc_id}, S3={s3_key}")
+    except Exception as e:
+        current_app.logger.error(f"Error saving to history: {e}")
+        # Продолжаем даже если сохранение в историю не удалось
+
+    return jsonify({
+        'success': True,
+        'filename': output_filename,
+        'history_id': doc_id,
+        'message': 'Document generated successfully'
+    })
+
+
+@bp.route('/generate', methods=['POST'])
 @login_required
+@render_admission
 def generate():
     """Генерация документа из шаблона и данных JSON"""
     try:
@@ -434,18 +812,16 @@ def generate():
         template_file = request.form.get('template_file')
 
         if template_file:
-            # Валидация пути для предотвращения Path Traversal
+            # Шаблон сессии из общего хранилища (токен проверяется по формату)
             try:
-                validated_path = validate_file_path(app.config['UPLOAD_FOLDER'], template_file)
-                upload_path = str(validated_path)
-            except ValueError as e:
-                app.logger.warning(f"Path traversal attempt: {e}")
+                _, filename = parse_token(template_file)
+                upload_path = get_session_store().get_path(template_file)
+            except InvalidSessionToken as e:
+                current_app.logger.warning(f"Invalid session template token: {e}")
                 return jsonify({'error': 'Invalid file path'}), 400
 
-            if not os.path.exists(upload_path):
+            if not upload_path:
                 return jsonify({'error': 'Template file not found. Please upload again.'}), 400
-            # Извлекаем оригинальное имя файла
-            filename = template_file.replace('session_', '').split('_', 2)[2] if '_' in template_file else template_file
         else:
             # Проверка наличия файла в запросе
             if 'template' not in request.files:
@@ -463,134 +839,89 @@ def generate():
             try:
                 validate_docx_file(file.stream)
             except ValueError as e:
-                app.logger.warning(f"File validation failed: {e}")
+                current_app.logger.warning(f"File validation failed: {e}")
                 return jsonify({'error': f'Invalid file: {str(e)}'}), 400
 
             # Сохранение загруженного шаблона
             filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            upload_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{timestamp}_{filename}")
+            upload_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{filename}")
             file.save(upload_path)
 
-        # Получение JSON данных
-        try:
-            json_data = request.form.get('data', '{}')
-            context = json.loads(json_data)
-        except json.JSONDecodeError as e:
-            return jsonify({'error': f'Invalid JSON: {str(e)}'}), 400
-
-        # Генерация имени выходного файла
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        output_filename = f"filled_{timestamp}_{filename}"
-        output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-
-        # Обработка шаблона
-        try:
-            doc = DocxTemplate(upload_path)
-            doc.render(context)
-            doc.save(output_path)
-        except Exception as e:
-            return jsonify({'error': f'Template processing error: {str(e)}'}), 500
+            from convert_brackets_final import convert_docx
+            convert_docx(upload_path)
 
-        # Обработка SNIPPET-меток
+        # Получение JSON данных: поле формы или файловая часть data (можно сжать gzip)
         try:
-            snippet_data = json.loads(request.form.get('snippets', '{}'))
-            for marker_name, snippet_id in snippet_data.items():
-                if not snippet_id:
-                    # "Не вставлять" — удаляем метку
-                    temp_doc = Document(output_path)
-                    marker_text = '{{SNIPPET:' + marker_name + '}}'
-                    for paragraph in temp_doc.paragraphs:
-                        if marker_text in paragraph.text:
-                            paragraph._element.getparent().remove(paragraph._element)
-                            break
-                    temp_doc.save(output_path)
-                    continue
+            context, context_json = serialization.read_json_field(
+                request.form, request.files, 'data',
+                max_decompressed=current_app.config['JSON_MAX_DECOMPRESSED_MB'] * 1024 * 1024,
+            )
+        except serialization.PayloadTooLarge as e:
+            return jsonify({'error': str(e)}), 413
+        except ValueError as e:
+            return jsonify({'error': f'Invalid JSON: {str(e)}'}), 400
 
-                # Получаем фрагмент из БД
-                snippet = db.get_snippet(int(snippet_id), user_id=current_user.id)
-                if not snippet:
-                    continue
+        # ?preview=1 — HTML-превью: рендеринг в памяти, без сохранения файла, S3 и истории
+        is_preview = request.args.get('preview') in ('1', 'true')
 
-                # Скачиваем фрагмент из S3
-                snippet_temp_path = os.path.join(
-                    app.config['UPLOAD_FOLDER'],
-                    f"snippet_{uuid.uuid4()}.docx"
-                )
-                if s3_client.download_file(snippet['s3_key'], snippet_temp_path):
-                    try:
-                        insert_snippet_into_doc(output_path, marker_name, snippet_temp_path)
-                    finally:
-                        if os.path.exists(snippet_temp_path):
-                            os.remove(snippet_temp_path)
-        except Exception as e:
-            app.logger.error(f"Error processing snippets: {e}")
+        if template_file:
+            template_hash = parse_token(template_file)[0]
+        elif is_preview:
+            template_hash = None
+        else:
+            # Шаблон в хранилище сессий: по хешу документ можно перегенерировать из истории
+            try:
+                token = get_session_store().put(upload_path, filename)
+                template_hash = parse_token(token)[0]
+                upload_path = get_session_store().get_path(token)
+            except IOError as e:
+                current_app.logger.warning(f"Failed to store template for regeneration: {e}")
+                template_hash = None
 
-        # Сохранение в историю (MinIO + БД)
         try:
-            # Генерируем уникальный ключ для S3
-            s3_key = f"generated/{uuid.uuid4()}_{output_filename}"
-
-            # Загружаем в MinIO
-            if s3_client.upload_file(output_path, s3_key):
-                # Получаем размер файла
-                file_size = os.path.getsize(output_path)
-
-                # Сохраняем метаданные в БД
-                doc_id = db.add_generated_document(
-                    template_name=filename,
-                    output_filename=output_filename,
-                    s3_key=s3_key,
-                    json_data=context,
-                    file_size=file_size,
-                    user_id=current_user.id
-                )
-
-                app.logger.info(f"Document saved to history: ID={doc_id}, S3={s3_key}")
-        except Exception as e:
-            app.logger.error(f"Error saving to history: {e}")
-            # Продолжаем даже если сохранение в историю не удалось
+            snippet_selection = _read_snippet_selection(serialization.loads(request.form.get('snippets', '{}')))
+        except (ValueError, TypeError, AttributeError) as e:
+            current_app.logger.error(f"Error processing snippets: {e}")
+            snippet_selection = {}
 
-        return jsonify({
-            'success': True,
-            'filename': output_filename,
-            'message': 'Document generated successfully'
-        })
+        return _render_document(
+            upload_path, filename, context, context_json, snippet_selection, template_hash, preview=is_preview
+        )
 
     except Exception as e:
-        app.logger.error(f"Error in generate endpoint: {e}")
+        current_app.logger.error(f"Error in generate endpoint: {e}")
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
 
-@app.route('/download/<filename>')
+@bp.route('/download/<filename>')
 @login_required
 def download(filename):
     """Скачивание сгенерированного документа"""
     try:
         # Валидация пути для предотвращения Path Traversal
         try:
-            validated_path = validate_file_path(app.config['OUTPUT_FOLDER'], filename)
+            validated_path = validate_file_path(current_app.config['OUTPUT_FOLDER'], filename)
             file_path = str(validated_path)
         except ValueError as e:
-            app.logger.warning(f"Path traversal attempt in download: {e}")
+            current_app.logger.warning(f"Path traversal attempt in download: {e}")
             return jsonify({'error': 'Invalid file path'}), 400
 
         if not os.path.exists(file_path):
             return jsonify({'error': 'File not found'}), 404
 
-        return send_file(
+        return send_download(
             file_path,
-            as_attachment=True,
+            'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
             download_name=secure_filename(filename),
-            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+            as_attachment=True
         )
 
     except Exception as e:
-        app.logger.error(f"Error in download endpoint: {e}")
+        current_app.logger.error(f"Error in download endpoint: {e}")
         return jsonify({'error': f'Download error: {str(e)}'}), 500
 
 
-@app.route('/health')
+@bp.route('/health')
 def health():
     """Проверка состояния приложения"""
     return jsonify({
@@ -599,13 +930,52 @@ def health():
     })
 
 
+@bp.route('/ready')
+def ready():
+    """Готовность воркера: 503, пока идёт прогрев кэша"""
+    state = current_app.extensions['warmup']
+    body = {'status': 'ready' if state.ready else 'warming_up', 'warmup': state.to_dict()}
+    return jsonify(body), (200 if state.ready else 503)
+
+
+def metrics_access_allowed():
+    """
+    Доступ к /metrics. Если задан METRICS_TOKEN — только с ним; иначе только прямые
+    запросы (без X-Forwarded-For, т.е. не через nginx) с адресов METRICS_ALLOWED_IPS.
+    """
+    token = current_app.config['METRICS_TOKEN']
+    if token:
+        scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+        return scheme.lower() == 'bearer' and hmac.compare_digest(credentials.strip().encode(), token.encode())
+
+    if request.headers.get('X-Forwarded-For') or not request.remote_addr:
+        return False
+    try:
+        address = ipaddress.ip_address(request.remote_addr)
+    except ValueError:
+        return False
+    for network in current_app.config['METRICS_ALLOWED_IPS'].split(','):
+        network = network.strip()
+        if network and address in ipaddress.ip_network(network, strict=False):
+            return True
+    return False
+
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Метрики процесса в формате Prometheus (дополнительно закрыт на nginx)"""
+    if not metrics_access_allowed():
+        return jsonify({'error': 'Forbidden'}), 403
+    return current_app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 # ===== Endpoints авторизации =====
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     """Страница входа"""
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
     if request.method == 'POST':
         username = request.form.get('username', '').strip()
@@ -619,18 +989,18 @@ def login():
         if user:
             login_user(user)
             next_page = request.args.get('next')
-            return redirect(next_page or url_for('index'))
+            return redirect(next_page or url_for('main.index'))
         else:
             flash('Invalid username or password', 'danger')
 
     return render_template('login.html')
 
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     """Страница регистрации"""
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
     if request.method == 'POST':
         username = request.form.get('username', '').strip()
@@ -665,35 +1035,36 @@ def register():
         if user:
             login_user(user)
             flash('Registration successful!', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         else:
             flash('Registration failed. Please try again.', 'danger')
 
     return render_template('register.html')
 
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     """Выход из системы"""
     logout_user()
     flash('You have been logged out', 'info')
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
 
-@app.route('/templates', methods=['GET'])
+@bp.route('/templates', methods=['GET'])
 @login_required
+@conditional_listing('templates')
 def get_templates():
     """Получение списка всех шаблонов пользователя"""
     try:
         templates = db.get_all_templates(user_id=current_user.id)
         return jsonify({'success': True, 'templates': templates})
     except Exception as e:
-        app.logger.error(f"Error getting templates: {e}")
+        current_app.logger.error(f"Error getting templates: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/templates/save', methods=['POST'])
+@bp.route('/templates/save', methods=['POST'])
 @login_required
 def save_template():
     """Сохранение шаблона в библиотеку"""
@@ -705,22 +1076,25 @@ def save_template():
         if not template_file or not name:
             return jsonify({'error': 'Template file and name are required'}), 400
 
-        # Валидация пути для предотвращения Path Traversal
+        # Шаблон сессии из общего хранилища
+        store = get_session_store()
         try:
-            validated_path = validate_file_path(app.config['UPLOAD_FOLDER'], template_file)
-            upload_path = str(validated_path)
-        except ValueError as e:
-            app.logger.warning(f"Path traversal attempt in save_template: {e}")
+            _, original_filename = parse_token(template_file)
+            upload_path = store.get_path(template_file)
+        except InvalidSessionToken as e:
+            current_app.logger.warning(f"Invalid session template token in save_template: {e}")
             return jsonify({'error': 'Invalid file path'}), 400
 
-        if not os.path.exists(upload_path):
+        if not upload_path:
             return jsonify({'error': 'Template file not found'}), 404
 
         # Извлечение переменных из шаблона
-        variables = extract_template_variables(upload_path)
+        variables = store.get_variables(template_file)
+        if variables is None:
+            variables = extract_template_variables(upload_path)
 
         # Генерация уникального ключа для S3
-        s3_key = f"{uuid.uuid4()}_{secure_filename(template_file)}"
+        s3_key = f"{uuid.uuid4()}_{secure_filename(original_filename)}"
 
         # Загрузка в S3
         if not s3_client.upload_file(upload_path, s3_key):
@@ -729,7 +1103,7 @@ def save_template():
         # Сохранение метаданных в БД
         template_id = db.add_template(
             name=name,
-            original_filename=template_file,
+            original_filename=original_filename,
             s3_key=s3_key,
             description=description,
             variables=variables,
@@ -743,11 +1117,11 @@ def save_template():
         })
 
     except Exception as e:
-        app.logger.error(f"Error saving template: {e}")
+        current_app.logger.error(f"Error saving template: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/templates/<int:template_id>', methods=['GET'])
+@bp.route('/templates/<int:template_id>', methods=['GET'])
 @login_required
 def load_template(template_id):
     """Загрузка шаблона из библиотеки"""
@@ -757,31 +1131,42 @@ def load_template(template_id):
         if not template:
             return jsonify({'error': 'Template not found'}), 404
 
-        # Скачиваем файл из S3 во временную папку
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        temp_filename = f"session_{timestamp}_{template['original_filename']}"
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], temp_filename)
-
-        if not s3_client.download_file(template['s3_key'], temp_path):
+        # Шаблон из локального кэша (при промахе — скачивание из S3)
+        cache = get_file_cache()
+        cached_path = cache.fetch(template['s3_key'], s3_client.download_file)
+        if not cached_path:
             return jsonify({'error': 'Failed to load template from storage'}), 500
 
-        # Парсим переменные
-        variables = extract_template_variables(temp_path)
+        # Шаблон сессии для последующего /generate на любом узле
+        session_token = get_session_store().put(
+            cached_path, secure_filename(template['original_filename']) or 'template.docx', keep_source=True
+        )
+
+        # Переменные извлекаются один раз на файл (или заранее при прогреве)
+        variables = cache.get_meta(template['s3_key'], VARIABLES_META)
+        if variables is None:
+            variables = extract_template_variables(cached_path)
+            cache.set_meta(template['s3_key'], VARIABLES_META, variables)
+
+        try:
+            db.record_template_use(template_id)
+        except Exception as e:
+            current_app.logger.warning(f"Failed to record template usage: {e}")
 
         return jsonify({
             'success': True,
-            'template_file': temp_filename,
+            'template_file': session_token,
             'variables': variables,
             'name': template['name'],
             'description': template['description']
         })
 
     except Exception as e:
-        app.logger.error(f"Error loading template: {e}")
+        current_app.logger.error(f"Error loading template: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/templates/<int:template_id>', methods=['DELETE'])
+@bp.route('/templates/<int:template_id>', methods=['DELETE'])
 @login_required
 def delete_template_endpoint(template_id):
     """Удаление шаблона из библиотеки"""
@@ -797,12 +1182,13 @@ def delete_template_endpoint(template_id):
         return jsonify({'success': True, 'message': 'Template deleted successfully'})
 
     except Exception as e:
-        app.logger.error(f"Error deleting template: {e}")
+        current_app.logger.error(f"Error deleting template: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/history', methods=['GET'])
+@bp.route('/history', methods=['GET'])
 @login_required
+@conditional_listing('history')
 def get_history():
     """Получение истории сгенерированных документов пользователя"""
     try:
@@ -810,11 +1196,64 @@ def get_history():
         documents = db.get_all_generated_documents(limit=limit, user_id=current_user.id)
         return jsonify({'success': True, 'documents': documents})
     except Exception as e:
-        app.logger.error(f"Error getting history: {e}")
+        current_app.logger.error(f"Error getting history: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/history/<int:doc_id>/download', methods=['GET'])
+def _encode_history_cursor(cursor):
+    """Курсор keyset-пагинации (created_at, id) → строка для клиента"""
+    if cursor is None:
+        return None
+    created_at, doc_id = cursor
+    return f"{created_at.isoformat()}_{doc_id}"
+
+
+def _decode_history_cursor(value):
+    """Строка курсора → (created_at, id); ValueError при неверном формате"""
+    created_at, _, doc_id = value.rpartition('_')
+    return datetime.fromisoformat(created_at), int(doc_id)
+
+
+def _safe_headline(headline):
+    """ts_headline не экранирует HTML: экранируем всё, кроме собственных <mark>"""
+    escaped = str(escape(headline or ''))
+    return escaped.replace('&lt;mark&gt;', '<mark>').replace('&lt;/mark&gt;', '</mark>')
+
+
+@bp.route('/history/search', methods=['GET'])
+@login_required
+def search_history():
+    """Полнотекстовый поиск по истории с keyset-пагинацией и подсветкой"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'Query parameter q is required'}), 400
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+
+        cursor = None
+        if request.args.get('cursor'):
+            try:
+                cursor = _decode_history_cursor(request.args['cursor'])
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+
+        documents, next_cursor = db.search_generated_documents(
+            query, user_id=current_user.id, limit=limit, cursor=cursor
+        )
+        for document in documents:
+            document['headline'] = _safe_headline(document['headline'])
+
+        return jsonify({
+            'success': True,
+            'documents': documents,
+            'next_cursor': _encode_history_cursor(next_cursor)
+        })
+    except Exception as e:
+        current_app.logger.error(f"Error searching history: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/history/<int:doc_id>/download', methods=['GET'])
 @login_required
 def download_from_history(doc_id):
     """Скачивание документа из истории"""
@@ -824,48 +1263,105 @@ def download_from_history(doc_id):
         if not document:
             return jsonify({'error': 'Document not found'}), 404
 
-        # Скачиваем файл из S3 во временную папку
-        temp_path = os.path.join(app.config['OUTPUT_FOLDER'], document['output_filename'])
+        # Документ истории не меняется: у клиента уже есть копия — S3 не нужен
+        not_modified = s3_not_modified(document['s3_key'], immutable=True)
+        if not_modified is not None:
+            return not_modified
 
-        if not s3_client.download_file(document['s3_key'], temp_path):
+        # Недавний документ — с локального диска, старый — из хранилища (и снова на диск)
+        path = get_document_store().get_path(document['s3_key'])
+        if path is None:
             return jsonify({'error': 'Failed to download from storage'}), 500
 
-        return send_file(
-            temp_path,
-            as_attachment=True,
+        response = send_download(
+            path,
+            'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
             download_name=document['output_filename'],
-            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+            as_attachment=True,
+            conditional=False,
+            etag=False
         )
+        return s3_cache_headers(response, document['s3_key'], immutable=True)
 
     except Exception as e:
-        app.logger.error(f"Error downloading from history: {e}")
+        current_app.logger.error(f"Error downloading from history: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/history/<int:doc_id>/data', methods=['GET'])
+@bp.route('/history/<int:doc_id>/data', methods=['GET'])
 @login_required
 def get_history_data(doc_id):
     """Получение JSON данных документа из истории"""
     try:
-        document = db.get_generated_document(doc_id, user_id=current_user.id)
+        # json_data отдаётся в том виде, в каком хранится: только проверяется, без повторной сериализации
+        document = db.get_generated_document(doc_id, user_id=current_user.id, parse_json=False)
 
         if not document:
             return jsonify({'error': 'Document not found'}), 404
 
-        return jsonify({
+        # Старые записи могут хранить не-JSON текст: он не вставляется в ответ (json_data_error)
+        body = serialization.iter_object({
             'success': True,
             'template_name': document['template_name'],
             'output_filename': document['output_filename'],
-            'json_data': document.get('json_data', {}),
-            'created_at': document['created_at']
-        })
+            'created_at': http_date(document['created_at']),
+        }, {'json_data': document.get('json_data')}, validate=True)
+        return current_app.response_class(body, mimetype='application/json')
 
     except Exception as e:
-        app.logger.error(f"Error getting document data: {e}")
+        current_app.logger.error(f"Error getting document data: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/history/<int:doc_id>', methods=['DELETE'])
+@bp.route('/history/<int:doc_id>/regenerate', methods=['POST'])
+@login_required
+@render_admission
+def regenerate_from_history(doc_id):
+    """
+    Перегенерация документа из истории с изменёнными данными.
+
+    Тело — JSON Patch (RFC 6902) к сохранённому json_data: массив операций
+    или {"patch": [...]}. Шаблон и выбор фрагментов берутся из записи истории.
+    ?preview=1 — HTML-превью без сохранения.
+    """
+    try:
+        document = db.get_generated_document(doc_id, user_id=current_user.id)
+        if not document:
+            return jsonify({'error': 'Document not found'}), 404
+        if not document.get('template_hash'):
+            return jsonify({'error': 'Document was generated before templates were tracked, use /generate'}), 409
+
+        body = request.get_json(force=True, silent=True)
+        patch = body.get('patch') if isinstance(body, dict) else body
+        try:
+            context = json_patch.apply_patch(document.get('json_data') or {}, patch)
+        except json_patch.JsonPatchTestFailed as e:
+            return jsonify({'error': str(e)}), 409
+        except json_patch.JsonPatchError as e:
+            return jsonify({'error': f'Invalid patch: {str(e)}'}), 400
+        if not isinstance(context, dict):
+            return jsonify({'error': 'Invalid patch: context must remain a JSON object'}), 400
+
+        filename = document['template_name']
+        try:
+            upload_path = get_session_store().get_path(make_token(document['template_hash'], filename))
+        except InvalidSessionToken:
+            upload_path = None
+        if not upload_path:
+            return jsonify({'error': 'Template of this document is no longer available'}), 410
+
+        return _render_document(
+            upload_path, filename, context, serialization.dumps(context),
+            document.get('snippet_selection') or {}, document['template_hash'],
+            preview=request.args.get('preview') in ('1', 'true')
+        )
+
+    except Exception as e:
+        current_app.logger.error(f"Error regenerating document: {e}")
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+
+@bp.route('/history/<int:doc_id>', methods=['DELETE'])
 @login_required
 def delete_from_history(doc_id):
     """Удаление документа из истории"""
@@ -875,38 +1371,39 @@ def delete_from_history(doc_id):
         if not s3_key:
             return jsonify({'error': 'Document not found'}), 404
 
-        # Удаляем файл из S3
-        s3_client.delete_file(s3_key)
+        # Удаляем файл из хранилища и с горячего уровня
+        get_document_store().delete(s3_key)
 
         return jsonify({'success': True, 'message': 'Document deleted successfully'})
 
     except Exception as e:
-        app.logger.error(f"Error deleting from history: {e}")
+        current_app.logger.error(f"Error deleting from history: {e}")
         return jsonify({'error': str(e)}), 500
 
 
 # ===== Endpoints справочников (snippets) =====
 
-@app.route('/snippets')
+@bp.route('/snippets')
 @login_required
 def snippets_page():
     """Страница управления справочниками"""
     return render_template('snippets.html')
 
 
-@app.route('/snippets/categories', methods=['GET'])
+@bp.route('/snippets/categories', methods=['GET'])
 @login_required
+@conditional_listing('snippets')
 def get_snippet_categories():
     """Получение списка категорий справочников"""
     try:
         categories = db.get_snippet_categories(user_id=current_user.id)
         return jsonify({'success': True, 'categories': categories})
     except Exception as e:
-        app.logger.error(f"Error getting snippet categories: {e}")
+        current_app.logger.error(f"Error getting snippet categories: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/snippets/categories', methods=['POST'])
+@bp.route('/snippets/categories', methods=['POST'])
 @login_required
 def create_snippet_category():
     """Создание категории справочника"""
@@ -925,11 +1422,11 @@ def create_snippet_category():
         )
         return jsonify({'success': True, 'category_id': cat_id})
     except Exception as e:
-        app.logger.error(f"Error creating snippet category: {e}")
+        current_app.logger.error(f"Error creating snippet category: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/snippets/categories/<int:cat_id>', methods=['PUT'])
+@bp.route('/snippets/categories/<int:cat_id>', methods=['PUT'])
 @login_required
 def update_snippet_category_endpoint(cat_id):
     """Обновление категории справочника"""
@@ -945,11 +1442,11 @@ def update_snippet_category_endpoint(cat_id):
             return jsonify({'success': True})
         return jsonify({'error': 'Category not found'}), 404
     except Exception as e:
-        app.logger.error(f"Error updating snippet category: {e}")
+        current_app.logger.error(f"Error updating snippet category: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/snippets/categories/<int:cat_id>', methods=['DELETE'])
+@bp.route('/snippets/categories/<int:cat_id>', methods=['DELETE'])
 @login_required
 def delete_snippet_category_endpoint(cat_id):
     """Удаление категории справочника (каскадно удаляет фрагменты)"""
@@ -962,35 +1459,37 @@ def delete_snippet_category_endpoint(cat_id):
             s3_client.delete_file(key)
         return jsonify({'success': True})
     except Exception as e:
-        app.logger.error(f"Error deleting snippet category: {e}")
+        current_app.logger.error(f"Error deleting snippet category: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/snippets/categories/<int:cat_id>/items', methods=['GET'])
+@bp.route('/snippets/categories/<int:cat_id>/items', methods=['GET'])
 @login_required
+@conditional_listing('snippets')
 def get_snippets_in_category(cat_id):
     """Получение фрагментов в категории"""
     try:
         items = db.get_snippets_by_category(cat_id, user_id=current_user.id)
         return jsonify({'success': True, 'items': items})
     except Exception as e:
-        app.logger.error(f"Error getting snippets: {e}")
+        current_app.logger.error(f"Error getting snippets: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/snippets/items', methods=['GET'])
+@bp.route('/snippets/items', methods=['GET'])
 @login_required
+@conditional_listing('snippets')
 def get_all_snippets():
     """Получение всех фрагментов пользователя (для dropdown при генерации)"""
     try:
         grouped = db.get_all_snippets_grouped(user_id=current_user.id)
         return jsonify({'success': True, 'snippets': grouped})
     except Exception as e:
-        app.logger.error(f"Error getting all snippets: {e}")
+        current_app.logger.error(f"Error getting all snippets: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/snippets/items', methods=['POST'])
+@bp.route('/snippets/items', methods=['POST'])
 @login_required
 def create_snippet():
     """Создание фрагмента (загрузка DOCX файла)"""
@@ -1023,7 +1522,7 @@ def create_snippet():
         # Сохранение во временную папку
         filename = secure_filename(file.filename)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"snippet_{timestamp}_{filename}")
+        temp_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f"snippet_{timestamp}_{filename}")
         file.save(temp_path)
 
         try:
@@ -1040,7 +1539,8 @@ def create_snippet():
                 original_filename=filename,
                 user_id=current_user.id,
                 description=description,
-                file_size=file_size
+                file_size=file_size,
+                content_text=extract_snippet_text(temp_path)
             )
             return jsonify({'success': True, 'snippet_id': snippet_id})
         finally:
@@ -1048,14 +1548,16 @@ def create_snippet():
                 os.remove(temp_path)
 
     except Exception as e:
-        app.logger.error(f"Error creating snippet: {e}")
+        current_app.logger.error(f"Error creating snippet: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/snippets/items/from-form', methods=['POST'])
+@bp.route('/snippets/items/from-form', methods=['POST'])
 @login_required
 def create_snippet_from_form():
     """Создание фрагмента из формы (генерирует DOCX таблицу)"""
+    from docx import Document
+
     try:
         data = request.get_json()
         name = data.get('name', '').strip()
@@ -1082,7 +1584,7 @@ def create_snippet_from_form():
         # Сохранение во временную папку
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"form_{timestamp}.docx"
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        temp_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         doc.save(temp_path)
 
         try:
@@ -1092,6 +1594,10 @@ def create_snippet_from_form():
             if not s3_client.upload_file(temp_path, s3_key):
                 return jsonify({'error': 'Failed to upload to storage'}), 500
 
+            # Текст для поиска — прямо из полей формы
+            content_text = '\n'.join(
+                f"{field.get('key', '')} {field.get('value', '')}".strip() for field in fields
+            )
             snippet_id = db.create_snippet(
                 category_id=category_id,
                 name=name,
@@ -1099,7 +1605,8 @@ def create_snippet_from_form():
                 original_filename=filename,
                 user_id=current_user.id,
                 description=description,
-                file_size=file_size
+                file_size=file_size,
+                content_text=content_text
             )
             return jsonify({'success': True, 'snippet_id': snippet_id})
         finally:
@@ -1107,11 +1614,28 @@ def create_snippet_from_form():
                 os.remove(temp_path)
 
     except Exception as e:
-        app.logger.error(f"Error creating snippet from form: {e}")
+        current_app.logger.error(f"Error creating snippet from form: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/snippets/search', methods=['GET'])
+@login_required
+def search_snippets():
+    """Поиск фрагментов по названию и тексту во всех категориях (type-ahead)"""
+    try:
+        query = request.args.get('q', '')
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 50)
+        items = db.search_snippets(current_user.id, query, limit=limit)
+        for item in items:
+            item.pop('rank', None)
+            item['headline'] = _safe_headline(item['headline']) if item['headline'] else None
+        return jsonify({'success': True, 'snippets': items})
+    except Exception as e:
+        current_app.logger.error(f"Error searching snippets: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/snippets/items/<int:snippet_id>/preview', methods=['GET'])
+@bp.route('/snippets/items/<int:snippet_id>/preview', methods=['GET'])
 @login_required
 def preview_snippet(snippet_id):
     """HTML-превью содержимого фрагмента"""
@@ -1120,70 +1644,26 @@ def preview_snippet(snippet_id):
         if not snippet:
             return jsonify({'error': 'Snippet not found'}), 404
 
-        # Скачиваем из S3
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"preview_{uuid.uuid4()}.docx")
-        if not s3_client.download_file(snippet['s3_key'], temp_path):
+        # Фрагмент из локального кэша (при промахе — скачивание из S3)
+        snippet_path = get_file_cache().fetch(snippet['s3_key'], s3_client.download_file)
+        if not snippet_path:
             return jsonify({'error': 'Failed to download from storage'}), 500
 
-        try:
-            from docx.oxml.ns import qn
-            from html import escape as html_escape
-
-            doc = Document(temp_path)
-            html_parts = []
-
-            for element in doc.element.body:
-                tag = element.tag.split('}')[-1] if '}' in element.tag else element.tag
-
-                if tag == 'p':
-                    # Параграф
-                    texts = []
-                    for run in element.findall(qn('w:r')):
-                        t = run.find(qn('w:t'))
-                        if t is not None and t.text:
-                            # Проверяем форматирование
-                            rpr = run.find(qn('w:rPr'))
-                            text = html_escape(t.text)
-                            if rpr is not None:
-                                if rpr.find(qn('w:b')) is not None:
-                                    text = f'<strong>{text}</strong>'
-                                if rpr.find(qn('w:i')) is not None:
-                                    text = f'<em>{text}</em>'
-                            texts.append(text)
-                    if texts:
-                        html_parts.append(f'<p>{"".join(texts)}</p>')
-
-                elif tag == 'tbl':
-                    # Таблица
-                    html_parts.append('<table class="table table-bordered table-sm">')
-                    for tr in element.findall(qn('w:tr')):
-                        html_parts.append('<tr>')
-                        for tc in tr.findall(qn('w:tc')):
-                            cell_texts = []
-                            for p in tc.findall(qn('w:p')):
-                                for run in p.findall(qn('w:r')):
-                                    t = run.find(qn('w:t'))
-                                    if t is not None and t.text:
-                                        cell_texts.append(html_escape(t.text))
-                            html_parts.append(f'<td>{" ".join(cell_texts)}</td>')
-                        html_parts.append('</tr>')
-                    html_parts.append('</table>')
+        from docx import Document
+        from preview import document_to_html
 
-            return jsonify({
-                'success': True,
-                'html': '\n'.join(html_parts),
-                'name': snippet['name']
-            })
-        finally:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+        return jsonify({
+            'success': True,
+            'html': document_to_html(Document(snippet_path)),
+            'name': snippet['name']
+        })
 
     except Exception as e:
-        app.logger.error(f"Error previewing snippet: {e}")
+        current_app.logger.error(f"Error previewing snippet: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/snippets/items/<int:snippet_id>/download', methods=['GET'])
+@bp.route('/snippets/items/<int:snippet_id>/download', methods=['GET'])
 @login_required
 def download_snippet(snippet_id):
     """Скачивание оригинального DOCX фрагмента"""
@@ -1192,7 +1672,20 @@ def download_snippet(snippet_id):
         if not snippet:
             return jsonify({'error': 'Snippet not found'}), 404
 
-        temp_path = os.path.join(app.config['OUTPUT_FOLDER'], f"dl_{uuid.uuid4()}.docx")
+        # ETag по s3_key: при замене файла ключ меняется
+        not_modified = s3_not_modified(snippet['s3_key'])
+        if not_modified is not None:
+            return not_modified
+
+        # Через nginx: файл не скачивается в приложение
+        offloaded = send_stored_object(
+            snippet['s3_key'], 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+            download_name=snippet['original_filename']
+        )
+        if offloaded is not None:
+            return s3_cache_headers(offloaded, snippet['s3_key'])
+
+        temp_path = os.path.join(current_app.config['OUTPUT_FOLDER'], f"dl_{uuid.uuid4()}.docx")
         if not s3_client.download_file(snippet['s3_key'], temp_path):
             return jsonify({'error': 'Failed to download from storage'}), 500
 
@@ -1204,18 +1697,21 @@ def download_snippet(snippet_id):
                 pass
             return response
 
-        return send_file(
+        response = send_file(
             temp_path,
             as_attachment=True,
             download_name=snippet['original_filename'],
-            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+            conditional=False,
+            etag=False
         )
+        return s3_cache_headers(response, snippet['s3_key'])
     except Exception as e:
-        app.logger.error(f"Error downloading snippet: {e}")
+        current_app.logger.error(f"Error downloading snippet: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/snippets/items/<int:snippet_id>', methods=['PUT'])
+@bp.route('/snippets/items/<int:snippet_id>', methods=['PUT'])
 @login_required
 def update_snippet_endpoint(snippet_id):
     """Обновление фрагмента (метаданные или замена файла)"""
@@ -1226,6 +1722,7 @@ def update_snippet_endpoint(snippet_id):
         new_s3_key = None
         new_filename = None
         new_file_size = None
+        new_content_text = None
 
         # Если есть новый файл
         if 'file' in request.files:
@@ -1238,7 +1735,7 @@ def update_snippet_endpoint(snippet_id):
 
                 new_filename = secure_filename(file.filename)
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"snippet_{timestamp}_{new_filename}")
+                temp_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f"snippet_{timestamp}_{new_filename}")
                 file.save(temp_path)
 
                 try:
@@ -1246,6 +1743,7 @@ def update_snippet_endpoint(snippet_id):
                     new_s3_key = f"snippets/{uuid.uuid4()}_{new_filename}"
                     if not s3_client.upload_file(temp_path, new_s3_key):
                         return jsonify({'error': 'Failed to upload to storage'}), 500
+                    new_content_text = extract_snippet_text(temp_path)
                 finally:
                     if os.path.exists(temp_path):
                         os.remove(temp_path)
@@ -1257,7 +1755,8 @@ def update_snippet_endpoint(snippet_id):
             description=description,
             s3_key=new_s3_key,
             original_filename=new_filename,
-            file_size=new_file_size
+            file_size=new_file_size,
+            content_text=new_content_text
         )
 
         # Удаляем старый файл из S3 если был заменён
@@ -1266,11 +1765,11 @@ def update_snippet_endpoint(snippet_id):
 
         return jsonify({'success': True})
     except Exception as e:
-        app.logger.error(f"Error updating snippet: {e}")
+        current_app.logger.error(f"Error updating snippet: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/snippets/items/<int:snippet_id>', methods=['DELETE'])
+@bp.route('/snippets/items/<int:snippet_id>', methods=['DELETE'])
 @login_required
 def delete_snippet_endpoint(snippet_id):
     """Удаление фрагмента"""
@@ -1281,9 +1780,133 @@ def delete_snippet_endpoint(snippet_id):
         s3_client.delete_file(s3_key)
         return jsonify({'success': True})
     except Exception as e:
-        app.logger.error(f"Error deleting snippet: {e}")
+        current_app.logger.error(f"Error deleting snippet: {e}")
         return jsonify({'error': str(e)}), 500
 
 
+# ===== Endpoints изображений =====
+
+@bp.route('/images', methods=['GET'])
+@login_required
+def get_images():
+    """Изображения пользователя для ссылок {"$image": id} в контексте"""
+    try:
+        images = db.get_images(current_user.id)
+        return jsonify({'success': True, 'images': images})
+    except Exception as e:
+        current_app.logger.error(f"Error getting images: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/images', methods=['POST'])
+@login_required
+def upload_image():
+    """Загрузка изображения (PNG, JPEG, GIF): хранится в S3 по хешу содержимого"""
+    import media
+
+    try:
+        if 'file' not in request.files:
+            return jsonify({'error': 'No file provided'}), 400
+
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+
+        temp_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f"image_{uuid.uuid4().hex}")
+        file.save(temp_path)
+        try:
+            file_size = os.path.getsize(temp_path)
+            if file_size > current_app.config['IMAGE_MAX_MB'] * 1024 * 1024:
+                return jsonify({'error': f"Image is too large (max {current_app.config['IMAGE_MAX_MB']} MB)"}), 413
+
+            try:
+                info = media.inspect_image(temp_path, current_app.config['IMAGE_MAX_PIXELS'])
+            except media.InvalidImage as e:
+                return jsonify({'error': str(e)}), 400
+
+            digest = hashlib.sha256()
+            with open(temp_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            content_hash = digest.hexdigest()
+            s3_key = f"images/{content_hash}{info['extension']}"
+
+            if not s3_client.upload_file(temp_path, s3_key):
+                return jsonify({'error': 'Failed to upload to storage'}), 500
+
+            name = request.form.get('name', '').strip() or secure_filename(file.filename) or s3_key
+            image_id = db.add_image(
+                user_id=current_user.id,
+                name=name,
+                s3_key=s3_key,
+                content_hash=content_hash,
+                content_type=info['content_type'],
+                width=info['width'],
+                height=info['height'],
+                file_size=file_size
+            )
+            # Оригинал сразу в локальный кэш: первая генерация не скачивает его из S3
+            get_file_cache().put(s3_key, temp_path)
+            return jsonify({
+                'success': True,
+                'image_id': image_id,
+                'width': info['width'],
+                'height': info['height'],
+                'reference': {media.IMAGE_REF_KEY: image_id},
+            })
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    except Exception as e:
+        current_app.logger.error(f"Error uploading image: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/images/<int:image_id>', methods=['GET'])
+@login_required
+def get_image_file(image_id):
+    """Оригинал изображения (ключ адресует содержимое — кэшируется навсегда)"""
+    try:
+        image = db.get_image(image_id, user_id=current_user.id)
+        if not image:
+            return jsonify({'error': 'Image not found'}), 404
+
+        not_modified = s3_not_modified(image['s3_key'], immutable=True)
+        if not_modified is not None:
+            return not_modified
+
+        path = get_file_cache().fetch(image['s3_key'], s3_client.download_file)
+        if not path:
+            return jsonify({'error': 'Failed to download from storage'}), 500
+
+        response = send_download(path, image['content_type'], conditional=False, etag=False)
+        return s3_cache_headers(response, image['s3_key'], immutable=True)
+    except Exception as e:
+        current_app.logger.error(f"Error getting image: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/images/<int:image_id>', methods=['DELETE'])
+@login_required
+def delete_image_endpoint(image_id):
+    """Удаление изображения (объект S3 — если на него больше никто не ссылается)"""
+    try:
+        found, s3_key = db.delete_image(image_id, user_id=current_user.id)
+        if not found:
+            return jsonify({'error': 'Image not found'}), 404
+        if s3_key:
+            s3_client.delete_file(s3_key)
+        return jsonify({'success': True})
+    except Exception as e:
+        current_app.logger.error(f"Error deleting image: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+# Экземпляр для gunicorn (app:app) и flask CLI — создание без сетевых вызовов
+app = create_app()
+
+
 if __name__ == '__main__':
+    warmup.start(app)
     app.run(debug=True, host='127.0.0.1', port=5001)
@@ -0,0 +1,334 @@
+"""
+Офлайн массовая генерация документов без Flask, БД и S3.
+
+Контексты читаются потоково из JSONL или CSV (по одной записи на документ),
+рендеринг идёт на всех ядрах, результат пишется в директорию или ZIP.
+После прерывания запуск с теми же аргументами продолжает с контрольной точки.
+
+Использование:
+    python batch_generate.py шаблон.docx contexts.jsonl -o out/
+    python batch_generate.py шаблон.docx contexts.csv -o out.zip --name-pattern "{index:06d}_{фамилия}.docx"
+
+Фрагменты (SNIPPET-метки):
+    --snippet terms=clauses/terms.docx      — фрагмент по умолчанию для метки
+    "__snippets__": {"terms": "vip.docx"}   — выбор в записи (путь относительно --snippets-dir),
+                                              null — удалить метку
+"""
+import os
+import re
+import sys
+import csv
+import json
+import shutil
+import hashlib
+import argparse
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from docx import Document
+from rendering import render_document, apply_snippets
+
+SNIPPETS_KEY = '__snippets__'
+UNSAFE_FILENAME_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+# Состояние процесса-воркера (заполняется в _init_worker)
+_worker_template = None
+_worker_snippets_dir = None
+_worker_snippet_cache = {}
+
+
+def iter_jsonl(path):
+    """Потоковое чтение JSONL: одна запись — одна строка"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield {'__error__': f'Invalid JSON at line {line_number}: {e}'}
+
+
+def unflatten_row(row):
+    """CSV-колонки вида client.name превращаются во вложенные объекты"""
+    result = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        target = result
+        parts = key.split('.')
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return result
+
+
+def iter_csv(path, delimiter=','):
+    """Потоковое чтение CSV с заголовком"""
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        for row in csv.DictReader(f, delimiter=delimiter):
+            context = unflatten_row(row)
+            snippets = context.get(SNIPPETS_KEY)
+            if isinstance(snippets, str) and snippets:
+                context[SNIPPETS_KEY] = json.loads(snippets)
+            yield context
+
+
+def iter_contexts(path, input_format, delimiter=','):
+    """Итератор контекстов в зависимости от формата входа"""
+    if input_format == 'csv':
+        return iter_csv(path, delimiter)
+    return iter_jsonl(path)
+
+
+def output_name(pattern, index, context):
+    """Имя выходного файла по шаблону (поля записи + index)"""
+    values = {k: v for k, v in context.items() if isinstance(v, (str, int, float))}
+    values['index'] = index
+    try:
+        name = pattern.format_map(values)
+    except (KeyError, ValueError, IndexError):
+        name = f"{index:06d}.docx"
+    name = UNSAFE_FILENAME_CHARS.sub('_', name).strip() or f"{index:06d}.docx"
+    if not name.lower().endswith('.docx'):
+        name += '.docx'
+    return name
+
+
+def unique_name(name, index, used):
+    """
+    Имя, не занятое предыдущими записями: при совпадении (например, одинаковая
+    фамилия в шаблоне имени) к нему добавляется index. Регистр не учитывается —
+    как в файловых системах Windows/macOS.
+    """
+    if name.lower() in used:
+        base, ext = os.path.splitext(name)
+        name = f"{base}_{index:06d}{ext}"
+    used.add(name.lower())
+    return name
+
+
+def _init_worker(template_path, snippets_dir):
+    """Шаблон читается один раз на процесс"""
+    global _worker_template, _worker_snippets_dir
+    with open(template_path, 'rb') as f:
+        _worker_template = f.read()
+    _worker_snippets_dir = snippets_dir
+
+
+def _snippet_document(path):
+    """Фрагменты парсятся один раз на процесс (вставка делает deepcopy)"""
+    if _worker_snippets_dir and not os.path.isabs(path):
+        path = os.path.join(_worker_snippets_dir, path)
+    if path not in _worker_snippet_cache:
+        _worker_snippet_cache[path] = Document(path)
+    return _worker_snippet_cache[path]
+
+
+def render_job(index, context, default_snippets):
+    """
+    Рендеринг одного документа в процессе пула.
+
+    Returns:
+        tuple: (index, байты DOCX или None, текст ошибки или None)
+    """
+    if '__error__' in context:
+        return index, None, context['__error__']
+    try:
+        context = dict(context)
+        selection = dict(default_snippets)
+        selection.update(context.pop(SNIPPETS_KEY, None) or {})
+
+        doc = render_document(BytesIO(_worker_template), context)
+        snippets = {
+            marker: (_snippet_document(path) if path else None)
+            for marker, path in selection.items()
+        }
+        apply_snippets(doc.docx, snippets)
+
+        output = BytesIO()
+        doc.save(output)
+        return index, output.getvalue(), None
+    except Exception as e:
+        return index, None, f"{type(e).__name__}: {e}"
+
+
+def template_fingerprint(template_path, input_path):
+    """Идентификатор запуска: контрольная точка валидна только для той же пары шаблон/вход"""
+    digest = hashlib.sha256()
+    with open(template_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    digest.update(os.path.abspath(input_path).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load_checkpoint(path, fingerprint):
+    """
+    Состояние из контрольной точки.
+
+    Returns:
+        tuple: (номер первой необработанной записи, число ошибок до неё)
+    """
+    if not os.path.exists(path):
+        return 0, 0
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return 0, 0
+    if state.get('fingerprint') != fingerprint:
+        return 0, 0
+    return int(state.get('next_index', 0)), int(state.get('errors', 0))
+
+
+def save_checkpoint(path, fingerprint, next_index, errors):
+    """Атомарная запись контрольной точки"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'fingerprint': fingerprint, 'next_index': next_index, 'errors': errors}, f)
+    os.replace(temp_path, path)
+
+
+def write_output(directory, name, data):
+    """Атомарная запись документа (частично записанный файл не появится под итоговым именем)"""
+    path = os.path.join(directory, name)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def pack_zip(staging_dir, zip_path):
+    """
+    Упаковка готовых документов в ZIP потоково с диска.
+    DOCX уже сжат, поэтому используется ZIP_STORED.
+    """
+    temp_path = f"{zip_path}.tmp"
+    with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for name in sorted(os.listdir(staging_dir)):
+            if name.endswith('.docx'):
+                zf.write(os.path.join(staging_dir, name), arcname=name)
+    os.replace(temp_path, zip_path)
+
+
+def parse_snippet_args(values):
+    """--snippet marker=path → {marker: path}"""
+    snippets = {}
+    for value in values or []:
+        marker, _, path = value.partition('=')
+        if not marker or not path:
+            raise argparse.ArgumentTypeError(f"Expected marker=path, got: {value}")
+        snippets[marker.strip()] = path.strip()
+    return snippets
+
+
+def run(args):
+    """Основной цикл: потоковое чтение → пул процессов → запись по порядку"""
+    input_format = args.format or ('csv' if args.input.lower().endswith('.csv') else 'jsonl')
+    to_zip = args.output.lower().endswith('.zip')
+    output_dir = f"{args.output}.parts" if to_zip else args.output
+    os.makedirs(output_dir, exist_ok=True)
+
+    checkpoint_path = args.checkpoint or os.path.join(output_dir, '.checkpoint.json')
+    errors_path = os.path.join(output_dir, 'errors.jsonl')
+    fingerprint = template_fingerprint(args.template, args.input)
+    start_index, errors = (0, 0) if args.restart else load_checkpoint(checkpoint_path, fingerprint)
+    default_snippets = parse_snippet_args(args.snippet)
+
+    if start_index:
+        print(f"Продолжение с записи {start_index} (контрольная точка {checkpoint_path})")
+
+    jobs = args.jobs or os.cpu_count() or 1
+    window = max(jobs * 4, 1)
+    next_index = start_index
+    written = 0
+    used_names = set()
+
+    # Новый запуск (--restart, другой шаблон или вход) начинает журнал ошибок заново
+    errors_mode = 'a' if start_index else 'w'
+    with open(errors_path, errors_mode, encoding='utf-8') as errors_file, \
+            ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                initargs=(args.template, args.snippets_dir)) as executor:
+        pending = deque()
+
+        def drain_one():
+            # Результаты забираются строго по порядку — контрольная точка
+            # всегда означает "все записи до next_index обработаны"
+            nonlocal next_index, written, errors
+            index, name, future = pending.popleft()
+            _, data, error = future.result()
+            if error:
+                errors += 1
+                errors_file.write(json.dumps({'index': index, 'error': error}, ensure_ascii=False) + '\n')
+            else:
+                write_output(output_dir, name, data)
+                written += 1
+            next_index = index + 1
+            if next_index % args.checkpoint_every == 0:
+                errors_file.flush()
+                save_checkpoint(checkpoint_path, fingerprint, next_index, errors)
+                print(f"  обработано записей: {next_index}")
+
+        for index, context in enumerate(iter_contexts(args.input, input_format, args.delimiter)):
+            # Имена уже обработанных записей тоже регистрируются: после продолжения
+            # новые документы не перезапишут готовые
+            name = unique_name(output_name(args.name_pattern, index, context), index, used_names)
+            if index < start_index:
+                continue
+            pending.append((index, name, executor.submit(render_job, index, context, default_snippets)))
+            # Ограниченное окно: вход никогда не читается целиком в память
+            if len(pending) >= window:
+                drain_one()
+
+        while pending:
+            drain_one()
+
+    save_checkpoint(checkpoint_path, fingerprint, next_index, errors)
+
+    if to_zip:
+        pack_zip(output_dir, args.output)
+        if not errors:
+            shutil.rmtree(output_dir)
+
+    print(f"✓ Готово: документов {written}, ошибок {errors}, результат: {args.output}")
+    if errors:
+        print(f"  Ошибки записаны в {errors_path}")
+    return 1 if errors else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Массовая генерация DOCX из шаблона и потока контекстов")
+    parser.add_argument('template', help='DOCX шаблон (Jinja2)')
+    parser.add_argument('input', help='Файл контекстов: .jsonl или .csv')
+    parser.add_argument('-o', '--output', required=True,
+                        help='Директория результата или путь к .zip')
+    parser.add_argument('--format', choices=['jsonl', 'csv'],
+                        help='Формат входа (по умолчанию — по расширению)')
+    parser.add_argument('--delimiter', default=',', help='Разделитель CSV')
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+                        help='Число процессов (по умолчанию — число ядер)')
+    parser.add_argument('--name-pattern', default='{index:06d}.docx',
+                        help='Шаблон имени файла, например "{index:06d}_{фамилия}.docx"')
+    parser.add_argument('--snippet', action='append',
+                        help='Фрагмент по умолчанию: метка=путь.docx (можно несколько)')
+    parser.add_argument('--snippets-dir', default=None,
+                        help='Базовая директория для путей фрагментов из записей')
+    parser.add_argument('--checkpoint', default=None,
+                        help='Файл контрольной точки (по умолчанию в директории результата)')
+    parser.add_argument('--checkpoint-every', type=int, default=100,
+                        help='Как часто сохранять контрольную точку (в записях)')
+    parser.add_argument('--restart', action='store_true',
+                        help='Игнорировать контрольную точку и начать заново')
+    args = parser.parse_args(argv)
+
+    if args.checkpoint_every < 1:
+        parser.error('--checkpoint-every must be positive')
+
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
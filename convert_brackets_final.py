@@ -4,11 +4,25 @@
 - Замена пробелов на подчеркивания
 - Замена дефисов на подчеркивания (Jinja2 не поддерживает дефисы)
 - Очистка множественных подчеркиваний
+
+Работает напрямую с XML частей пакета (тело, колонтитулы, текстовые поля)
+на уровне run'ов, поэтому форматирование (жирный, курсив и т.д.) сохраняется.
+
+Использование:
+    python convert_brackets_final.py partners/ "incoming/**/*.docx" -j 8
+Повторный запуск пропускает файлы, хеш которых не изменился (манифест).
 """
 import re
-from docx import Document
 import os
+import sys
+import glob
 import json
+import hashlib
+import argparse
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+from lxml import etree
 
 
 def normalize_variable_name(name):
@@ -27,57 +41,183 @@ def normalize_variable_name(name):
     return normalized
 
 
-def process_paragraph(paragraph):
-    """Обработка параграфа - замена {var} на {{var}} и нормализация имен"""
-    full_text = paragraph.text
+# Паттерн: {слово} но НЕ {{слово}}, НЕ }} и НЕ Jinja2-теги {% ... %} / {# ... #}
+SINGLE_BRACE_PATTERN = re.compile(r'(?<!\{)\{(?![%#])([^{}]+)\}(?!\})')
 
-    # Паттерн: {слово} но НЕ {{слово}} и НЕ }}
-    pattern = r'(?<!\{)\{([^{}]+)\}(?!\})'
+# Уже существующие Jinja2-конструкции: скобки внутри них (литералы словарей
+# в {% set %}, выражения в {{ }}) не являются старыми метками
+JINJA_SPAN_PATTERN = re.compile(r'\{\{.*?\}\}|\{%.*?%\}|\{#.*?#\}', re.DOTALL)
 
-    # Проверяем, есть ли что заменять
-    if not re.search(pattern, full_text):
-        return False, {}
+# Части пакета, в которых встречаются метки: тело, колонтитулы.
+# Текстовые поля (w:txbxContent) лежат внутри этих же частей.
+CONVERTIBLE_PARTS = re.compile(r'^word/(document|header\d*|footer\d*)\.xml$')
 
-    # Словарь для отслеживания замен
-    replacements = {}
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+W_P = f'{{{W_NS}}}p'
+W_T = f'{{{W_NS}}}t'
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+
+# Парсер без разрешения внешних сущностей (защита от XXE)
+_XML_PARSER = etree.XMLParser(resolve_entities=False, no_network=True, huge_tree=False)
+
+
+def _iter_text_nodes(element):
+    """
+    Обход w:t узлов параграфа в порядке документа.
+    Вложенные параграфы (текстовые поля внутри w:drawing/w:pict)
+    пропускаются — они обрабатываются как самостоятельные параграфы.
+    """
+    for child in element:
+        if child.tag == W_T:
+            yield child
+        elif child.tag != W_P:
+            yield from _iter_text_nodes(child)
+
+
+def _replace_span(nodes, offsets, start, end, replacement):
+    """
+    Замена диапазона [start, end) склеенного текста параграфа.
+    Новый текст попадает в run, где начиналась метка (сохраняет его
+    форматирование), из остальных run'ов удаляются только символы метки.
+    """
+    for node, offset in zip(nodes, offsets):
+        text = node.text or ''
+        node_end = offset + len(text)
+        if node_end <= start or offset >= end:
+            continue
+
+        local_start = max(start - offset, 0)
+        local_end = min(end - offset, len(text))
+
+        if offset <= start:
+            node.text = text[:local_start] + replacement + text[local_end:]
+        else:
+            node.text = text[local_end:]
+        node.set(XML_SPACE, 'preserve')
+
+
+def convert_paragraph_element(paragraph, replacements):
+    """
+    Конвертация одного w:p: {var} → {{var}} с нормализацией имени.
+    Работает на уровне run'ов, форматирование не теряется.
+
+    Returns:
+        bool: True если параграф изменён
+    """
+    nodes = list(_iter_text_nodes(paragraph))
+    if not nodes:
+        return False
+
+    offsets = []
+    parts = []
+    position = 0
+    for node in nodes:
+        text = node.text or ''
+        offsets.append(position)
+        parts.append(text)
+        position += len(text)
+    full_text = ''.join(parts)
+
+    jinja_spans = [match.span() for match in JINJA_SPAN_PATTERN.finditer(full_text)]
+    matches = [
+        match for match in SINGLE_BRACE_PATTERN.finditer(full_text)
+        if not any(start < match.end() and match.start() < end for start, end in jinja_spans)
+    ]
+    if not matches:
+        return False
 
-    def replace_func(match):
-        """Функция замены с нормализацией"""
+    # Справа налево: смещения левее текущей замены остаются валидными
+    for match in reversed(matches):
         original_name = match.group(1)
         normalized_name = normalize_variable_name(original_name)
         replacements[original_name] = normalized_name
-        return '{{' + normalized_name + '}}'
+        _replace_span(nodes, offsets, match.start(), match.end(),
+                      '{{' + normalized_name + '}}')
 
-    # Заменяем одинарные скобки на двойные с нормализацией
-    new_text = re.sub(pattern, replace_func, full_text)
+    return True
 
-    # Очищаем все runs в параграфе
-    for run in paragraph.runs:
-        run.text = ''
 
-    # Добавляем новый текст в первый run (или создаем новый)
-    if paragraph.runs:
-        paragraph.runs[0].text = new_text
-    else:
-        paragraph.add_run(new_text)
+def convert_part_xml(xml_bytes, replacements):
+    """
+    Конвертация XML-части пакета (document/header/footer).
+
+    Returns:
+        tuple: (новые байты или None если изменений нет, число изменённых параграфов)
+    """
+    # Быстрый выход: в части нет ни одной фигурной скобки
+    if b'{' not in xml_bytes:
+        return None, 0
+
+    root = etree.fromstring(xml_bytes, _XML_PARSER)
+    changes_count = 0
+    for paragraph in root.iter(W_P):
+        if convert_paragraph_element(paragraph, replacements):
+            changes_count += 1
+
+    if not changes_count:
+        return None, 0
+
+    return etree.tostring(root, xml_declaration=True, encoding='UTF-8', standalone=True), changes_count
+
+
+def convert_docx_bytes(data):
+    """
+    Конвертация DOCX в памяти без python-docx.
+
+    Args:
+        data: Байты исходного DOCX
 
-    return True, replacements
+    Returns:
+        tuple: (байты результата, число изменённых параграфов, словарь замен {оригинал: нормализованное})
+    """
+    replacements = {}
+    changed_parts = {}
+    changes_count = 0
+
+    with zipfile.ZipFile(BytesIO(data), 'r') as zin:
+        for info in zin.infolist():
+            if not CONVERTIBLE_PARTS.match(info.filename):
+                continue
+            new_xml, count = convert_part_xml(zin.read(info), replacements)
+            if new_xml is not None:
+                changed_parts[info.filename] = new_xml
+                changes_count += count
+
+        if not changed_parts:
+            return data, 0, replacements
+
+        output = BytesIO()
+        with zipfile.ZipFile(output, 'w') as zout:
+            for info in zin.infolist():
+                content = changed_parts.get(info.filename)
+                if content is None:
+                    content = zin.read(info)
+                zout.writestr(info, content, compress_type=info.compress_type)
 
+    return output.getvalue(), changes_count, replacements
 
-def process_table(table):
-    """Обработка таблицы"""
-    changed = False
-    all_replacements = {}
 
-    for row in table.rows:
-        for cell in row.cells:
-            for paragraph in cell.paragraphs:
-                was_changed, replacements = process_paragraph(paragraph)
-                if was_changed:
-                    changed = True
-                    all_replacements.update(replacements)
+def convert_docx(input_path, output_path=None):
+    """
+    Библиотечная функция конвертации шаблона со старым синтаксисом {var}.
+    Если output_path не указан, файл конвертируется на месте.
+    Файл перезаписывается только при наличии изменений.
+
+    Returns:
+        tuple: (число изменённых параграфов, словарь замен)
+    """
+    with open(input_path, 'rb') as f:
+        data = f.read()
 
-    return changed, all_replacements
+    new_data, changes_count, replacements = convert_docx_bytes(data)
+
+    if output_path is None:
+        output_path = input_path
+    if changes_count or os.path.abspath(output_path) != os.path.abspath(input_path):
+        with open(output_path, 'wb') as f:
+            f.write(new_data)
+
+    return changes_count, replacements
 
 
 def convert_document(input_path, output_path=None):
@@ -89,27 +229,7 @@ def convert_document(input_path, output_path=None):
     print(f"Обработка: {input_path}")
 
     try:
-        doc = Document(input_path)
-
-        changes_count = 0
-        all_replacements = {}
-
-        # Обрабатываем параграфы
-        for paragraph in doc.paragraphs:
-            was_changed, replacements = process_paragraph(paragraph)
-            if was_changed:
-                changes_count += 1
-                all_replacements.update(replacements)
-
-        # Обрабатываем таблицы
-        for table in doc.tables:
-            was_changed, replacements = process_table(table)
-            if was_changed:
-                changes_count += 1
-                all_replacements.update(replacements)
-
-        # Сохраняем документ
-        doc.save(output_path)
+        changes_count, all_replacements = convert_docx(input_path, output_path)
 
         print(f"✓ Сохранено: {output_path}")
         print(f"  Изменено элементов: {changes_count}")
@@ -134,58 +254,240 @@ def generate_json_template(replacements):
     return json_template
 
 
-if __name__ == "__main__":
-    files_to_convert = [
-        "ТА-турист турпродукт 27082025.docx  пр..docx",
-        "для договора.docx"
-    ]
+MANIFEST_FILENAME = '.convert_manifest.json'
 
-    print("=" * 70)
-    print("ФИНАЛЬНАЯ конвертация шаблонов DOCX для Jinja2")
-    print("Замена: пробелы → '_', дефисы → '_', {var} → {{var}}")
-    print("=" * 70)
 
-    all_file_replacements = {}
+def file_sha256(path):
+    """SHA-256 содержимого файла (для манифеста инкрементальной конвертации)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-    for filename in files_to_convert:
-        if os.path.exists(filename):
-            # Создаем копию в docx_templates
-            base_name = os.path.basename(filename)
-            clean_name = re.sub(r'\s+', ' ', base_name).strip()
-            output_path = os.path.join("docx_templates", clean_name)
 
-            result_path, replacements = convert_document(filename, output_path)
-            if result_path and replacements:
-                all_file_replacements[clean_name] = replacements
+def clean_filename(name):
+    """Нормализация имени файла: схлопывание пробелов"""
+    return re.sub(r'\s+', ' ', name).strip()
 
-                # Генерируем JSON шаблон
-                json_template = generate_json_template(replacements)
-                json_filename = os.path.join("examples",
-                    clean_name.replace('.docx', '_шаблон.json'))
 
-                with open(json_filename, 'w', encoding='utf-8') as f:
-                    json.dump(json_template, f, ensure_ascii=False, indent=2)
+def _glob_root(pattern):
+    """Директория до первого компонента маски: от неё считаются относительные пути совпадений"""
+    parts = []
+    for part in pattern.replace('\\', '/').split('/'):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return '/'.join(parts) or '.'
 
-                print(f"  JSON шаблон: {json_filename}")
 
+def collect_inputs(patterns, output_dir):
+    """
+    Разворачивание аргументов CLI в список пар (входной файл, путь результата).
+    Поддерживаются файлы, директории (рекурсивно) и glob-маски.
+    Путь результата — путь файла относительно директории-аргумента или начала
+    маски (до первого компонента с * ? [), поэтому одинаковые имена в разных
+    подпапках не перезаписывают друг друга. Входы, которые всё же дают один
+    и тот же результат (одинаковые пути в разных аргументах), пропускаются
+    с ошибкой.
+    """
+    pairs = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _dirs, files in os.walk(pattern):
+                for name in files:
+                    if not name.lower().endswith('.docx') or name.startswith('~$'):
+                        continue
+                    path = os.path.join(root, name)
+                    relative = os.path.relpath(path, pattern)
+                    pairs[os.path.abspath(path)] = os.path.join(output_dir, os.path.dirname(relative),
+                                                                clean_filename(name))
         else:
-            print(f"✗ Файл не найден: {filename}")
+            magic = glob.has_magic(pattern)
+            matches = glob.glob(pattern, recursive=True) if magic else [pattern]
+            root = _glob_root(pattern) if magic else None
+            for path in matches:
+                if os.path.isfile(path) and path.lower().endswith('.docx'):
+                    relative = os.path.relpath(path, root) if root else os.path.basename(path)
+                    pairs[os.path.abspath(path)] = os.path.join(output_dir, os.path.dirname(relative),
+                                                                clean_filename(os.path.basename(path)))
+                elif not magic:
+                    print(f"✗ Файл не найден: {path}")
+
+    by_output = {}
+    for input_path, output_path in pairs.items():
+        by_output.setdefault(os.path.normpath(output_path), []).append(input_path)
+    for output_path, inputs in by_output.items():
+        if len(inputs) > 1:
+            print(f"✗ Один результат {output_path} у файлов: {', '.join(sorted(inputs))} — пропущены")
+            for input_path in inputs:
+                del pairs[input_path]
+    return sorted(pairs.items())
+
+
+def load_manifest(path):
+    """Чтение манифеста хешей предыдущих запусков"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    """Атомарная запись манифеста (через временный файл)"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def is_up_to_date(entry, input_hash, output_path):
+    """Вход не изменился с прошлого запуска, а результат на месте и по тому же пути"""
+    if not entry or not entry.get('output'):
+        return False
+    if os.path.abspath(entry['output']) != os.path.abspath(output_path) or not os.path.exists(output_path):
+        return False
+    # Второе условие — конвертация на месте (вход совпадает с результатом)
+    return input_hash in (entry.get('sha256'), entry.get('output_sha256'))
+
+
+def convert_job(input_path, output_path, examples_path):
+    """
+    Конвертация одного файла в процессе пула.
+    Возвращает словарь с результатом (сериализуемый для манифеста).
+
+    Args:
+        examples_path: Куда сохранить JSON-заготовку (None — не сохранять)
+    """
+    result = {'input': input_path, 'output': output_path, 'replacements': {}}
+    try:
+        result['sha256'] = file_sha256(input_path)
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        changes_count, replacements = convert_docx(input_path, output_path)
+        result['changes'] = changes_count
+        result['replacements'] = replacements
+        result['output_sha256'] = file_sha256(output_path)
+
+        if replacements and examples_path:
+            os.makedirs(os.path.dirname(examples_path) or '.', exist_ok=True)
+            with open(examples_path, 'w', encoding='utf-8') as f:
+                json.dump(generate_json_template(replacements), f, ensure_ascii=False, indent=2)
+            result['examples'] = examples_path
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    return result
 
+
+def examples_template_path(examples_dir, output_dir, output_path):
+    """Путь JSON-заготовки: та же относительная структура, что у шаблонов в output_dir"""
+    if not examples_dir:
+        return None
+    relative = os.path.relpath(output_path, output_dir)
+    return os.path.join(examples_dir, os.path.splitext(relative)[0] + '_шаблон.json')
+
+
+def print_summary(results):
+    """Сводка замен по всем сконвертированным файлам"""
     print("\n" + "=" * 70)
     print("СВОДКА ВСЕХ ЗАМЕН:")
     print("=" * 70)
 
-    for filename, replacements in all_file_replacements.items():
-        print(f"\n📄 {filename}:")
+    for result in results:
+        if not result['replacements']:
+            continue
+        print(f"\n📄 {os.path.basename(result['output'])}:")
         print("   " + "-" * 65)
-        for original, normalized in sorted(replacements.items()):
+        for original, normalized in sorted(result['replacements'].items()):
             if original != normalized:
                 print(f"   ❌ {{{original}}} → ✅ {{{{{normalized}}}}}")
             else:
                 print(f"   ✅ {{{original}}} → {{{{{original}}}}}")
 
+
+def main(argv=None):
+    """Пакетная конвертация: директории/glob-маски, пул процессов, манифест хешей"""
+    parser = argparse.ArgumentParser(
+        description="Конвертация DOCX шаблонов {var} → {{var}} для Jinja2"
+    )
+    parser.add_argument('inputs', nargs='+',
+                        help='Файлы .docx, директории или glob-маски (например "partners/**/*.docx")')
+    parser.add_argument('-o', '--output-dir', default='docx_templates',
+                        help='Куда сохранять сконвертированные шаблоны (по умолчанию docx_templates/)')
+    parser.add_argument('-e', '--examples-dir', default='examples',
+                        help='Куда сохранять JSON-заготовки (по умолчанию examples/)')
+    parser.add_argument('--no-examples', action='store_true',
+                        help='Не генерировать JSON-заготовки')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='Число процессов (по умолчанию — число ядер)')
+    parser.add_argument('--manifest', default=None,
+                        help=f'Путь к манифесту хешей (по умолчанию <output-dir>/{MANIFEST_FILENAME})')
+    parser.add_argument('--force', action='store_true',
+                        help='Конвертировать все файлы, игнорируя манифест')
+    args = parser.parse_args(argv)
+
+    manifest_path = args.manifest or os.path.join(args.output_dir, MANIFEST_FILENAME)
+    examples_dir = None if args.no_examples else args.examples_dir
+
+    print("=" * 70)
+    print("ФИНАЛЬНАЯ конвертация шаблонов DOCX для Jinja2")
+    print("Замена: пробелы → '_', дефисы → '_', {var} → {{var}}")
+    print("=" * 70)
+
+    # С --force манифест не используется для пропуска, но записи остальных файлов сохраняются
+    manifest = load_manifest(manifest_path)
+    jobs = []
+    skipped = 0
+    for input_path, output_path in collect_inputs(args.inputs, args.output_dir):
+        if not args.force and is_up_to_date(manifest.get(input_path), file_sha256(input_path), output_path):
+            skipped += 1
+            continue
+        jobs.append((input_path, output_path))
+
+    print(f"Файлов к обработке: {len(jobs)}, без изменений (пропущено): {skipped}")
+
+    results = []
+    errors = 0
+    if jobs:
+        workers = max(1, min(args.jobs, len(jobs)))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(convert_job, input_path, output_path,
+                                examples_template_path(examples_dir, args.output_dir, output_path))
+                for input_path, output_path in jobs
+            ]
+            for future in as_completed(futures):
+                result = future.result()
+                if 'error' in result:
+                    errors += 1
+                    print(f"✗ {result['input']}: {result['error']}")
+                    continue
+                print(f"✓ {result['output']} (изменено элементов: {result['changes']})")
+                manifest[result['input']] = {
+                    'sha256': result['sha256'],
+                    'output': result['output'],
+                    'output_sha256': result['output_sha256'],
+                    'examples': result.get('examples'),
+                }
+                results.append(result)
+
+        save_manifest(manifest_path, manifest)
+
+    print_summary(sorted(results, key=lambda r: r['output']))
+
     print("\n" + "=" * 70)
     print("✓ Конвертация завершена!")
-    print(f"  Шаблоны: docx_templates/")
-    print(f"  JSON примеры: examples/")
+    print(f"  Сконвертировано: {len(results)}, пропущено: {skipped}, ошибок: {errors}")
+    print(f"  Шаблоны: {args.output_dir}/")
+    if examples_dir:
+        print(f"  JSON примеры: {examples_dir}/")
     print("=" * 70)
+
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
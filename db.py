@@ -2,11 +2,13 @@
 PostgreSQL база данных для хранения метаданных шаблонов и пользователей
 """
 import os
+import re
 import psycopg2
+import psycopg2.errors
 from psycopg2.extras import RealDictCursor
 from contextlib import contextmanager
 from datetime import datetime
-import json
+import serialization
 from werkzeug.security import generate_password_hash, check_password_hash
 
 # Параметры подключения к PostgreSQL из переменных окружения
@@ -16,6 +18,10 @@ POSTGRES_USER = os.environ.get('POSTGRES_USER', 'docx')
 POSTGRES_PASSWORD = os.environ.get('POSTGRES_PASSWORD', '')
 POSTGRES_DB = os.environ.get('POSTGRES_DB', 'docx_changer')
 
+# Подсветка результатов поиска по истории строится по началу текста документа:
+# ts_headline заново разбирает весь переданный текст
+HISTORY_HEADLINE_MAX_CHARS = 20000
+
 
 def get_connection_string():
 	"""Формирование строки подключения к PostgreSQL"""
@@ -35,13 +41,15 @@ def get_db_connection():
 		conn.close()
 
 
-def init_db():
-	"""Инициализация базы данных"""
-	with get_db_connection() as conn:
-		cursor = conn.cursor()
+# Ключ advisory lock: миграции из нескольких процессов/контейнеров применяются по очереди
+MIGRATIONS_LOCK_ID = 73120401
 
-		# Таблица пользователей
-		cursor.execute('''
+# Упорядоченный список миграций: (версия, описание, [SQL]).
+# Каждая миграция идемпотентна (IF NOT EXISTS), чтобы её можно было применить
+# к базе, созданной до появления schema_version. Новые миграции — только в конец.
+MIGRATIONS = [
+	(1, 'Базовая схема', [
+		'''
 			CREATE TABLE IF NOT EXISTS users (
 				id SERIAL PRIMARY KEY,
 				username TEXT NOT NULL UNIQUE,
@@ -50,10 +58,8 @@ def init_db():
 				created_at TIMESTAMP DEFAULT NOW(),
 				is_active BOOLEAN DEFAULT TRUE
 			)
-		''')
-
-		# Таблица шаблонов
-		cursor.execute('''
+		''',
+		'''
 			CREATE TABLE IF NOT EXISTS templates (
 				id SERIAL PRIMARY KEY,
 				name TEXT NOT NULL,
@@ -65,10 +71,8 @@ def init_db():
 				created_at TIMESTAMP DEFAULT NOW(),
 				updated_at TIMESTAMP DEFAULT NOW()
 			)
-		''')
-
-		# Таблица истории сгенерированных документов
-		cursor.execute('''
+		''',
+		'''
 			CREATE TABLE IF NOT EXISTS generated_documents (
 				id SERIAL PRIMARY KEY,
 				template_name TEXT NOT NULL,
@@ -79,10 +83,8 @@ def init_db():
 				user_id INTEGER REFERENCES users(id),
 				created_at TIMESTAMP DEFAULT NOW()
 			)
-		''')
-
-		# Таблица категорий справочников
-		cursor.execute('''
+		''',
+		'''
 			CREATE TABLE IF NOT EXISTS snippet_categories (
 				id SERIAL PRIMARY KEY,
 				name TEXT NOT NULL,
@@ -91,10 +93,8 @@ def init_db():
 				created_at TIMESTAMP DEFAULT NOW(),
 				updated_at TIMESTAMP DEFAULT NOW()
 			)
-		''')
-
-		# Таблица фрагментов справочников
-		cursor.execute('''
+		''',
+		'''
 			CREATE TABLE IF NOT EXISTS snippets (
 				id SERIAL PRIMARY KEY,
 				category_id INTEGER NOT NULL REFERENCES snippet_categories(id) ON DELETE CASCADE,
@@ -107,50 +107,268 @@ def init_db():
 				created_at TIMESTAMP DEFAULT NOW(),
 				updated_at TIMESTAMP DEFAULT NOW()
 			)
-		''')
+		''',
+	]),
+	(2, 'user_id в таблицах, созданных до многопользовательского режима', [
+		'ALTER TABLE templates ADD COLUMN IF NOT EXISTS user_id INTEGER REFERENCES users(id)',
+		'ALTER TABLE generated_documents ADD COLUMN IF NOT EXISTS user_id INTEGER REFERENCES users(id)',
+	]),
+	(3, 'Индексы по user_id, category_id и created_at', [
+		'CREATE INDEX IF NOT EXISTS idx_templates_user_created ON templates (user_id, created_at DESC)',
+		'CREATE INDEX IF NOT EXISTS idx_templates_created ON templates (created_at DESC)',
+		'CREATE INDEX IF NOT EXISTS idx_generated_documents_user_created ON generated_documents (user_id, created_at DESC)',
+		'CREATE INDEX IF NOT EXISTS idx_generated_documents_created ON generated_documents (created_at DESC)',
+		'CREATE INDEX IF NOT EXISTS idx_snippet_categories_user ON snippet_categories (user_id)',
+		'CREATE INDEX IF NOT EXISTS idx_snippets_category_name ON snippets (category_id, name)',
+		'CREATE INDEX IF NOT EXISTS idx_snippets_user ON snippets (user_id)',
+	]),
+	(4, 'Счётчики использования шаблонов и фрагментов (для прогрева кэша)', [
+		'ALTER TABLE templates ADD COLUMN IF NOT EXISTS use_count INTEGER NOT NULL DEFAULT 0',
+		'ALTER TABLE templates ADD COLUMN IF NOT EXISTS last_used_at TIMESTAMP',
+		'ALTER TABLE snippets ADD COLUMN IF NOT EXISTS use_count INTEGER NOT NULL DEFAULT 0',
+		'ALTER TABLE snippets ADD COLUMN IF NOT EXISTS last_used_at TIMESTAMP',
+		'CREATE INDEX IF NOT EXISTS idx_templates_use_count ON templates (use_count DESC)',
+		'CREATE INDEX IF NOT EXISTS idx_snippets_use_count ON snippets (use_count DESC)',
+	]),
+	(5, 'Полнотекстовый поиск по истории генерации', [
+		# Текст для поиска и подсветки: имена файлов и все строковые значения json_data
+		'''
+			CREATE OR REPLACE FUNCTION history_search_text(template_name TEXT, output_filename TEXT, json_data TEXT)
+			RETURNS TEXT AS $$
+			DECLARE
+				values_text TEXT;
+			BEGIN
+				BEGIN
+					SELECT string_agg(v #>> '{}', ' ') INTO values_text
+					FROM jsonb_path_query(json_data::jsonb, 'strict $.** ? (@.type() == "string")') AS v;
+				EXCEPTION WHEN others THEN
+					-- Невалидный JSON в старых записях: ищем по исходному тексту
+					values_text := json_data;
+				END;
+				RETURN concat_ws(' ', template_name, output_filename, values_text);
+			END;
+			$$ LANGUAGE plpgsql IMMUTABLE
+		''',
+		# Русская морфология + simple (фамилии, номера, латиница без стемминга)
+		'''
+			CREATE OR REPLACE FUNCTION history_search_vector(template_name TEXT, output_filename TEXT, json_data TEXT)
+			RETURNS tsvector AS $$
+				SELECT
+					setweight(to_tsvector('russian', concat_ws(' ', template_name, output_filename)), 'A') ||
+					setweight(to_tsvector('simple', concat_ws(' ', template_name, output_filename)), 'A') ||
+					setweight(to_tsvector('russian', history_search_text(NULL, NULL, json_data)), 'B') ||
+					setweight(to_tsvector('simple', history_search_text(NULL, NULL, json_data)), 'B')
+			$$ LANGUAGE sql IMMUTABLE
+		''',
+		'ALTER TABLE generated_documents ADD COLUMN IF NOT EXISTS search_vector tsvector',
+		'''
+			CREATE OR REPLACE FUNCTION generated_documents_search_update() RETURNS trigger AS $$
+			BEGIN
+				NEW.search_vector := history_search_vector(NEW.template_name, NEW.output_filename, NEW.json_data);
+				RETURN NEW;
+			END;
+			$$ LANGUAGE plpgsql
+		''',
+		'DROP TRIGGER IF EXISTS generated_documents_search_update ON generated_documents',
+		'''
+			CREATE TRIGGER generated_documents_search_update
+			BEFORE INSERT OR UPDATE OF template_name, output_filename, json_data ON generated_documents
+			FOR EACH ROW EXECUTE FUNCTION generated_documents_search_update()
+		''',
+		'''
+			UPDATE generated_documents
+			SET search_vector = history_search_vector(template_name, output_filename, json_data)
+			WHERE search_vector IS NULL
+		''',
+		'CREATE INDEX IF NOT EXISTS idx_generated_documents_search ON generated_documents USING GIN (search_vector)',
+	]),
+	(6, 'Поиск по содержимому фрагментов (полнотекстовый и триграммный)', [
+		'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+		'ALTER TABLE snippets ADD COLUMN IF NOT EXISTS content_text TEXT',
+		'''
+			ALTER TABLE snippets ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+				setweight(to_tsvector('russian'::regconfig, coalesce(name, '')), 'A') ||
+				setweight(to_tsvector('simple'::regconfig, coalesce(name, '')), 'A') ||
+				setweight(to_tsvector('russian'::regconfig, coalesce(description, '')), 'B') ||
+				setweight(to_tsvector('russian'::regconfig, coalesce(content_text, '')), 'C') ||
+				setweight(to_tsvector('simple'::regconfig, coalesce(content_text, '')), 'D')
+			) STORED
+		''',
+		'CREATE INDEX IF NOT EXISTS idx_snippets_search ON snippets USING GIN (search_vector)',
+		'CREATE INDEX IF NOT EXISTS idx_snippets_name_trgm ON snippets USING GIN (name gin_trgm_ops)',
+		'CREATE INDEX IF NOT EXISTS idx_snippets_content_trgm ON snippets USING GIN (content_text gin_trgm_ops)',
+	]),
+	(7, 'Версии данных пользователя для ETag списков', [
+		'''
+			CREATE TABLE IF NOT EXISTS user_data_versions (
+				user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+				resource TEXT NOT NULL,
+				version BIGINT NOT NULL DEFAULT 0,
+				PRIMARY KEY (user_id, resource)
+			)
+		''',
+		# TG_ARGV[0] — имя ресурса (templates, snippets, history)
+		'''
+			CREATE OR REPLACE FUNCTION bump_user_data_version() RETURNS trigger AS $$
+			DECLARE
+				uid INTEGER;
+			BEGIN
+				FOREACH uid IN ARRAY ARRAY[
+					CASE WHEN TG_OP <> 'INSERT' THEN OLD.user_id END,
+					CASE WHEN TG_OP <> 'DELETE' THEN NEW.user_id END
+				] LOOP
+					IF uid IS NOT NULL THEN
+						INSERT INTO user_data_versions (user_id, resource, version)
+						VALUES (uid, TG_ARGV[0], 1)
+						ON CONFLICT (user_id, resource)
+						DO UPDATE SET version = user_data_versions.version + 1;
+					END IF;
+				END LOOP;
+				RETURN NULL;
+			END;
+			$$ LANGUAGE plpgsql
+		''',
+		# Счётчики использования (use_count) не меняют списки — UPDATE OF только по видимым колонкам
+		'DROP TRIGGER IF EXISTS templates_data_version ON templates',
+		'''
+			CREATE TRIGGER templates_data_version
+			AFTER INSERT OR DELETE OR UPDATE OF name, original_filename, description, s3_key, user_id ON templates
+			FOR EACH ROW EXECUTE FUNCTION bump_user_data_version('templates')
+		''',
+		'DROP TRIGGER IF EXISTS snippets_data_version ON snippets',
+		'''
+			CREATE TRIGGER snippets_data_version
+			AFTER INSERT OR DELETE OR UPDATE OF name, description, category_id, s3_key, original_filename, user_id ON snippets
+			FOR EACH ROW EXECUTE FUNCTION bump_user_data_version('snippets')
+		''',
+		'DROP TRIGGER IF EXISTS snippet_categories_data_version ON snippet_categories',
+		'''
+			CREATE TRIGGER snippet_categories_data_version
+			AFTER INSERT OR DELETE OR UPDATE OF name, description, user_id ON snippet_categories
+			FOR EACH ROW EXECUTE FUNCTION bump_user_data_version('snippets')
+		''',
+		'DROP TRIGGER IF EXISTS generated_documents_data_version ON generated_documents',
+		'''
+			CREATE TRIGGER generated_documents_data_version
+			AFTER INSERT OR DELETE OR UPDATE OF template_name, output_filename, file_size, user_id ON generated_documents
+			FOR EACH ROW EXECUTE FUNCTION bump_user_data_version('history')
+		''',
+	]),
+	(8, 'Шаблон и выбор фрагментов сгенерированного документа (перегенерация из истории)', [
+		# template_hash — sha256 шаблона в хранилище сессий, snippet_selection — JSON {метка: id фрагмента или null}
+		'ALTER TABLE generated_documents ADD COLUMN IF NOT EXISTS template_hash TEXT',
+		'ALTER TABLE generated_documents ADD COLUMN IF NOT EXISTS snippet_selection TEXT',
+		'CREATE INDEX IF NOT EXISTS idx_generated_documents_template_hash ON generated_documents(template_hash)',
+	]),
+	(9, 'Изображения для контекста генерации (логотипы, подписи, печати)', [
+		# s3_key адресует содержимое (images/<sha256>.<ext>) и может быть общим для нескольких пользователей
+		'''
+			CREATE TABLE IF NOT EXISTS images (
+				id SERIAL PRIMARY KEY,
+				user_id INTEGER NOT NULL REFERENCES users(id),
+				name TEXT NOT NULL,
+				s3_key TEXT NOT NULL,
+				content_hash TEXT NOT NULL,
+				content_type TEXT NOT NULL,
+				width INTEGER NOT NULL,
+				height INTEGER NOT NULL,
+				file_size INTEGER,
+				created_at TIMESTAMP DEFAULT NOW(),
+				UNIQUE (user_id, content_hash)
+			)
+		''',
+		'CREATE INDEX IF NOT EXISTS idx_images_content_hash ON images(content_hash)',
+	]),
+]
 
-		conn.commit()
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def _get_schema_version(conn):
+	"""Текущая версия схемы (0 если таблицы schema_version ещё нет)"""
+	cursor = conn.cursor()
+	try:
+		cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+		return cursor.fetchone()[0]
+	except psycopg2.errors.UndefinedTable:
+		conn.rollback()
+		return 0
+
+
+def get_schema_version():
+	"""Текущая версия схемы БД"""
+	with get_db_connection() as conn:
+		return _get_schema_version(conn)
 
 
 def migrate_db():
-	"""Миграция существующей БД для добавления user_id"""
+	"""
+	Применение недостающих миграций.
+	Если схема актуальна — один запрос к БД. Иначе миграции применяются
+	под advisory lock, каждая в своей транзакции вместе с записью в schema_version.
+
+	Returns:
+		list: номера применённых миграций
+	"""
 	with get_db_connection() as conn:
-		cursor = conn.cursor()
+		if _get_schema_version(conn) >= LATEST_SCHEMA_VERSION:
+			return []
 
-		# Проверяем, есть ли колонка user_id в templates
-		cursor.execute("""
-			SELECT column_name FROM information_schema.columns
-			WHERE table_name = 'templates' AND column_name = 'user_id'
-		""")
-		if not cursor.fetchone():
-			cursor.execute('ALTER TABLE templates ADD COLUMN user_id INTEGER REFERENCES users(id)')
-
-		# Проверяем, есть ли колонка user_id в generated_documents
-		cursor.execute("""
-			SELECT column_name FROM information_schema.columns
-			WHERE table_name = 'generated_documents' AND column_name = 'user_id'
-		""")
-		if not cursor.fetchone():
-			cursor.execute('ALTER TABLE generated_documents ADD COLUMN user_id INTEGER REFERENCES users(id)')
-
-		# Проверяем, существует ли таблица users
-		cursor.execute("""
-			SELECT table_name FROM information_schema.tables
-			WHERE table_name = 'users'
-		""")
-		if not cursor.fetchone():
+		cursor = conn.cursor()
+		cursor.execute('SELECT pg_advisory_lock(%s)', (MIGRATIONS_LOCK_ID,))
+		applied = []
+		try:
 			cursor.execute('''
-				CREATE TABLE users (
-					id SERIAL PRIMARY KEY,
-					username TEXT NOT NULL UNIQUE,
-					email TEXT NOT NULL UNIQUE,
-					password_hash TEXT NOT NULL,
-					created_at TIMESTAMP DEFAULT NOW(),
-					is_active BOOLEAN DEFAULT TRUE
+				CREATE TABLE IF NOT EXISTS schema_version (
+					version INTEGER PRIMARY KEY,
+					description TEXT NOT NULL,
+					applied_at TIMESTAMP DEFAULT NOW()
 				)
 			''')
+			conn.commit()
+
+			# Перечитываем версию под блокировкой: другой процесс мог успеть раньше
+			current_version = _get_schema_version(conn)
+			for version, description, statements in MIGRATIONS:
+				if version <= current_version:
+					continue
+				for statement in statements:
+					cursor.execute(statement)
+				cursor.execute(
+					'INSERT INTO schema_version (version, description) VALUES (%s, %s)',
+					(version, description)
+				)
+				conn.commit()
+				applied.append(version)
+		except Exception:
+			conn.rollback()
+			raise
+		finally:
+			cursor.execute('SELECT pg_advisory_unlock(%s)', (MIGRATIONS_LOCK_ID,))
+			conn.commit()
+
+		return applied
+
+
+def init_db():
+	"""Инициализация базы данных (создание схемы через миграции)"""
+	return migrate_db()
+
+
+def get_data_version(user_id, resource):
+	"""
+	Версия данных пользователя (templates, snippets, history) — увеличивается
+	триггерами при каждом изменении. Используется для ETag списков.
+	"""
+	with get_db_connection() as conn:
+		cursor = conn.cursor()
+		cursor.execute(
+			'SELECT version FROM user_data_versions WHERE user_id = %s AND resource = %s',
+			(user_id, resource)
+		)
+		row = cursor.fetchone()
+		return row[0] if row else 0
 
-		conn.commit()
 
 # ===== Функции для работы с пользователями =====
 
@@ -212,7 +430,7 @@ def verify_password(user_dict, password):
 
 def add_template(name, original_filename, s3_key, description='', variables=None, user_id=None):
 	"""Добавление шаблона в БД"""
-	variables_json = json.dumps(variables) if variables else None
+	variables_json = serialization.dumps(variables) if variables else None
 
 	with get_db_connection() as conn:
 		cursor = conn.cursor()
@@ -259,6 +477,31 @@ def get_template(template_id, user_id=None):
 		return dict(template) if template else None
 
 
+def record_template_use(template_id):
+	"""Учёт использования шаблона из библиотеки"""
+	with get_db_connection() as conn:
+		cursor = conn.cursor()
+		cursor.execute('''
+			UPDATE templates SET use_count = use_count + 1, last_used_at = NOW()
+			WHERE id = %s
+		''', (template_id,))
+		conn.commit()
+
+
+def get_most_used_templates(limit=10):
+	"""Самые используемые шаблоны всех пользователей (для прогрева кэша)"""
+	with get_db_connection() as conn:
+		cursor = conn.cursor(cursor_factory=RealDictCursor)
+		cursor.execute('''
+			SELECT id, name, original_filename, s3_key, use_count
+			FROM templates
+			WHERE use_count > 0
+			ORDER BY use_count DESC, last_used_at DESC
+			LIMIT %s
+		''', (limit,))
+		return [dict(row) for row in cursor.fetchall()]
+
+
 def delete_template(template_id, user_id=None):
 	"""Удаление шаблона из БД с проверкой владельца"""
 	with get_db_connection() as conn:
@@ -285,17 +528,32 @@ def delete_template(template_id, user_id=None):
 
 # ===== Функции для работы с историей сгенерированных документов =====
 
-def add_generated_document(template_name, output_filename, s3_key, json_data, file_size=0, user_id=None):
-	"""Добавление сгенерированного документа в историю"""
-	json_data_str = json.dumps(json_data) if json_data else None
+def add_generated_document(template_name, output_filename, s3_key, json_data, file_size=0, user_id=None, json_text=None,
+                           template_hash=None, snippet_selection=None):
+	"""
+	Добавление сгенерированного документа в историю.
+
+	Args:
+		json_text: Исходный JSON-текст json_data, если он уже есть (сохраняется без повторной сериализации)
+		template_hash: sha256 шаблона в хранилище сессий (для перегенерации)
+		snippet_selection: Выбор фрагментов {метка: id фрагмента или None}
+	"""
+	if not json_data:
+		json_data_str = None
+	elif json_text is not None:
+		json_data_str = json_text
+	else:
+		json_data_str = serialization.dumps(json_data)
+	selection_str = serialization.dumps(snippet_selection) if snippet_selection else None
 
 	with get_db_connection() as conn:
 		cursor = conn.cursor()
 		cursor.execute('''
-			INSERT INTO generated_documents (template_name, output_filename, s3_key, json_data, file_size, user_id)
-			VALUES (%s, %s, %s, %s, %s, %s)
+			INSERT INTO generated_documents
+				(template_name, output_filename, s3_key, json_data, file_size, user_id, template_hash, snippet_selection)
+			VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
 			RETURNING id
-		''', (template_name, output_filename, s3_key, json_data_str, file_size, user_id))
+		''', (template_name, output_filename, s3_key, json_data_str, file_size, user_id, template_hash, selection_str))
 		doc_id = cursor.fetchone()[0]
 		conn.commit()
 
@@ -308,7 +566,8 @@ def get_all_generated_documents(limit=100, user_id=None):
 		cursor = conn.cursor(cursor_factory=RealDictCursor)
 		if user_id is not None:
 			cursor.execute('''
-				SELECT id, template_name, output_filename, file_size, created_at
+				SELECT id, template_name, output_filename, file_size, created_at,
+					template_hash IS NOT NULL AS can_regenerate
 				FROM generated_documents
 				WHERE user_id = %s
 				ORDER BY created_at DESC
@@ -316,7 +575,8 @@ def get_all_generated_documents(limit=100, user_id=None):
 			''', (user_id, limit))
 		else:
 			cursor.execute('''
-				SELECT id, template_name, output_filename, file_size, created_at
+				SELECT id, template_name, output_filename, file_size, created_at,
+					template_hash IS NOT NULL AS can_regenerate
 				FROM generated_documents
 				ORDER BY created_at DESC
 				LIMIT %s
@@ -324,8 +584,111 @@ def get_all_generated_documents(limit=100, user_id=None):
 		return [dict(row) for row in cursor.fetchall()]
 
 
-def get_generated_document(doc_id, user_id=None):
-	"""Получение сгенерированного документа по ID с проверкой владельца"""
+# Элемент синтаксиса websearch: [-]"фраза" или [-]слово
+_WEBSEARCH_TERM = re.compile(r'(-?)(?:"([^"]*)"?|([^\s"]+))')
+
+
+def _websearch_prefix_tsquery(query):
+	"""
+	Запрос для конфигурации simple с тем же синтаксисом, что у websearch_to_tsquery,
+	и поиском по началу последнего набираемого слова:
+	'договор -аренда' → 'договор & !аренда', '"иван петров" or мар' → 'иван <-> петров | мар:*'.
+	Исключения и фразы сохраняются, поэтому запрос можно объединять с websearch_to_tsquery через ||.
+	"""
+	groups = [[]]
+	last_word = None
+	for match in _WEBSEARCH_TERM.finditer(query.lower()):
+		negated, phrase, word = match.groups()
+		if word == 'or' and not negated:
+			if groups[-1]:
+				groups.append([])
+			continue
+		words = re.findall(r'\w+', phrase if phrase is not None else word)
+		if not words:
+			continue
+		term = ' <-> '.join(words)
+		if negated:
+			groups[-1].append(f"!({term})" if len(words) > 1 else f"!{term}")
+			continue
+		groups[-1].append(term)
+		# Префикс — только у незакрытого слова, а не у фразы в кавычках
+		last_word = (len(groups) - 1, len(groups[-1]) - 1) if phrase is None else None
+
+	if last_word is not None:
+		group, index = last_word
+		groups[group][index] += ':*'
+	return ' | '.join(' & '.join(group) for group in groups if group)
+
+
+def search_generated_documents(query, user_id, limit=20, cursor=None):
+	"""
+	Полнотекстовый поиск по истории: имя шаблона, имя файла, значения json_data.
+
+	Args:
+		query: Строка поиска (синтаксис websearch: "фраза", -исключение, or)
+		cursor: (created_at, id) последней строки предыдущей страницы
+
+	Returns:
+		tuple: (документы с полем headline, курсор следующей страницы или None)
+	"""
+	prefix_query = _websearch_prefix_tsquery(query)
+	if not prefix_query:
+		return [], None
+
+	params = {
+		'query': query,
+		'prefix_query': prefix_query,
+		'user_id': user_id,
+		'limit': limit + 1,
+		'headline_chars': HISTORY_HEADLINE_MAX_CHARS,
+	}
+	keyset = ''
+	if cursor is not None:
+		keyset = 'AND (d.created_at, d.id) < (%(cursor_created_at)s, %(cursor_id)s)'
+		params['cursor_created_at'], params['cursor_id'] = cursor
+
+	with get_db_connection() as conn:
+		db_cursor = conn.cursor(cursor_factory=RealDictCursor)
+		# Сначала страница (LIMIT), затем подсветка только её строк и по ограниченному тексту
+		db_cursor.execute(f'''
+			WITH q AS (
+				SELECT websearch_to_tsquery('russian', %(query)s) || to_tsquery('simple', %(prefix_query)s) AS query
+			), page AS (
+				SELECT d.id, d.template_name, d.output_filename, d.file_size, d.created_at, d.json_data,
+					d.template_hash IS NOT NULL AS can_regenerate
+				FROM generated_documents d, q
+				WHERE d.user_id = %(user_id)s
+					AND d.search_vector @@ q.query
+					{keyset}
+				ORDER BY d.created_at DESC, d.id DESC
+				LIMIT %(limit)s
+			)
+			SELECT p.id, p.template_name, p.output_filename, p.file_size, p.created_at, p.can_regenerate,
+				ts_headline(
+					'russian',
+					left(history_search_text(p.template_name, p.output_filename, p.json_data), %(headline_chars)s),
+					q.query,
+					'StartSel=<mark>, StopSel=</mark>, MaxWords=20, MinWords=5, MaxFragments=2, FragmentDelimiter=" … "'
+				) AS headline
+			FROM page p, q
+			ORDER BY p.created_at DESC, p.id DESC
+		''', params)
+		rows = [dict(row) for row in db_cursor.fetchall()]
+
+	next_cursor = None
+	if len(rows) > limit:
+		rows = rows[:limit]
+		next_cursor = (rows[-1]['created_at'], rows[-1]['id'])
+	return rows, next_cursor
+
+
+def get_generated_document(doc_id, user_id=None, parse_json=True):
+	"""
+	Получение сгенерированного документа по ID с проверкой владельца.
+
+	Args:
+		parse_json: Разобрать json_data (иначе возвращается сохранённый текст)
+	"""
 	with get_db_connection() as conn:
 		cursor = conn.cursor(cursor_factory=RealDictCursor)
 		if user_id is not None:
@@ -337,16 +700,31 @@ def get_generated_document(doc_id, user_id=None):
 		if document:
 			doc_dict = dict(document)
 			# Парсим JSON данные
-			if doc_dict.get('json_data'):
+			if parse_json and doc_dict.get('json_data'):
 				try:
-					doc_dict['json_data'] = json.loads(doc_dict['json_data'])
-				except json.JSONDecodeError:
+					doc_dict['json_data'] = serialization.loads(doc_dict['json_data'])
+				except serialization.JSONDecodeError:
 					doc_dict['json_data'] = None
+			try:
+				doc_dict['snippet_selection'] = serialization.loads(doc_dict['snippet_selection']) \
+					if doc_dict.get('snippet_selection') else {}
+			except serialization.JSONDecodeError:
+				doc_dict['snippet_selection'] = {}
 			return doc_dict
 
 	return None
 
 
+def get_referenced_template_hashes():
+	"""Хеши шаблонов, на которые ссылается история (их нельзя удалять из хранилища сессий)"""
+	with get_db_connection() as conn:
+		cursor = conn.cursor()
+		cursor.execute('''
+			SELECT DISTINCT template_hash FROM generated_documents WHERE template_hash IS NOT NULL
+		''')
+		return {row[0] for row in cursor.fetchall()}
+
+
 def delete_generated_document(doc_id, user_id=None):
 	"""Удаление сгенерированного документа из истории с проверкой владельца"""
 	with get_db_connection() as conn:
@@ -462,15 +840,15 @@ def delete_snippet_category(cat_id, user_id):
 
 # ===== Функции для работы с фрагментами справочников =====
 
-def create_snippet(category_id, name, s3_key, original_filename, user_id, description='', file_size=0):
+def create_snippet(category_id, name, s3_key, original_filename, user_id, description='', file_size=0, content_text=None):
 	"""Создание фрагмента в справочнике"""
 	with get_db_connection() as conn:
 		cursor = conn.cursor()
 		cursor.execute('''
-			INSERT INTO snippets (category_id, name, description, s3_key, original_filename, file_size, user_id)
-			VALUES (%s, %s, %s, %s, %s, %s, %s)
+			INSERT INTO snippets (category_id, name, description, s3_key, original_filename, file_size, user_id, content_text)
+			VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
 			RETURNING id
-		''', (category_id, name, description, s3_key, original_filename, file_size, user_id))
+		''', (category_id, name, description, s3_key, original_filename, file_size, user_id, content_text))
 		snippet_id = cursor.fetchone()[0]
 		conn.commit()
 		return snippet_id
@@ -529,7 +907,35 @@ def get_snippet(snippet_id, user_id):
 		return dict(row) if row else None
 
 
-def update_snippet(snippet_id, user_id, name=None, description=None, s3_key=None, original_filename=None, file_size=None):
+def record_snippet_use(snippet_ids):
+	"""Учёт выбора фрагментов при генерации"""
+	if not snippet_ids:
+		return
+	with get_db_connection() as conn:
+		cursor = conn.cursor()
+		cursor.execute('''
+			UPDATE snippets SET use_count = use_count + 1, last_used_at = NOW()
+			WHERE id = ANY(%s)
+		''', (list(snippet_ids),))
+		conn.commit()
+
+
+def get_most_used_snippets(limit=20):
+	"""Самые часто выбираемые фрагменты всех пользователей (для прогрева кэша)"""
+	with get_db_connection() as conn:
+		cursor = conn.cursor(cursor_factory=RealDictCursor)
+		cursor.execute('''
+			SELECT id, name, s3_key, use_count
+			FROM snippets
+			WHERE use_count > 0
+			ORDER BY use_count DESC, last_used_at DESC
+			LIMIT %s
+		''', (limit,))
+		return [dict(row) for row in cursor.fetchall()]
+
+
+def update_snippet(snippet_id, user_id, name=None, description=None, s3_key=None, original_filename=None, file_size=None,
+		content_text=None):
 	"""Обновление фрагмента (метаданные или замена файла)"""
 	with get_db_connection() as conn:
 		cursor = conn.cursor()
@@ -561,6 +967,9 @@ def update_snippet(snippet_id, user_id, name=None, description=None, s3_key=None
 		if file_size is not None:
 			updates.append('file_size = %s')
 			params.append(file_size)
+		if content_text is not None:
+			updates.append('content_text = %s')
+			params.append(content_text)
 		if not updates:
 			return None
 		updates.append('updated_at = NOW()')
@@ -575,6 +984,94 @@ def update_snippet(snippet_id, user_id, name=None, description=None, s3_key=None
 		return None
 
 
+def _like_pattern(query):
+	"""Подстрока для ILIKE с экранированием спецсимволов"""
+	escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+	return f"%{escaped}%"
+
+
+def search_snippets(user_id, query, limit=20):
+	"""
+	Поиск фрагментов пользователя по названию, описанию и тексту во всех категориях.
+
+	Совпадения полнотекстового запроса и подстроки (триграммный индекс, для
+	ввода по мере набора) ранжируются вместе. Пустой запрос возвращает
+	самые часто выбираемые фрагменты.
+
+	Returns:
+		list: фрагменты с category_name и подсвеченным headline
+	"""
+	query = (query or '').strip()
+	with get_db_connection() as conn:
+		cursor = conn.cursor(cursor_factory=RealDictCursor)
+		if not query:
+			cursor.execute('''
+				SELECT s.id, s.name, s.description, s.category_id, sc.name AS category_name,
+					NULL AS headline
+				FROM snippets s
+				JOIN snippet_categories sc ON sc.id = s.category_id
+				WHERE s.user_id = %s
+				ORDER BY s.use_count DESC, s.name
+				LIMIT %s
+			''', (user_id, limit))
+			return [dict(row) for row in cursor.fetchall()]
+
+		cursor.execute('''
+			WITH q AS (
+				SELECT websearch_to_tsquery('russian', %(query)s)
+					|| to_tsquery('simple', %(prefix_query)s) AS query
+			)
+			SELECT s.id, s.name, s.description, s.category_id, sc.name AS category_name,
+				ts_headline(
+					'russian', coalesce(s.content_text, ''), q.query,
+					'StartSel=<mark>, StopSel=</mark>, MaxWords=18, MinWords=6, MaxFragments=1'
+				) AS headline,
+				ts_rank(s.search_vector, q.query) + similarity(s.name, %(query)s) AS rank
+			FROM snippets s
+			JOIN snippet_categories sc ON sc.id = s.category_id, q
+			WHERE s.user_id = %(user_id)s
+				AND (
+					s.search_vector @@ q.query
+					OR s.name ILIKE %(like)s
+					OR s.content_text ILIKE %(like)s
+				)
+			ORDER BY rank DESC, s.use_count DESC, s.name
+			LIMIT %(limit)s
+		''', {
+			'query': query,
+			'prefix_query': _websearch_prefix_tsquery(query),
+			'like': _like_pattern(query),
+			'user_id': user_id,
+			'limit': limit,
+		})
+		return [dict(row) for row in cursor.fetchall()]
+
+
+def get_snippets_without_content(after_id=0, limit=100):
+	"""Фрагменты, для которых ещё не извлечён текст (загружены до индексации), по возрастанию id"""
+	with get_db_connection() as conn:
+		cursor = conn.cursor(cursor_factory=RealDictCursor)
+		cursor.execute('''
+			SELECT id, user_id, s3_key
+			FROM snippets
+			WHERE content_text IS NULL AND id > %s
+			ORDER BY id
+			LIMIT %s
+		''', (after_id, limit))
+		return [dict(row) for row in cursor.fetchall()]
+
+
+def set_snippet_content(snippet_id, content_text):
+	"""Сохранение извлечённого текста фрагмента"""
+	with get_db_connection() as conn:
+		cursor = conn.cursor()
+		cursor.execute(
+			'UPDATE snippets SET content_text = %s WHERE id = %s',
+			(content_text, snippet_id)
+		)
+		conn.commit()
+
+
 def delete_snippet(snippet_id, user_id):
 	"""Удаление фрагмента. Возвращает s3_key для удаления из S3."""
 	with get_db_connection() as conn:
@@ -593,3 +1090,87 @@ def delete_snippet(snippet_id, user_id):
 			conn.commit()
 			return s3_key
 		return None
+
+
+# ===== Функции для работы с изображениями =====
+
+def add_image(user_id, name, s3_key, content_hash, content_type, width, height, file_size=0):
+	"""
+	Добавление изображения. Повторная загрузка того же файла пользователем
+	возвращает существующую запись.
+
+	Returns:
+		int: ID изображения
+	"""
+	with get_db_connection() as conn:
+		cursor = conn.cursor()
+		cursor.execute('''
+			INSERT INTO images (user_id, name, s3_key, content_hash, content_type, width, height, file_size)
+			VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+			ON CONFLICT (user_id, content_hash) DO UPDATE SET name = images.name
+			RETURNING id
+		''', (user_id, name, s3_key, content_hash, content_type, width, height, file_size))
+		image_id = cursor.fetchone()[0]
+		conn.commit()
+		return image_id
+
+
+def get_images(user_id):
+	"""Все изображения пользователя"""
+	with get_db_connection() as conn:
+		cursor = conn.cursor(cursor_factory=RealDictCursor)
+		cursor.execute('''
+			SELECT id, name, content_type, width, height, file_size, created_at
+			FROM images
+			WHERE user_id = %s
+			ORDER BY created_at DESC
+		''', (user_id,))
+		return [dict(row) for row in cursor.fetchall()]
+
+
+def get_image(image_id, user_id):
+	"""Получение изображения по ID с проверкой владельца"""
+	with get_db_connection() as conn:
+		cursor = conn.cursor(cursor_factory=RealDictCursor)
+		cursor.execute(
+			'SELECT * FROM images WHERE id = %s AND user_id = %s',
+			(image_id, user_id)
+		)
+		row = cursor.fetchone()
+		return dict(row) if row else None
+
+
+def get_images_by_ids(image_ids, user_id):
+	"""Изображения пользователя по списку ID: {id: запись}"""
+	if not image_ids:
+		return {}
+	with get_db_connection() as conn:
+		cursor = conn.cursor(cursor_factory=RealDictCursor)
+		cursor.execute(
+			'SELECT * FROM images WHERE id = ANY(%s) AND user_id = %s',
+			(list(image_ids), user_id)
+		)
+		return {row['id']: dict(row) for row in cursor.fetchall()}
+
+
+def delete_image(image_id, user_id):
+	"""
+	Удаление изображения.
+
+	Returns:
+		tuple: (найдено, s3_key для удаления из S3 или None, если объект ещё используется)
+	"""
+	with get_db_connection() as conn:
+		cursor = conn.cursor()
+		cursor.execute(
+			'DELETE FROM images WHERE id = %s AND user_id = %s RETURNING s3_key',
+			(image_id, user_id)
+		)
+		result = cursor.fetchone()
+		if not result:
+			return False, None
+		s3_key = result[0]
+		cursor.execute('SELECT 1 FROM images WHERE s3_key = %s LIMIT 1', (s3_key,))
+		still_used = cursor.fetchone() is not None
+		conn.commit()
+		return True, None if still_used else s3_key
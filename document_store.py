@@ -0,0 +1,98 @@
+"""
+Двухуровневое хранилище сгенерированных документов.
+
+Документ скачивают в первые дни после генерации, потом почти никогда.
+Горячий уровень — локальный диск узла (LocalFileCache с бюджетом размера
+и сроком хранения с последнего обращения), холодный — хранилище объектов
+(S3 или storage.FilesystemStorage). Новый документ пишется в оба уровня;
+чтение идёт с диска, а документ, вытесненный с диска, скачивается из
+холодного уровня и снова становится горячим (продвижение при обращении).
+
+Доля чтений с горячего уровня — метрика document_store_hot_hit_ratio
+(по счётчикам document_store_reads_total{tier="hot"|"cold"}).
+"""
+import os
+import uuid
+import logging
+import threading
+import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.describe('document_store_reads_total', 'Generated document reads by tier (hot: local disk, cold: object storage)')
+metrics.describe('document_store_hot_hit_ratio', 'Share of generated document reads served by the hot tier')
+
+
+class TieredDocumentStore:
+    """Горячий уровень на локальном диске поверх хранилища объектов"""
+
+    def __init__(self, storage, hot_cache):
+        """
+        Args:
+            storage: Хранилище объектов (холодный уровень, интерфейс storage.StorageBackend)
+            hot_cache: LocalFileCache горячего уровня (max_bytes и ttl задают бюджет)
+        """
+        self.storage = storage
+        self.hot = hot_cache
+        self._lock = threading.Lock()
+        self._reads = {'hot': 0, 'cold': 0}
+
+    def _count(self, tier):
+        metrics.inc('document_store_reads_total', labels={'tier': tier})
+        with self._lock:
+            self._reads[tier] += 1
+            total = self._reads['hot'] + self._reads['cold']
+            metrics.set_gauge('document_store_hot_hit_ratio', round(self._reads['hot'] / total, 4))
+
+    def put(self, key, path):
+        """
+        Сохранение нового документа: в хранилище объектов и на горячий уровень.
+        Исходный файл остаётся на месте.
+
+        Returns:
+            bool: True, если документ сохранён в хранилище объектов
+        """
+        if not self.storage.upload_file(path, key):
+            return False
+        try:
+            self.hot.put(key, path, move=False)
+        except OSError as e:
+            # Горячий уровень — только ускорение: документ уже в хранилище
+            logger.warning(f"Hot tier write failed for {key}: {e}")
+        return True
+
+    def get_path(self, key):
+        """
+        Локальный путь к документу: с горячего уровня или скачанный из хранилища объектов.
+
+        Returns:
+            str: путь к файлу или None, если документа нет
+        """
+        path = self.hot.get(key)
+        if path is not None:
+            self._count('hot')
+            return path
+        # Продвижение: скачанный документ снова на горячем уровне
+        temp_path = f"{self.hot.path_for(key)}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+        try:
+            if not self.storage.download_file(key, temp_path):
+                return None
+            path = self.hot.put(key, temp_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self._count('cold')
+        return path
+
+    def delete(self, key):
+        """Удаление документа с обоих уровней"""
+        self.hot.remove(key)
+        return self.storage.delete_file(key)
+
+    def stats(self):
+        """Чтения по уровням в этом процессе и доля горячих"""
+        with self._lock:
+            hot, cold = self._reads['hot'], self._reads['cold']
+        total = hot + cold
+        return {'hot': hot, 'cold': cold, 'hot_hit_ratio': round(hot / total, 4) if total else None}
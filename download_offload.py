@@ -0,0 +1,82 @@
+"""
+Отдача файлов через nginx (X-Accel-Redirect).
+
+При DOWNLOAD_OFFLOAD=nginx маршруты скачивания только проверяют доступ и
+путь, а байты отдаёт nginx: ответ приложения пустой, с заголовком
+X-Accel-Redirect на internal-location. Воркер не держится на время
+передачи файла медленному клиенту.
+
+Internal-locations (см. nginx/nginx.conf), префикс — X_ACCEL_PREFIX:
+    <prefix>/output/   — OUTPUT_FOLDER (сгенерированные файлы, горячий уровень истории)
+    <prefix>/cache/    — CACHE_FOLDER (локальный кэш объектов: изображения)
+    <prefix>/hot/      — DOCUMENTS_HOT_FOLDER, если он задан вне OUTPUT_FOLDER
+                         (location добавляется по образцу output)
+    <prefix>/storage/  — STORAGE_PATH (бэкенд filesystem)
+    <prefix>/s3/       — прокси в MinIO по подписанной ссылке (бэкенд s3)
+
+Заголовки ответа приложения (Content-Type, Content-Disposition, Cache-Control)
+nginx сохраняет; ETag передаётся через $upstream_http_etag.
+Модуль не зависит от Flask.
+"""
+import os
+import unicodedata
+from urllib.parse import quote, urlsplit
+from werkzeug.datastructures import Headers
+
+ACCEL_HEADER = 'X-Accel-Redirect'
+
+
+def accel_uri(path, locations, prefix):
+    """
+    URI internal-location для локального файла.
+
+    Args:
+        locations: {имя location: директория}
+        prefix: Префикс internal-location (X_ACCEL_PREFIX)
+
+    Returns:
+        str: URI или None, если файл вне известных директорий
+    """
+    path = os.path.realpath(path)
+    candidates = sorted(
+        ((name, os.path.realpath(directory)) for name, directory in locations.items() if directory),
+        key=lambda item: len(item[1]), reverse=True,
+    )
+    for name, directory in candidates:
+        if os.path.commonpath([path, directory]) != directory or path == directory:
+            continue
+        relative = os.path.relpath(path, directory).replace(os.sep, '/')
+        return f"{prefix.rstrip('/')}/{name}/{quote(relative)}"
+    return None
+
+
+def s3_accel_uri(presigned_url, prefix):
+    """URI internal-location прокси в S3: путь и подпись из ссылки (хост задан в nginx)"""
+    parts = urlsplit(presigned_url)
+    uri = f"{prefix.rstrip('/')}/s3{parts.path}"
+    return f"{uri}?{parts.query}" if parts.query else uri
+
+
+def content_disposition(download_name, as_attachment=True):
+    """Заголовок Content-Disposition (как у flask.send_file: не-ASCII имя — в filename*)"""
+    names = {}
+    if download_name:
+        try:
+            download_name.encode('ascii')
+            names['filename'] = download_name
+        except UnicodeEncodeError:
+            simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+            names['filename'] = simple
+            names['filename*'] = "UTF-8''" + quote(download_name, safe="!#$&+^`|~")
+    headers = Headers()
+    headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline', **names)
+    return headers['Content-Disposition']
+
+
+def accel_response(response_class, uri, mimetype, download_name=None, as_attachment=True):
+    """Пустой ответ, тело которого отдаст nginx"""
+    response = response_class(status=200, mimetype=mimetype)
+    response.headers[ACCEL_HEADER] = uri
+    if download_name or as_attachment:
+        response.headers['Content-Disposition'] = content_disposition(download_name, as_attachment)
+    return response
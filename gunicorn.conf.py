@@ -0,0 +1,40 @@
+"""
+Конфигурация gunicorn.
+
+Веб-воркеры — потоковые (gthread): они держат медленные вызовы MinIO и
+PostgreSQL, не блокируя процесс целиком. CPU-тяжёлый рендеринг выполняется
+в отдельном пуле процессов (render_pool.py), который размеряется независимо.
+Рекомендации по размерам — docs/deployment/SCALING.md.
+"""
+import os
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+workers = int(os.environ.get('WEB_WORKERS', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 8))
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+# Перезапуск веб-воркеров (страховка от утечек в долгоживущих процессах)
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = os.environ.get('GUNICORN_ERROR_LOG', '-')
+# Логи модулей (render_pool: память по шаблонам) — через корневой логгер в stderr
+logconfig_dict = {
+    'root': {'level': os.environ.get('LOG_LEVEL', 'INFO'), 'handlers': ['error_console']},
+}
+
+
+def post_worker_init(worker):
+    """
+    Пул рендеринга поднимается при старте воркера, а не на первом запросе;
+    затем в фоне прогревается кэш популярных шаблонов (/ready ждёт его)
+    """
+    import render_pool
+    import warmup
+    render_pool.start()
+    warmup.start(worker.wsgi)
+
+
+def worker_exit(server, worker):
+    import render_pool
+    render_pool.shutdown()
@@ -0,0 +1,173 @@
+"""
+JSON Patch (RFC 6902) с указателями JSON Pointer (RFC 6901).
+
+Используется для перегенерации документа из истории: клиент присылает
+только изменения контекста, а не весь контекст целиком.
+Операции: add, remove, replace, move, copy, test.
+"""
+from copy import deepcopy
+
+
+class JsonPatchError(ValueError):
+    """Некорректный патч или путь, которого нет в документе"""
+    pass
+
+
+class JsonPatchTestFailed(JsonPatchError):
+    """Операция test не прошла: документ изменился с момента чтения"""
+    pass
+
+
+def parse_pointer(pointer):
+    """
+    Разбор JSON Pointer в список токенов.
+
+    Raises:
+        JsonPatchError: указатель не начинается с "/"
+    """
+    if not isinstance(pointer, str):
+        raise JsonPatchError(f"Invalid JSON pointer: {pointer!r}")
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise JsonPatchError(f"JSON pointer must start with '/': {pointer!r}")
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+
+def json_equal(left, right):
+    """
+    Равенство JSON-значений по RFC 6902 (операция test): типы должны совпадать,
+    true/false не равны числам 1/0, числа сравниваются по значению (1 == 1.0).
+    """
+    if isinstance(left, bool) or isinstance(right, bool):
+        return isinstance(left, bool) and isinstance(right, bool) and left == right
+    if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+        return left == right
+    if isinstance(left, dict) and isinstance(right, dict):
+        return left.keys() == right.keys() and all(json_equal(left[key], right[key]) for key in left)
+    if isinstance(left, list) and isinstance(right, list):
+        return len(left) == len(right) and all(json_equal(a, b) for a, b in zip(left, right))
+    return type(left) is type(right) and left == right
+
+
+def _array_index(container, token, allow_end=False):
+    """Индекс массива из токена: "-" — конец массива (только для add)"""
+    if token == '-' and allow_end:
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token.startswith('0')):
+        raise JsonPatchError(f"Invalid array index: {token!r}")
+    index = int(token)
+    limit = len(container) if allow_end else len(container) - 1
+    if index > limit:
+        raise JsonPatchError(f"Array index out of range: {index}")
+    return index
+
+
+def _resolve(document, tokens):
+    """Значение по токенам указателя"""
+    current = document
+    for token in tokens:
+        if isinstance(current, dict):
+            if token not in current:
+                raise JsonPatchError(f"Path not found: /{'/'.join(tokens)}")
+            current = current[token]
+        elif isinstance(current, list):
+            current = current[_array_index(current, token)]
+        else:
+            raise JsonPatchError(f"Path not found: /{'/'.join(tokens)}")
+    return current
+
+
+def _parent(document, tokens):
+    """Контейнер и последний токен пути"""
+    if not tokens:
+        raise JsonPatchError('Operation on the document root is not supported')
+    return _resolve(document, tokens[:-1]), tokens[-1]
+
+
+def _add(document, tokens, value):
+    container, token = _parent(document, tokens)
+    if isinstance(container, dict):
+        container[token] = value
+    elif isinstance(container, list):
+        container.insert(_array_index(container, token, allow_end=True), value)
+    else:
+        raise JsonPatchError(f"Cannot add to a scalar at /{'/'.join(tokens)}")
+
+
+def _remove(document, tokens):
+    container, token = _parent(document, tokens)
+    if isinstance(container, dict):
+        if token not in container:
+            raise JsonPatchError(f"Path not found: /{'/'.join(tokens)}")
+        return container.pop(token)
+    if isinstance(container, list):
+        return container.pop(_array_index(container, token))
+    raise JsonPatchError(f"Path not found: /{'/'.join(tokens)}")
+
+
+def _replace(document, tokens, value):
+    container, token = _parent(document, tokens)
+    if isinstance(container, dict):
+        if token not in container:
+            raise JsonPatchError(f"Path not found: /{'/'.join(tokens)}")
+        container[token] = value
+    elif isinstance(container, list):
+        container[_array_index(container, token)] = value
+    else:
+        raise JsonPatchError(f"Path not found: /{'/'.join(tokens)}")
+
+
+def apply_patch(document, patch):
+    """
+    Применение патча к копии документа (исходный документ не меняется).
+
+    Args:
+        document: Разобранный JSON (dict/list)
+        patch: Список операций RFC 6902
+
+    Returns:
+        Новый документ
+
+    Raises:
+        JsonPatchError: некорректная операция или путь
+        JsonPatchTestFailed: не прошла операция test
+    """
+    if not isinstance(patch, list):
+        raise JsonPatchError('Patch must be a JSON array of operations')
+
+    result = deepcopy(document)
+    for operation in patch:
+        if not isinstance(operation, dict) or 'op' not in operation or 'path' not in operation:
+            raise JsonPatchError(f"Invalid patch operation: {operation!r}")
+        op = operation['op']
+        tokens = parse_pointer(operation['path'])
+
+        if op in ('add', 'replace', 'test') and 'value' not in operation:
+            raise JsonPatchError(f"Operation '{op}' requires 'value'")
+
+        if op in ('add', 'replace') and not tokens:
+            # Путь "" — замена документа целиком
+            result = deepcopy(operation['value'])
+        elif op == 'add':
+            _add(result, tokens, deepcopy(operation['value']))
+        elif op == 'remove':
+            _remove(result, tokens)
+        elif op == 'replace':
+            _replace(result, tokens, deepcopy(operation['value']))
+        elif op in ('move', 'copy'):
+            if 'from' not in operation:
+                raise JsonPatchError(f"Operation '{op}' requires 'from'")
+            source = parse_pointer(operation['from'])
+            if op == 'move':
+                if tokens[:len(source)] == source and tokens != source:
+                    raise JsonPatchError('Cannot move a value into its own child')
+                _add(result, tokens, _remove(result, source))
+            else:
+                _add(result, tokens, deepcopy(_resolve(result, source)))
+        elif op == 'test':
+            if not json_equal(_resolve(result, tokens), operation['value']):
+                raise JsonPatchTestFailed(f"Test failed at {operation['path']}")
+        else:
+            raise JsonPatchError(f"Unknown patch operation: {op!r}")
+    return result
@@ -0,0 +1,536 @@
+"""
+Нагрузочное тестирование узла: сколько генераций в секунду выдерживает один сервер.
+
+Сценарий — смесь операций (загрузка шаблона, генерация, превью, история,
+фрагменты) с весами; каждый поток — отдельный пользователь со своей сессией
+и keep-alive соединением. Перед замером пользователи регистрируются,
+загружают шаблон и фрагмент (через те же маршруты). Отчёт — пропускная
+способность, перцентили задержки и доля ошибок по каждому маршруту;
+отказы admission control (429 с Retry-After) считаются отдельно от ошибок.
+
+Стенд без внешних сервисов (MinIO и Postgres в контейнерах, образы скачаны заранее):
+    docker compose -f docker-compose.loadtest.yml up -d --build
+    python loadtest.py -c 16 -d 60
+    python loadtest.py -c 32 -d 120 --mix generate=6,parse=1,history=2,snippets=1 \\
+        --rows 1,20,200 --report report.json
+
+Смесь данных: --rows — размеры таблицы встроенного шаблона (выбираются
+равновероятно), --data — свои контексты из JSONL, --template — свой шаблон.
+Модуль использует только стандартную библиотеку и python-docx (для встроенного шаблона).
+"""
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+import http.client
+from io import BytesIO
+from urllib.parse import urlsplit, urlencode
+
+# Операции сценария: имя → (метод, маршрут в отчёте)
+ACTIONS = {
+    'parse': ('POST', '/parse-template'),
+    'generate': ('POST', '/generate'),
+    'preview': ('POST', '/generate?preview=1'),
+    'history': ('GET', '/history'),
+    'history_search': ('GET', '/history/search'),
+    'snippets': ('GET', '/snippets/items'),
+    'snippet_preview': ('GET', '/snippets/items/<id>/preview'),
+}
+DEFAULT_MIX = 'generate=6,preview=1,parse=1,history=2,snippets=1,snippet_preview=1'
+PERCENTILES = (50, 90, 95, 99)
+SNIPPET_MARKER = 'terms'
+# Ответ render_admission при перегрузке узла
+REJECTED_STATUS = 429
+
+
+class LoadTestError(Exception):
+    """Подготовка сценария не удалась (регистрация, загрузка шаблона)"""
+    pass
+
+
+def parse_mix(value):
+    """'generate=6,history=2' → {'generate': 6.0, 'history': 2.0}"""
+    mix = {}
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in ACTIONS:
+            raise argparse.ArgumentTypeError(f"Unknown action: {name}. Available: {', '.join(ACTIONS)}")
+        try:
+            mix[name] = float(weight) if weight else 1.0
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid weight for {name}: {weight}")
+        if mix[name] < 0:
+            raise argparse.ArgumentTypeError(f"Weight must not be negative: {name}")
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("Mix must contain at least one action with positive weight")
+    return mix
+
+
+def parse_rows(value):
+    """'1,20,200' → [1, 20, 200]"""
+    try:
+        rows = [int(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected comma-separated integers, got: {value}")
+    if not rows or min(rows) < 0:
+        raise argparse.ArgumentTypeError("Row counts must be non-negative integers")
+    return rows
+
+
+def percentile(sorted_values, p):
+    """Перцентиль с линейной интерполяцией по отсортированному списку"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class RouteStats:
+    """Задержки и исходы запросов одного маршрута"""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+        self.rejected = 0
+
+    def record(self, latency, status):
+        """status — HTTP-код или None (соединение не удалось)"""
+        self.latencies.append(latency)
+        key = str(status) if status is not None else 'connection'
+        self.statuses[key] = self.statuses.get(key, 0) + 1
+        if status == REJECTED_STATUS:
+            self.rejected += 1
+        elif status is None or status >= 400:
+            self.errors += 1
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        for key, count in other.statuses.items():
+            self.statuses[key] = self.statuses.get(key, 0) + count
+        self.errors += other.errors
+        self.rejected += other.rejected
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies)
+        total = len(latencies)
+        ok = total - self.errors - self.rejected
+        result = {
+            'requests': total,
+            'throughput': round(ok / elapsed, 2) if elapsed else 0.0,
+            'error_rate': round(self.errors / total, 4) if total else 0.0,
+            'rejected_rate': round(self.rejected / total, 4) if total else 0.0,
+            'statuses': dict(sorted(self.statuses.items())),
+        }
+        for p in PERCENTILES:
+            value = percentile(latencies, p)
+            result[f'p{p}_ms'] = round(value * 1000, 1) if value is not None else None
+        result['max_ms'] = round(latencies[-1] * 1000, 1) if latencies else None
+        return result
+
+
+def encode_multipart(fields, files):
+    """
+    Тело multipart/form-data.
+
+    Args:
+        fields: {имя: строка}
+        files: {имя: (имя файла, байты, MIME)}
+
+    Returns:
+        tuple: (тело, Content-Type)
+    """
+    boundary = uuid.uuid4().hex
+    body = BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode('utf-8'))
+        body.write(value.encode('utf-8') + b'\r\n')
+    for name, (filename, content, content_type) in files.items():
+        body.write(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode('utf-8')
+        )
+        body.write(content + b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode('utf-8'))
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+
+class Client:
+    """HTTP-клиент одного пользователя: keep-alive соединение и cookie сессии"""
+
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connect = lambda: connection_class(parts.hostname, parts.port, timeout=timeout)
+        self.prefix = parts.path.rstrip('/')
+        self.connection = None
+        self.cookies = {}
+
+    def request(self, method, path, body=None, content_type=None):
+        """
+        Returns:
+            tuple: (HTTP-код, тело ответа)
+
+        Raises:
+            OSError, http.client.HTTPException: соединение не удалось
+        """
+        headers = {'Accept': 'application/json'}
+        if content_type:
+            headers['Content-Type'] = content_type
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        if self.connection is None:
+            self.connection = self.connect()
+        try:
+            self.connection.request(method, self.prefix + path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            raise
+        for header in response.headers.get_all('Set-Cookie') or []:
+            name, _, value = header.split(';', 1)[0].partition('=')
+            self.cookies[name.strip()] = value.strip()
+        if response.getheader('Connection', '').lower() == 'close':
+            self.connection.close()
+            self.connection = None
+        return response.status, content
+
+    def post_form(self, path, fields):
+        return self.request('POST', path, urlencode(fields).encode('utf-8'), 'application/x-www-form-urlencoded')
+
+    def post_multipart(self, path, fields, files=None):
+        body, content_type = encode_multipart(fields, files or {})
+        return self.request('POST', path, body, content_type)
+
+    def post_json(self, path, data):
+        return self.request('POST', path, json.dumps(data).encode('utf-8'), 'application/json')
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def _json(status, content, what):
+    if status != 200:
+        raise LoadTestError(f"{what} failed: HTTP {status}: {content[:200]!r}")
+    try:
+        return json.loads(content)
+    except ValueError:
+        raise LoadTestError(f"{what} returned non-JSON response (not logged in?)")
+
+
+def build_template():
+    """Встроенный шаблон: поля, таблица на rows строк и SNIPPET-метка"""
+    from docx import Document
+
+    doc = Document()
+    doc.add_paragraph('Договор № {{ number }} от {{ date }}')
+    doc.add_paragraph('Клиент: {{ client.name }}, ИНН {{ client.inn }}')
+    table = doc.add_table(rows=3, cols=3)
+    table.cell(0, 0).text = '{%tr for item in items %}'
+    table.cell(1, 0).text = '{{ item.name }}'
+    table.cell(1, 1).text = '{{ item.quantity }}'
+    table.cell(1, 2).text = '{{ item.price }}'
+    table.cell(2, 0).text = '{%tr endfor %}'
+    doc.add_paragraph('{{SNIPPET:' + SNIPPET_MARKER + '}}')
+    doc.add_paragraph('Итого: {{ total }}')
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def build_snippet():
+    """Встроенный фрагмент для SNIPPET-метки шаблона"""
+    from docx import Document
+
+    doc = Document()
+    for number in range(1, 6):
+        doc.add_paragraph(f'{number}. Стороны несут ответственность в соответствии с законодательством.')
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def build_context(rows, rng):
+    """Контекст встроенного шаблона с таблицей на rows строк"""
+    items = [
+        {'name': f'Позиция {index}', 'quantity': rng.randint(1, 50), 'price': round(rng.uniform(10, 10000), 2)}
+        for index in range(1, rows + 1)
+    ]
+    return {
+        'number': str(rng.randint(1, 99999)),
+        'date': time.strftime('%d.%m.%Y'),
+        'client': {'name': f'ООО «Клиент {rng.randint(1, 999)}»', 'inn': str(rng.randint(10 ** 9, 10 ** 10 - 1))},
+        'items': items,
+        'total': round(sum(item['quantity'] * item['price'] for item in items), 2),
+    }
+
+
+def load_contexts(path):
+    """Контексты из JSONL (по одному на строку)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        contexts = [json.loads(line) for line in f if line.strip()]
+    if not contexts:
+        raise LoadTestError(f"No contexts in {path}")
+    return contexts
+
+
+class VirtualUser:
+    """Пользователь сценария: сессия, загруженный шаблон и фрагмент"""
+
+    def __init__(self, client, username, password):
+        self.client = client
+        self.username = username
+        self.password = password
+        self.template_token = None
+        self.snippet_id = None
+
+    def sign_in(self):
+        """Регистрация (или вход, если пользователь уже есть): успех — редирект"""
+        status, _ = self.client.post_form('/register', {
+            'username': self.username,
+            'email': f'{self.username}@loadtest.local',
+            'password': self.password,
+            'password_confirm': self.password,
+        })
+        if status != 302:
+            status, _ = self.client.post_form('/login', {'username': self.username, 'password': self.password})
+            if status != 302:
+                raise LoadTestError(f"Cannot register or log in as {self.username}: HTTP {status}")
+
+    def prepare(self, template, snippet):
+        """Шаблон сессии и фрагмент для SNIPPET-метки"""
+        self.template_token = _json(*self.parse(template), 'Template upload')['template_file']
+
+        category = _json(*self.client.post_json('/snippets/categories', {'name': 'Load test'}), 'Snippet category')
+        if snippet is not None:
+            result = _json(*self.client.post_multipart(
+                '/snippets/items',
+                {'name': 'Ответственность', 'category_id': str(category['category_id'])},
+                {'file': ('terms.docx', snippet, 'application/octet-stream')},
+            ), 'Snippet upload')
+            self.snippet_id = result['snippet_id']
+
+    def parse(self, template):
+        return self.client.post_multipart(
+            '/parse-template', {}, {'template': ('loadtest.docx', template, 'application/octet-stream')}
+        )
+
+    def generate(self, context, preview=False):
+        snippets = {SNIPPET_MARKER: self.snippet_id} if self.snippet_id else {}
+        return self.client.post_multipart('/generate?preview=1' if preview else '/generate', {
+            'template_file': self.template_token,
+            'data': json.dumps(context, ensure_ascii=False),
+            'snippets': json.dumps(snippets),
+        })
+
+
+class Scenario:
+    """Параметры прогона, общие для всех потоков"""
+
+    def __init__(self, args):
+        self.args = args
+        self.mix = args.mix
+        self.actions = list(self.mix)
+        self.weights = [self.mix[name] for name in self.actions]
+        if args.template:
+            with open(args.template, 'rb') as f:
+                self.template = f.read()
+            self.snippet = None
+        else:
+            self.template = build_template()
+            self.snippet = build_snippet()
+        self.contexts = load_contexts(args.data) if args.data else None
+        self.run_id = args.run_id or uuid.uuid4().hex[:8]
+
+    def context(self, rng):
+        if self.contexts is not None:
+            return rng.choice(self.contexts)
+        return build_context(rng.choice(self.args.rows), rng)
+
+    def execute(self, user, action, rng):
+        """Одна операция сценария → (HTTP-код, тело)"""
+        if action == 'parse':
+            return user.parse(self.template)
+        if action == 'generate':
+            return user.generate(self.context(rng))
+        if action == 'preview':
+            return user.generate(self.context(rng), preview=True)
+        if action == 'history':
+            return user.client.request('GET', '/history?limit=20')
+        if action == 'history_search':
+            return user.client.request('GET', '/history/search?' + urlencode({'q': 'Клиент'}))
+        if action == 'snippets':
+            return user.client.request('GET', '/snippets/items')
+        if action == 'snippet_preview':
+            if user.snippet_id is None:
+                return user.client.request('GET', '/snippets/items')
+            return user.client.request('GET', f'/snippets/items/{user.snippet_id}/preview')
+        raise ValueError(action)
+
+
+def _worker(scenario, index, start_barrier, state, results):
+    """Поток нагрузки: подготовка пользователя, затем операции до конца прогона"""
+    args = scenario.args
+    rng = random.Random(args.seed * 1000 + index)
+    client = Client(args.base_url, args.timeout)
+    user = VirtualUser(client, f'loadtest_{scenario.run_id}_{index}', 'loadtest-password')
+    stats = {}
+    try:
+        try:
+            user.sign_in()
+            user.prepare(scenario.template, scenario.snippet)
+        except (LoadTestError, OSError, http.client.HTTPException) as e:
+            state['setup_errors'].append(f"user {index}: {e}")
+            return
+        finally:
+            start_barrier.wait()
+
+        while not state['stop'].is_set():
+            action = rng.choices(scenario.actions, scenario.weights)[0]
+            started = time.perf_counter()
+            try:
+                status, _ = scenario.execute(user, action, rng)
+            except (OSError, http.client.HTTPException):
+                status = None
+            finished = time.perf_counter()
+            if finished >= state['measure_from'] and not state['stop'].is_set():
+                stats.setdefault(action, RouteStats()).record(finished - started, status)
+            if args.think_time:
+                time.sleep(rng.uniform(0, 2 * args.think_time))
+    finally:
+        client.close()
+        results.append(stats)
+
+
+def run(args):
+    """
+    Прогон сценария.
+
+    Returns:
+        dict: отчёт (параметры, итог и статистика по маршрутам)
+    """
+    scenario = Scenario(args)
+    start_barrier = threading.Barrier(args.concurrency + 1)
+    state = {'stop': threading.Event(), 'measure_from': float('inf'), 'setup_errors': []}
+    results = []
+
+    threads = [
+        threading.Thread(target=_worker, args=(scenario, index, start_barrier, state, results), daemon=True)
+        for index in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    if state['setup_errors'] and len(state['setup_errors']) == args.concurrency:
+        state['stop'].set()
+        raise LoadTestError('All users failed to set up: ' + '; '.join(state['setup_errors'][:3]))
+
+    started = time.perf_counter()
+    state['measure_from'] = started + args.warmup
+    time.sleep(args.warmup + args.duration)
+    state['stop'].set()
+    elapsed = time.perf_counter() - state['measure_from']
+    for thread in threads:
+        thread.join(args.timeout + 5)
+
+    merged = {}
+    for stats in results:
+        for action, route_stats in stats.items():
+            merged.setdefault(action, RouteStats()).merge(route_stats)
+    total = RouteStats()
+    for route_stats in merged.values():
+        total.merge(route_stats)
+
+    return {
+        'base_url': args.base_url,
+        'concurrency': args.concurrency,
+        'duration_s': round(elapsed, 2),
+        'mix': scenario.mix,
+        'setup_errors': state['setup_errors'],
+        'total': total.summary(elapsed),
+        'routes': {
+            f"{ACTIONS[action][0]} {ACTIONS[action][1]}": route_stats.summary(elapsed)
+            for action, route_stats in sorted(merged.items())
+        },
+    }
+
+
+def format_report(report):
+    """Отчёт в виде таблицы для терминала"""
+    columns = ['requests', 'throughput', 'error_rate', 'rejected_rate'] + [f'p{p}_ms' for p in PERCENTILES] + ['max_ms']
+    headers = ['route', 'req', 'ok/s', 'err%', 'rej%'] + [f'p{p}' for p in PERCENTILES] + ['max']
+    rows = []
+    for route, summary in list(report['routes'].items()) + [('TOTAL', report['total'])]:
+        values = []
+        for column in columns:
+            value = summary[column]
+            if column.endswith('_rate'):
+                value = f'{value * 100:.2f}'
+            values.append('-' if value is None else str(value))
+        rows.append([route] + values)
+    widths = [max(len(str(row[i])) for row in rows + [headers]) for i in range(len(headers))]
+    lines = [
+        f"{report['base_url']}: {report['concurrency']} users, {report['duration_s']} s measured (latency in ms)",
+        '  '.join(header.ljust(widths[i]) if i == 0 else header.rjust(widths[i]) for i, header in enumerate(headers)),
+    ]
+    for row in rows:
+        lines.append('  '.join(value.ljust(widths[i]) if i == 0 else value.rjust(widths[i]) for i, value in enumerate(row)))
+    if report['setup_errors']:
+        lines.append(f"Setup failed for {len(report['setup_errors'])} users: {report['setup_errors'][0]}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный сценарий для одного узла DOCX Template Filler")
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000', help='Адрес приложения (без nginx)')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='Число одновременных пользователей')
+    parser.add_argument('-d', '--duration', type=float, default=60, help='Длительность замера, секунд')
+    parser.add_argument('--warmup', type=float, default=10,
+                        help='Прогрев перед замером, секунд (запросы не входят в отчёт)')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'Веса операций: {DEFAULT_MIX}')
+    parser.add_argument('--rows', type=parse_rows, default=[1, 20, 200],
+                        help='Размеры таблицы встроенного шаблона, выбираются равновероятно')
+    parser.add_argument('--template', default=None, help='Свой DOCX шаблон вместо встроенного')
+    parser.add_argument('--data', default=None, help='JSONL с контекстами для --template')
+    parser.add_argument('--think-time', type=float, default=0,
+                        help='Средняя пауза пользователя между запросами, секунд')
+    parser.add_argument('--timeout', type=float, default=60, help='Таймаут запроса, секунд')
+    parser.add_argument('--seed', type=int, default=1, help='Зерно генератора смеси запросов')
+    parser.add_argument('--run-id', default=None, help='Суффикс имён пользователей (повторный прогон теми же)')
+    parser.add_argument('--report', default=None, help='Записать отчёт в JSON')
+    args = parser.parse_args(argv)
+
+    if args.template and not args.data:
+        parser.error('--template requires --data with contexts for it')
+    if args.concurrency < 1:
+        parser.error('--concurrency must be at least 1')
+
+    try:
+        report = run(args)
+    except LoadTestError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    print(format_report(report))
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0 if not report['setup_errors'] else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+Локальный дисковый кэш объектов S3 (шаблоны библиотеки, фрагменты).
+
+Ключи S3 содержат uuid или хеш содержимого и не переиспользуются, поэтому
+закэшированный файл никогда не устаревает: инвалидация не нужна, только вытеснение по размеру.
+Кэш общий для всех воркеров узла — файлы появляются атомарно (os.replace).
+
+Рядом с файлом хранятся результаты предобработки (например, извлечённые
+переменные шаблона) в виде JSON: <hash>.<name>.json.
+
+Обход директории при вытеснении не делается на каждую запись: процесс
+ведёт оценку размера кэша (по последнему обходу плюс свои записи) и обходит
+директорию, когда оценка превысила бюджет или прошло scan_interval секунд
+(записи других воркеров и истёкшие по ttl файлы).
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.describe('file_cache_hits_total', 'Local file cache hits')
+metrics.describe('file_cache_misses_total', 'Local file cache misses (downloaded from S3)')
+metrics.describe('file_cache_evictions_total', 'Files evicted from the local cache')
+
+
+class LocalFileCache:
+    """Кэш файлов по ключу S3 с вытеснением давно не использованных"""
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, min_age=300, ttl=None, scan_interval=60):
+        """
+        Args:
+            directory: Директория кэша
+            max_bytes: Бюджет на диске
+            min_age: Файлы, использованные позже чем min_age секунд назад, не вытесняются
+                     (путь мог быть уже передан в пул рендеринга)
+            ttl: Файлы, не использованные ttl секунд, считаются отсутствующими
+                 и удаляются при вытеснении (None — без срока)
+            scan_interval: Обход директории при записи не чаще, чем раз в scan_interval
+                           секунд, пока оценка размера в пределах бюджета
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self.ttl = ttl
+        self.scan_interval = scan_interval
+        self._lock = threading.Lock()
+        # Оценка размера: None — директорию ещё не обходили
+        self._estimated_size = None
+        self._scanned_at = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _base(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def path_for(self, key):
+        """Путь файла в кэше (расширение сохраняется — python-docx его не требует, но так нагляднее)"""
+        return self._base(key) + os.path.splitext(key)[1]
+
+    def get(self, key):
+        """Путь к файлу, если он в кэше (отмечает использование), иначе None"""
+        path = self.path_for(key)
+        try:
+            if self.ttl is not None and os.stat(path).st_mtime < time.time() - self.ttl:
+                self._remove_file(path)
+                return None
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def remove(self, key):
+        """Удаление файла из кэша (если есть)"""
+        self._remove_file(self.path_for(key))
+
+    def fetch(self, key, download):
+        """
+        Файл из кэша или скачанный через download(key, path).
+
+        Args:
+            download: Функция скачивания, возвращающая True при успехе
+                      (сигнатура как у S3Client.download_file)
+
+        Returns:
+            str: путь к файлу в кэше или None, если скачать не удалось
+        """
+        path = self.get(key)
+        if path is not None:
+            metrics.inc('file_cache_hits_total')
+            return path
+
+        metrics.inc('file_cache_misses_total')
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            if not download(key, temp_path):
+                return None
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        self._written(path)
+        return path
+
+    def put(self, key, source_path, move=True):
+        """
+        Помещение локального файла в кэш.
+
+        Args:
+            move: Переместить файл (иначе скопировать)
+
+        Returns:
+            str: путь к файлу в кэше
+        """
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        if move:
+            shutil.move(source_path, temp_path)
+        else:
+            shutil.copyfile(source_path, temp_path)
+        os.replace(temp_path, path)
+        self._written(path)
+        return path
+
+    def get_meta(self, key, name):
+        """Результат предобработки файла или None"""
+        try:
+            with open(f"{self._base(key)}.{name}.json", 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set_meta(self, key, name, value):
+        """Сохранение результата предобработки рядом с файлом"""
+        meta_path = f"{self._base(key)}.{name}.json"
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        temp_path = f"{meta_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(temp_path, meta_path)
+
+    def _entries(self):
+        """Все файлы кэша: (время использования, размер, путь)"""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def size(self):
+        """Текущий размер кэша, байт"""
+        return sum(size for _, size, _ in self._entries())
+
+    def _written(self, path):
+        """Учёт записанного файла; вытеснение, если оценка сверх бюджета или пора обойти директорию"""
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = 0
+        with self._lock:
+            due = self._estimated_size is None or time.monotonic() - self._scanned_at >= self.scan_interval
+            if not due:
+                self._estimated_size += size
+                due = self._estimated_size > self.max_bytes
+            if not due:
+                return 0
+            # Отметка обхода: потоки, записавшие файл во время обхода, не запускают его по интервалу
+            self._scanned_at = time.monotonic()
+        return self.evict()
+
+    def evict(self):
+        """Вытеснение файлов старше ttl и давно не использованных — до бюджета"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        with self._lock:
+            self._estimated_size = total
+            self._scanned_at = time.monotonic()
+        now = time.time()
+        expired_before = now - self.ttl if self.ttl is not None else None
+        has_expired = expired_before is not None and any(mtime < expired_before for mtime, _, _ in entries)
+        if total <= self.max_bytes and not has_expired:
+            return 0
+
+        removed = 0
+        cutoff = now - self.min_age
+        for mtime, size, path in sorted(entries):
+            expired = expired_before is not None and mtime < expired_before
+            if not expired and (total <= self.max_bytes or mtime > cutoff):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self._estimated_size = total
+        if removed:
+            metrics.inc('file_cache_evictions_total', removed)
+            logger.info(f"Local cache: evicted {removed} files, {total / 1024 / 1024:.1f} MB left")
+        return removed
@@ -0,0 +1,249 @@
+"""
+Изображения в контексте генерации (логотипы, подписи, печати).
+
+Изображение загружается один раз (/images) и хранится в S3 под ключом
+по хешу содержимого; в контексте на него ссылаются по id:
+
+    {"logo": {"$image": 12, "width_mm": 40}}
+
+Размер задаётся width_mm и/или height_mm (второй — по пропорциям); без
+размеров изображение выводится в натуральную величину при IMAGE_DPI.
+Перед рендерингом ссылка превращается в вариант изображения, уменьшенный
+и пережатый под целевой размер: вариант хранится в локальном кэше по
+ключу media/<sha256>/<ширина>x<высота><расширение> и создаётся один раз
+на размер. В шаблоне вариант становится InlineImage docxtpl; python-docx
+добавляет одинаковые изображения в пакет один раз (по SHA1 содержимого).
+
+Вариант в контексте — объект ImageVariant, который нельзя получить из JSON:
+путь к файлу на сервере задаёт только substitute_images. Служебные ключи
+(RESERVED_KEYS) во входящем контексте запрещены.
+
+Модуль не зависит от Flask, БД и S3.
+"""
+import math
+import os
+from collections import namedtuple
+from PIL import Image, ImageOps
+
+# Ключ ссылки на загруженное изображение в контексте
+IMAGE_REF_KEY = '$image'
+# Ключи, которые клиент не может передать в контексте (служебные, прежний формат варианта)
+IMAGE_PATH_KEY = '$image_path'
+RESERVED_KEYS = frozenset({IMAGE_PATH_KEY})
+
+# Форматы загрузки: формат Pillow → (расширение, MIME)
+FORMATS = {
+    'PNG': ('.png', 'image/png'),
+    'JPEG': ('.jpg', 'image/jpeg'),
+    'GIF': ('.gif', 'image/gif'),
+}
+
+JPEG_QUALITY = 85
+MM_PER_INCH = 25.4
+
+
+class InvalidImage(ValueError):
+    """Файл не является изображением поддерживаемого формата или ссылка некорректна"""
+    pass
+
+
+# Разрешённый на сервере вариант изображения (передаётся в пул рендеринга через pickle)
+ImageVariant = namedtuple('ImageVariant', ('path', 'width_mm', 'height_mm'))
+
+
+def inspect_image(path, max_pixels=40_000_000):
+    """
+    Проверка загруженного файла изображения.
+
+    Returns:
+        dict: format, extension, content_type, width, height
+
+    Raises:
+        InvalidImage: не изображение, неподдерживаемый формат или слишком много пикселей
+    """
+    try:
+        with Image.open(path) as image:
+            image_format = image.format
+            width, height = image.size
+            image.verify()
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise InvalidImage(f"Not a valid image: {e}")
+
+    if image_format not in FORMATS:
+        raise InvalidImage(f"Unsupported image format: {image_format}. Allowed: PNG, JPEG, GIF")
+    if width * height > max_pixels:
+        raise InvalidImage(f"Image is too large: {width}x{height} pixels")
+
+    extension, content_type = FORMATS[image_format]
+    return {
+        'format': image_format,
+        'extension': extension,
+        'content_type': content_type,
+        'width': width,
+        'height': height,
+    }
+
+
+def _positive_number(value, name):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        raise InvalidImage(f"{name} must be a positive number")
+    return float(value)
+
+
+def parse_ref(value):
+    """
+    Ссылка на изображение в значении контекста.
+
+    Returns:
+        tuple: (id изображения, width_mm или None, height_mm или None) или None, если это не ссылка
+
+    Raises:
+        InvalidImage: ссылка с некорректным id или размером
+    """
+    if not isinstance(value, dict) or IMAGE_REF_KEY not in value:
+        return None
+    image_id = value[IMAGE_REF_KEY]
+    if isinstance(image_id, bool) or not isinstance(image_id, int):
+        raise InvalidImage(f"{IMAGE_REF_KEY} must be an image id")
+    return (
+        image_id,
+        _positive_number(value.get('width_mm'), 'width_mm'),
+        _positive_number(value.get('height_mm'), 'height_mm'),
+    )
+
+
+def _walk(value, on_ref):
+    """
+    Обход контекста: ссылки на изображения заменяются результатом on_ref(ref).
+
+    Raises:
+        InvalidImage: в контексте есть служебный ключ (RESERVED_KEYS)
+    """
+    ref = parse_ref(value)
+    if ref is not None:
+        return on_ref(ref)
+    if isinstance(value, dict):
+        reserved = RESERVED_KEYS.intersection(value)
+        if reserved:
+            raise InvalidImage(f"Reserved key in context: {', '.join(sorted(reserved))}")
+        return {key: _walk(item, on_ref) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_walk(item, on_ref) for item in value]
+    return value
+
+
+def find_image_refs(context):
+    """
+    Уникальные ссылки на изображения в контексте (в порядке появления).
+
+    Raises:
+        InvalidImage: некорректная ссылка или служебный ключ в контексте
+    """
+    refs = []
+
+    def collect(ref):
+        if ref not in refs:
+            refs.append(ref)
+        return None
+
+    _walk(context, collect)
+    return refs
+
+
+def fit(original_size, width_mm=None, height_mm=None, dpi=200):
+    """
+    Размер на странице и размер варианта в пикселях.
+
+    Вариант не больше оригинала (изображение не увеличивается) и не больше,
+    чем нужно для dpi на странице.
+
+    Returns:
+        tuple: ((ширина, высота) в пикселях, (width_mm, height_mm))
+    """
+    original_width, original_height = original_size
+    if width_mm is None and height_mm is None:
+        width_mm = original_width / dpi * MM_PER_INCH
+        height_mm = original_height / dpi * MM_PER_INCH
+    elif height_mm is None:
+        height_mm = width_mm * original_height / original_width
+    elif width_mm is None:
+        width_mm = height_mm * original_width / original_height
+
+    target_width = math.ceil(width_mm / MM_PER_INCH * dpi)
+    target_height = math.ceil(height_mm / MM_PER_INCH * dpi)
+    pixels = (min(target_width, original_width), min(target_height, original_height))
+    return pixels, (round(width_mm, 2), round(height_mm, 2))
+
+
+def variant_extension(image_format):
+    """JPEG остаётся JPEG, остальные форматы (с прозрачностью, GIF) — PNG"""
+    return '.jpg' if image_format == 'JPEG' else '.png'
+
+
+def variant_key(content_hash, pixels, extension):
+    """Ключ варианта изображения в локальном кэше"""
+    return f"media/{content_hash}/{pixels[0]}x{pixels[1]}{extension}"
+
+
+def resize_image(source_path, output_path, pixels, jpeg_quality=JPEG_QUALITY):
+    """
+    Вариант изображения: поворот по EXIF, уменьшение до pixels, пережатие
+    без метаданных. Формат выходного файла — по расширению output_path.
+    """
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.size != tuple(pixels):
+            image = image.resize(tuple(pixels), Image.LANCZOS)
+
+        if os.path.splitext(output_path)[1].lower() == '.jpg':
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            image.save(output_path, 'JPEG', quality=jpeg_quality, optimize=True, progressive=True)
+        else:
+            if image.mode == 'P':
+                image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+            image.save(output_path, 'PNG', optimize=True)
+
+
+def substitute_images(context, resolved):
+    """
+    Замена ссылок в контексте на варианты изображений.
+
+    Args:
+        resolved: {ссылка (как в find_image_refs): (путь к варианту, (width_mm, height_mm))}
+
+    Returns:
+        Новый контекст: ссылки заменены на ImageVariant
+    """
+    def replace(ref):
+        path, (width_mm, height_mm) = resolved[ref]
+        return ImageVariant(path, width_mm, height_mm)
+
+    return _walk(context, replace)
+
+
+def bind_images(template, context):
+    """
+    Варианты изображений в контексте → InlineImage шаблона (в процессе рендеринга).
+    Одинаковые варианты получают один и тот же объект InlineImage. Привязываются
+    только ImageVariant из substitute_images: словари из JSON остаются данными.
+    """
+    from docx.shared import Mm
+    from docxtpl import InlineImage
+
+    images = {}
+
+    def bind(value):
+        if isinstance(value, ImageVariant):
+            if value not in images:
+                images[value] = InlineImage(template, value.path, width=Mm(value.width_mm), height=Mm(value.height_mm))
+            return images[value]
+        if isinstance(value, dict):
+            return {name: bind(item) for name, item in value.items()}
+        if isinstance(value, list):
+            return [bind(item) for item in value]
+        return value
+
+    return bind(context)
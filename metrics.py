@@ -0,0 +1,77 @@
+"""
+Метрики процесса в текстовом формате Prometheus.
+
+Значения хранятся в памяти процесса: при нескольких воркерах gunicorn
+каждый отдаёт свои, поэтому у всех метрик есть метка pid.
+"""
+import os
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_help = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted((labels or {}).items()))
+
+
+def describe(name, help_text):
+    """Описание метрики для строки # HELP"""
+    _help[name] = help_text
+
+
+def inc(name, value=1, labels=None):
+    """Увеличение счётчика"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, labels=None):
+    """Установка значения gauge"""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def add_gauge(name, delta, labels=None):
+    """Изменение gauge на delta (например, +1/-1 для очереди)"""
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + delta
+
+
+def get_value(name, labels=None):
+    """Текущее значение счётчика или gauge (для тестов и /health)"""
+    key = _key(name, labels)
+    with _lock:
+        return _counters.get(key, _gauges.get(key, 0))
+
+
+def _format_labels(labels):
+    labels = dict(labels)
+    labels['pid'] = os.getpid()
+    parts = []
+    for key, value in sorted(labels.items()):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{escaped}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def render():
+    """Все метрики процесса в формате Prometheus text exposition"""
+    lines = []
+    with _lock:
+        series = [(key, value, 'counter') for key, value in _counters.items()]
+        series += [(key, value, 'gauge') for key, value in _gauges.items()]
+
+    described = set()
+    for (name, labels), value, metric_type in sorted(series, key=lambda item: item[0]):
+        if name not in described:
+            if name in _help:
+                lines.append(f'# HELP {name} {_help[name]}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            described.add(name)
+        lines.append(f'{name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
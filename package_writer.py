@@ -0,0 +1,199 @@
+"""
+Сохранение DOCX с копированием неизменённых частей из шаблона как есть.
+
+python-docx при сохранении заново сериализует и сжимает (deflate) все
+части пакета, в том числе изображения и шрифты, которых рендеринг не
+касается. Здесь каждая часть сравнивается с записью исходного архива по
+CRC-32 и размеру: совпавшие записи копируются сжатыми байтами без
+распаковки и повторного сжатия, изменённые XML-части сжимаются с уровнем
+DOCX_COMPRESS_LEVEL, новые уже сжатые медиафайлы (PNG, JPEG) сохраняются без сжатия.
+
+Архив пишется напрямую (локальные заголовки, центральный каталог):
+zipfile не умеет записывать заранее сжатые данные. ZIP64 не поддерживается —
+для таких пакетов используется обычное сохранение python-docx.
+"""
+import os
+import time
+import uuid
+import zlib
+import struct
+import logging
+import zipfile
+from io import BytesIO
+from docx.opc.pkgwriter import PackageWriter
+
+logger = logging.getLogger(__name__)
+
+# Уровень сжатия изменённых частей: 1 — быстрее, 9 — меньше файл
+DOCX_COMPRESS_LEVEL = int(os.environ.get('DOCX_COMPRESS_LEVEL', 6))
+
+# Форматы, которые deflate почти не уменьшает
+_STORED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.mp3', '.mp4', '.zip', '.odttf'}
+
+_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+_CENTRAL_HEADER = struct.Struct('<4s6H3L5H2L')
+_END_RECORD = struct.Struct('<4s4H2LH')
+_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+_ZIP32_LIMIT = 0xFFFFFFFF
+_UTF8_FLAG = 0x800
+
+
+class _Zip64Required(Exception):
+    """Пакет не помещается в ZIP без расширения ZIP64"""
+    pass
+
+
+def _dos_datetime(date_time):
+    year, month, day, hour, minute, second = date_time[:6]
+    return (
+        (max(year, 1980) - 1980) << 9 | month << 5 | day,
+        hour << 11 | minute << 5 | second // 2,
+    )
+
+
+class RawCopyZipWriter:
+    """
+    PhysPkgWriter python-docx (write(pack_uri, blob), close()): записи,
+    совпадающие с исходным архивом, копируются без перепаковки.
+    """
+
+    def __init__(self, output, source, compresslevel=DOCX_COMPRESS_LEVEL):
+        """
+        Args:
+            output: Поток записи архива
+            source: Поток исходного архива (с seek)
+        """
+        self.output = output
+        self.compresslevel = compresslevel
+        self.source = source
+        with zipfile.ZipFile(source) as archive:
+            self.source_entries = {info.filename: info for info in archive.infolist()}
+        self.entries = []
+        self.offset = 0
+        self.now = _dos_datetime(time.localtime())
+        self.stats = {'copied': 0, 'compressed': 0, 'stored': 0}
+
+    def _raw_source_data(self, info):
+        """Сжатые байты записи исходного архива (без распаковки)"""
+        self.source.seek(info.header_offset)
+        header = self.source.read(_LOCAL_HEADER.size)
+        fields = _LOCAL_HEADER.unpack(header)
+        if fields[0] != _LOCAL_HEADER_SIGNATURE:
+            return None
+        name_length, extra_length = fields[9], fields[10]
+        self.source.seek(info.header_offset + _LOCAL_HEADER.size + name_length + extra_length)
+        return self.source.read(info.compress_size)
+
+    def write(self, pack_uri, blob):
+        name = pack_uri.membername
+        crc = zlib.crc32(blob)
+        info = self.source_entries.get(name)
+
+        if (info is not None and info.CRC == crc and info.file_size == len(blob)
+                and info.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) and not info.flag_bits & 0x1):
+            data = self._raw_source_data(info)
+            if data is not None and len(data) == info.compress_size:
+                self._add(name, data, crc, len(blob), info.compress_type, _dos_datetime(info.date_time))
+                self.stats['copied'] += 1
+                return
+
+        if os.path.splitext(name)[1].lower() in _STORED_EXTENSIONS:
+            self._add(name, blob, crc, len(blob), zipfile.ZIP_STORED, self.now)
+            self.stats['stored'] += 1
+            return
+
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        data = compressor.compress(blob) + compressor.flush()
+        self._add(name, data, crc, len(blob), zipfile.ZIP_DEFLATED, self.now)
+        self.stats['compressed'] += 1
+
+    def _add(self, name, data, crc, size, compress_type, date_time):
+        if self.offset > _ZIP32_LIMIT or size > _ZIP32_LIMIT or len(data) > _ZIP32_LIMIT:
+            raise _Zip64Required(name)
+        encoded = name.encode('utf-8')
+        flags = 0 if encoded.isascii() else _UTF8_FLAG
+        date, clock = date_time
+        header = _LOCAL_HEADER.pack(
+            _LOCAL_HEADER_SIGNATURE, 20, flags, compress_type, clock, date,
+            crc, len(data), size, len(encoded), 0,
+        )
+        self.output.write(header)
+        self.output.write(encoded)
+        self.output.write(data)
+        self.entries.append((encoded, flags, compress_type, clock, date, crc, len(data), size, self.offset))
+        self.offset += len(header) + len(encoded) + len(data)
+
+    def close(self):
+        """Центральный каталог и запись конца архива"""
+        if len(self.entries) >= 0xFFFF:
+            raise _Zip64Required('too many entries')
+        directory_offset = self.offset
+        directory_size = 0
+        for encoded, flags, compress_type, clock, date, crc, compressed, size, offset in self.entries:
+            header = _CENTRAL_HEADER.pack(
+                b'PK\x01\x02', 20, 20, flags, compress_type, clock, date,
+                crc, compressed, size, len(encoded), 0, 0, 0, 0, 0, offset,
+            )
+            self.output.write(header)
+            self.output.write(encoded)
+            directory_size += len(header) + len(encoded)
+        if directory_offset > _ZIP32_LIMIT:
+            raise _Zip64Required('central directory offset')
+        self.output.write(_END_RECORD.pack(
+            b'PK\x05\x06', 0, 0, len(self.entries), len(self.entries), directory_size, directory_offset, 0,
+        ))
+
+
+def _write_package(package, output, source, compresslevel):
+    writer = RawCopyZipWriter(output, source, compresslevel)
+    PackageWriter._write_content_types_stream(writer, package.parts)
+    PackageWriter._write_pkg_rels(writer, package.rels)
+    PackageWriter._write_parts(writer, package.parts)
+    writer.close()
+    return writer.stats
+
+
+def save_package(document, output, source, compresslevel=None):
+    """
+    Сохранение документа python-docx: неизменённые части копируются из source.
+
+    Args:
+        document: python-docx Document
+        output: Путь или поток результата
+        source: DOCX, из которого документ был открыт (путь или поток с seek)
+        compresslevel: Уровень сжатия изменённых частей (по умолчанию DOCX_COMPRESS_LEVEL)
+
+    Returns:
+        dict: {'copied', 'compressed', 'stored'} — число записей каждого вида
+              или None, если пакет сохранён обычным путём (нужен ZIP64)
+    """
+    if compresslevel is None:
+        compresslevel = DOCX_COMPRESS_LEVEL
+    package = document.part.package
+    # Как OpcPackage.save: части готовятся к записи (например, обновляют свойства)
+    for part in package.parts:
+        part.before_marshal()
+
+    source_file = open(source, 'rb') if isinstance(source, (str, os.PathLike)) else source
+    try:
+        if isinstance(output, (str, os.PathLike)):
+            temp_path = f"{output}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(temp_path, 'wb') as temp:
+                    stats = _write_package(package, temp, source_file, compresslevel)
+                os.replace(temp_path, output)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        else:
+            buffer = BytesIO()
+            stats = _write_package(package, buffer, source_file, compresslevel)
+            output.write(buffer.getbuffer())
+        return stats
+    except _Zip64Required as e:
+        logger.info(f"Package needs ZIP64 ({e}), saving with python-docx")
+        document.save(output)
+        return None
+    finally:
+        if source_file is not source:
+            source_file.close()
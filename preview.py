@@ -0,0 +1,414 @@
+"""
+HTML-превью DOCX: обход XML документа без сохранения файла и без Word.
+
+Поддерживаются параграфы с форматированием runs (жирный, курсив,
+подчёркивание, зачёркивание, индексы, табуляции, переносы), заголовки,
+нумерованные и маркированные списки, таблицы (объединённые и вложенные
+ячейки), колонтитулы первого раздела. Изображения заменяются заглушкой.
+
+Страницы приблизительные: документ делится по явным разрывам страниц
+и разделов, а длинные участки без разрывов — по числу блоков.
+Модуль не зависит от Flask: превью строится в процессе пула рендеринга.
+"""
+from html import escape
+from docx.oxml.ns import qn
+
+# Параграфов (строк таблиц, пунктов списка) на страницу превью без явных разрывов
+BLOCKS_PER_PAGE = 40
+
+_ALIGNMENT = {'center': 'center', 'right': 'right', 'end': 'right', 'both': 'justify', 'distribute': 'justify'}
+
+
+def _local_name(element):
+    tag = element.tag
+    return tag.split('}')[-1] if isinstance(tag, str) and '}' in tag else tag
+
+
+def _is_on(properties, tag):
+    """Флаг форматирования (w:b, w:i, ...): наличие элемента без val="0"/"false" """
+    element = properties.find(qn(tag))
+    if element is None:
+        return False
+    return element.get(qn('w:val')) not in ('0', 'false', 'none')
+
+
+class _Block:
+    """Блок верхнего уровня: HTML и его «вес» для разбиения на страницы"""
+
+    __slots__ = ('html', 'weight', 'break_before', 'break_after')
+
+    def __init__(self, html, weight=1, break_before=False, break_after=False):
+        self.html = html
+        self.weight = weight
+        self.break_before = break_before
+        self.break_after = break_after
+
+
+class HtmlPreview:
+    """Построитель HTML-превью открытого python-docx Document"""
+
+    def __init__(self, document, body=None):
+        """
+        Args:
+            document: python-docx Document (стили, нумерация, колонтитулы)
+            body: Элемент w:body, если тело не в документе (см. rendering.render_document)
+        """
+        self.document = document
+        self.body = body if body is not None else document.element.body
+        self._numbering = self._load_numbering()
+        self._headings, self._style_numbering = self._load_styles()
+
+    # ===== Справочники документа =====
+
+    def _load_numbering(self):
+        """{(numId, ilvl): numFmt} из numbering.xml"""
+        try:
+            numbering = self.document.part.numbering_part.element
+        except (NotImplementedError, KeyError, AttributeError):
+            return {}
+
+        abstract_formats = {}
+        for abstract in numbering.findall(qn('w:abstractNum')):
+            levels = {}
+            for level in abstract.findall(qn('w:lvl')):
+                fmt = level.find(qn('w:numFmt'))
+                levels[level.get(qn('w:ilvl'))] = fmt.get(qn('w:val')) if fmt is not None else 'decimal'
+            abstract_formats[abstract.get(qn('w:abstractNumId'))] = levels
+
+        formats = {}
+        for num in numbering.findall(qn('w:num')):
+            abstract_id = num.find(qn('w:abstractNumId'))
+            if abstract_id is None:
+                continue
+            for ilvl, fmt in abstract_formats.get(abstract_id.get(qn('w:val')), {}).items():
+                formats[(num.get(qn('w:numId')), ilvl)] = fmt
+        return formats
+
+    def _load_styles(self):
+        """
+        Справочник стилей параграфов.
+
+        Returns:
+            tuple: ({styleId: уровень заголовка} для Heading N / Title,
+                    {styleId: w:numPr} для стилей списков)
+        """
+        headings = {}
+        numbering = {}
+        try:
+            styles = self.document.styles.element
+        except (NotImplementedError, KeyError, AttributeError):
+            return headings, numbering
+        for style in styles.findall(qn('w:style')):
+            ppr = style.find(qn('w:pPr'))
+            if ppr is not None and ppr.find(qn('w:numPr')) is not None:
+                numbering[style.get(qn('w:styleId'))] = ppr.find(qn('w:numPr'))
+            name = style.find(qn('w:name'))
+            name = (name.get(qn('w:val')) if name is not None else '').lower()
+            if name == 'title':
+                headings[style.get(qn('w:styleId'))] = 1
+            elif name.startswith('heading '):
+                level = name.split(' ', 1)[1]
+                if level.isdigit():
+                    headings[style.get(qn('w:styleId'))] = min(int(level), 6)
+        return headings, numbering
+
+    # ===== Runs и параграфы =====
+
+    def _run_html(self, run):
+        """HTML одного w:r; второй элемент — был ли в run разрыв страницы"""
+        parts = []
+        page_break = False
+        for child in run:
+            name = _local_name(child)
+            if name == 't':
+                parts.append(escape(child.text or ''))
+            elif name == 'tab':
+                parts.append('&emsp;')
+            elif name == 'br':
+                if child.get(qn('w:type')) == 'page':
+                    page_break = True
+                else:
+                    parts.append('<br>')
+            elif name == 'cr':
+                parts.append('<br>')
+            elif name in ('drawing', 'pict', 'object'):
+                parts.append('<span class="docx-image">[изображение]</span>')
+
+        text = ''.join(parts)
+        rpr = run.find(qn('w:rPr'))
+        if text and rpr is not None:
+            if _is_on(rpr, 'w:b'):
+                text = f'<strong>{text}</strong>'
+            if _is_on(rpr, 'w:i'):
+                text = f'<em>{text}</em>'
+            if _is_on(rpr, 'w:u'):
+                text = f'<u>{text}</u>'
+            if _is_on(rpr, 'w:strike') or _is_on(rpr, 'w:dstrike'):
+                text = f'<s>{text}</s>'
+            vert_align = rpr.find(qn('w:vertAlign'))
+            if vert_align is not None:
+                tag = {'superscript': 'sup', 'subscript': 'sub'}.get(vert_align.get(qn('w:val')))
+                if tag:
+                    text = f'<{tag}>{text}</{tag}>'
+        return text, page_break
+
+    @staticmethod
+    def _num_pr_value(num_pr, style_num_pr, tag):
+        """Значение из w:numPr параграфа, иначе из w:numPr его стиля"""
+        for source in (num_pr, style_num_pr):
+            if source is not None and source.find(qn(tag)) is not None:
+                return source.find(qn(tag)).get(qn('w:val'))
+        return None
+
+    def _paragraph(self, paragraph):
+        """
+        Разбор параграфа.
+
+        Returns:
+            tuple: (внутренний HTML, свойства: tag, style, list, break_before, break_after)
+        """
+        ppr = paragraph.find(qn('w:pPr'))
+        info = {'tag': 'p', 'style': '', 'list': None, 'break_before': False, 'break_after': False}
+
+        if ppr is not None:
+            style = ppr.find(qn('w:pStyle'))
+            style_id = style.get(qn('w:val')) if style is not None else None
+            if style_id in self._headings:
+                info['tag'] = f"h{self._headings[style_id]}"
+            # Нумерация параграфа или его стиля (List Bullet, List Number)
+            num_pr = ppr.find(qn('w:numPr'))
+            style_num_pr = self._style_numbering.get(style_id)
+            if num_pr is not None or style_num_pr is not None:
+                num_id = self._num_pr_value(num_pr, style_num_pr, 'w:numId')
+                ilvl = self._num_pr_value(num_pr, style_num_pr, 'w:ilvl') or '0'
+                # numId="0" — нумерация отключена
+                if num_id and num_id != '0':
+                    fmt = self._numbering.get((num_id, ilvl), 'bullet')
+                    info['list'] = (int(ilvl), 'ul' if fmt in ('bullet', 'none') else 'ol')
+            jc = ppr.find(qn('w:jc'))
+            if jc is not None and jc.get(qn('w:val')) in _ALIGNMENT:
+                info['style'] = f' style="text-align: {_ALIGNMENT[jc.get(qn("w:val"))]}"'
+            info['break_before'] = _is_on(ppr, 'w:pageBreakBefore')
+            # Разрыв раздела в конце параграфа — новая страница
+            info['break_after'] = ppr.find(qn('w:sectPr')) is not None
+
+        parts = []
+        for run in paragraph.iter(qn('w:r')):
+            text, page_break = self._run_html(run)
+            if page_break:
+                if any(parts):
+                    info['break_after'] = True
+                else:
+                    info['break_before'] = True
+            parts.append(text)
+        return ''.join(parts), info
+
+    # ===== Таблицы =====
+
+    def _table(self, table):
+        """HTML таблицы: gridSpan → colspan, vMerge → rowspan, вложенные таблицы рекурсивно"""
+        rows = []
+        origins = {}  # колонка → ячейка, начавшая вертикальное объединение
+        for tr in table.findall(qn('w:tr')):
+            cells = []
+            column = 0
+            for tc in tr.findall(qn('w:tc')):
+                tcpr = tc.find(qn('w:tcPr'))
+                span = 1
+                merge = None
+                if tcpr is not None:
+                    grid_span = tcpr.find(qn('w:gridSpan'))
+                    if grid_span is not None:
+                        span = int(grid_span.get(qn('w:val'), 1))
+                    v_merge = tcpr.find(qn('w:vMerge'))
+                    if v_merge is not None:
+                        merge = v_merge.get(qn('w:val'), 'continue')
+
+                if merge == 'continue' and column in origins:
+                    origins[column]['rowspan'] += 1
+                else:
+                    cell = {'html': self.blocks_html(tc), 'colspan': span, 'rowspan': 1}
+                    cells.append(cell)
+                    if merge == 'restart':
+                        origins[column] = cell
+                    else:
+                        origins.pop(column, None)
+                column += span
+            rows.append(cells)
+
+        html = ['<table class="table table-bordered table-sm">']
+        for cells in rows:
+            html.append('<tr>')
+            for cell in cells:
+                attrs = ''
+                if cell['colspan'] > 1:
+                    attrs += f' colspan="{cell["colspan"]}"'
+                if cell['rowspan'] > 1:
+                    attrs += f' rowspan="{cell["rowspan"]}"'
+                html.append(f'<td{attrs}>{cell["html"]}</td>')
+            html.append('</tr>')
+        html.append('</table>')
+        return ''.join(html), len(rows)
+
+    # ===== Блоки =====
+
+    def _blocks(self, container):
+        """Блоки контейнера (тело, ячейка, колонтитул); подряд идущие пункты списка — один блок"""
+        list_items = []
+
+        def flush_list():
+            if not list_items:
+                return None
+            html = []
+            stack = []
+            for level, list_tag, item_html, item_style in list_items:
+                while len(stack) > level + 1:
+                    html.append(f'</{stack.pop()}>')
+                if len(stack) == level + 1 and stack[-1] != list_tag:
+                    html.append(f'</{stack.pop()}>')
+                while len(stack) < level + 1:
+                    stack.append(list_tag)
+                    html.append(f'<{list_tag}>')
+                html.append(f'<li{item_style}>{item_html}</li>')
+            while stack:
+                html.append(f'</{stack.pop()}>')
+            block = _Block(''.join(html), weight=len(list_items))
+            list_items.clear()
+            return block
+
+        for element in container:
+            name = _local_name(element)
+            if name == 'sdt':
+                # Элемент управления содержимым: блоки внутри w:sdtContent
+                content = element.find(qn('w:sdtContent'))
+                if content is not None:
+                    block = flush_list()
+                    if block:
+                        yield block
+                    yield from self._blocks(content)
+                continue
+
+            if name == 'p':
+                inner, info = self._paragraph(element)
+                if info['list'] is not None and not info['break_before']:
+                    level, list_tag = info['list']
+                    list_items.append((level, list_tag, inner, info['style']))
+                    if info['break_after']:
+                        block = flush_list()
+                        block.break_after = True
+                        yield block
+                    continue
+                block = flush_list()
+                if block:
+                    yield block
+                tag = info['tag']
+                yield _Block(
+                    f'<{tag}{info["style"]}>{inner or "&nbsp;"}</{tag}>',
+                    break_before=info['break_before'], break_after=info['break_after'],
+                )
+            elif name == 'tbl':
+                block = flush_list()
+                if block:
+                    yield block
+                html, rows = self._table(element)
+                yield _Block(html, weight=max(rows, 1))
+
+        block = flush_list()
+        if block:
+            yield block
+
+    def blocks_html(self, container):
+        """HTML всех блоков контейнера без разбиения на страницы"""
+        return ''.join(block.html for block in self._blocks(container))
+
+    def _header_footer_part(self, sect_pr, kind, ref_type):
+        """Элемент колонтитула по ссылке w:headerReference/w:footerReference раздела"""
+        for reference in sect_pr.findall(qn(f'w:{kind}Reference')):
+            if reference.get(qn('w:type'), 'default') == ref_type:
+                # Через rels, а не section.header: docxtpl подменяет цели связей отрендеренными частями
+                rel = self.document.part.rels.get(reference.get(qn('r:id')))
+                return rel.target_part.element if rel is not None else None
+        return None
+
+    def _header_footer(self, page_number):
+        """HTML верхнего и нижнего колонтитулов для страницы (первый раздел документа)"""
+        sect_pr = next(self.body.iter(qn('w:sectPr')), None)
+        if sect_pr is None:
+            return '', ''
+        ref_type = 'default'
+        if page_number == 1 and _is_on(sect_pr, 'w:titlePg'):
+            ref_type = 'first'
+        result = []
+        for kind in ('header', 'footer'):
+            element = self._header_footer_part(sect_pr, kind, ref_type)
+            result.append(self.blocks_html(element) if element is not None else '')
+        return tuple(result)
+
+    def pages(self, blocks_per_page=BLOCKS_PER_PAGE, max_pages=None):
+        """
+        Страницы превью.
+
+        Args:
+            blocks_per_page: Длина страницы без явных разрывов
+            max_pages: Остановиться после стольких страниц (None — без ограничения)
+
+        Returns:
+            tuple: (список HTML страниц, обрезано ли превью по max_pages)
+        """
+        bodies = [[]]
+        weight = 0
+        truncated = False
+
+        def new_page():
+            nonlocal weight
+            bodies.append([])
+            weight = 0
+
+        for block in self._blocks(self.body):
+            if block.break_before and bodies[-1]:
+                new_page()
+            elif weight and weight + block.weight > blocks_per_page:
+                new_page()
+            if max_pages and len(bodies) > max_pages:
+                truncated = True
+                bodies.pop()
+                break
+            bodies[-1].append(block.html)
+            weight += block.weight
+            if block.break_after:
+                new_page()
+
+        if len(bodies) > 1 and not bodies[-1]:
+            bodies.pop()
+
+        cache = {}
+        result = []
+        for number, body in enumerate(bodies, start=1):
+            key = number == 1
+            if key not in cache:
+                cache[key] = self._header_footer(number)
+            header_html, footer_html = cache[key]
+            page = ['<div class="docx-page">']
+            if header_html:
+                page.append(f'<div class="docx-header">{header_html}</div>')
+            page.append(f'<div class="docx-body">{"".join(body)}</div>')
+            if footer_html:
+                page.append(f'<div class="docx-footer">{footer_html}</div>')
+            page.append('</div>')
+            result.append(''.join(page))
+        return result, truncated
+
+
+def document_to_html(document):
+    """HTML содержимого документа без разбиения на страницы (превью фрагмента)"""
+    return HtmlPreview(document).blocks_html(document.element.body)
+
+
+def document_pages(document, blocks_per_page=BLOCKS_PER_PAGE, max_pages=None, body=None):
+    """
+    Постраничное HTML-превью документа с колонтитулами.
+
+    Returns:
+        tuple: (список HTML страниц, обрезано ли превью)
+    """
+    return HtmlPreview(document, body).pages(blocks_per_page, max_pages)
@@ -0,0 +1,534 @@
+"""
+Пул процессов для CPU-тяжёлых операций: рендеринг DocxTemplate,
+вставка фрагментов, HTML-превью, извлечение переменных шаблона и текста фрагментов,
+уменьшение изображений.
+
+Веб-воркеры gunicorn (gthread) обслуживают I/O (S3, PostgreSQL) в потоках
+и передают тяжёлую работу сюда. Пул создаётся один раз на веб-воркер
+(см. post_worker_init в gunicorn.conf.py), процессы пула перезапускаются
+после RENDER_POOL_MAX_TASKS задач.
+
+Конфигурация (переменные окружения):
+    RENDER_POOL_SIZE       — число процессов пула на веб-воркер (0 — выполнять в потоке запроса)
+    RENDER_POOL_MAX_TASKS  — задач на процесс до его перезапуска
+    RENDER_TIMEOUT         — таймаут ожидания результата, секунд (зависший процесс завершается)
+    RENDER_WORKER_MAX_RSS_MB — RSS процесса пула, после которого процесс заменяется
+    RENDER_JOB_MAX_MEMORY_MB — оценка памяти задачи, сверх которой задача отклоняется
+    RENDER_MEMORY_FACTOR     — байт RSS на байт распакованного XML (для оценки)
+
+Память: lxml-деревья больших шаблонов раздувают RSS процессов пула, и
+Python не возвращает эту память системе. Поэтому каждая задача сообщает
+пиковый и итоговый RSS процесса; процесс, перешедший порог, останавливается
+и заменяется новым (по одному, так что процессов не больше RENDER_POOL_SIZE).
+Процесс, не уложившийся в таймаут, завершается и тоже заменяется: зависшая
+задача не занимает слот пула.
+Задачи, которые по размеру распакованных XML-частей заведомо не уложатся
+в бюджет, отклоняются до запуска (RenderTooLarge).
+
+Задачи обмениваются путями к файлам, а не содержимым: файлы уже лежат
+в uploads/ и output/, поэтому через pipe идут только контекст и пути.
+"""
+import os
+import time
+import queue
+import atexit
+import logging
+import zipfile
+import resource
+import threading
+import multiprocessing
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RENDER_POOL_SIZE = int(os.environ.get('RENDER_POOL_SIZE', 2))
+RENDER_POOL_MAX_TASKS = int(os.environ.get('RENDER_POOL_MAX_TASKS', 200))
+RENDER_TIMEOUT = float(os.environ.get('RENDER_TIMEOUT', 110))
+RENDER_WORKER_MAX_RSS_MB = int(os.environ.get('RENDER_WORKER_MAX_RSS_MB', 350))
+RENDER_JOB_MAX_MEMORY_MB = int(os.environ.get('RENDER_JOB_MAX_MEMORY_MB', 250))
+RENDER_MEMORY_FACTOR = float(os.environ.get('RENDER_MEMORY_FACTOR', 8))
+
+MB = 1024 * 1024
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+metrics.describe('render_workers_recycled_total', 'Render worker processes replaced, by reason (rss, max_tasks, timeout, crash)')
+metrics.describe('render_too_large_total', 'Renders refused with 413: estimated memory over budget')
+metrics.describe('render_worker_rss_bytes', 'RSS of the render worker after its last job')
+metrics.describe('render_job_peak_rss_bytes', 'Peak RSS of the render worker during the last job')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class RenderError(Exception):
+    """
+    Ошибка задачи пула. Исключения docxtpl/Jinja2 не всегда переживают
+    pickle между процессами, поэтому наружу передаётся только текст.
+    """
+    pass
+
+
+class RenderTooLarge(RenderError):
+    """Оценка памяти задачи превышает RENDER_JOB_MAX_MEMORY_MB"""
+
+    def __init__(self, estimated_bytes, limit_bytes):
+        super().__init__(
+            f"Document is too large to render: estimated {estimated_bytes / MB:.0f} MB "
+            f"of memory, limit {limit_bytes / MB:.0f} MB"
+        )
+        self.estimated_bytes = estimated_bytes
+        self.limit_bytes = limit_bytes
+
+
+# ===== Память =====
+
+def _current_rss():
+    """Текущий RSS процесса, байт"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        # Не Linux: доступен только пик за всё время процесса
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _reset_peak_rss():
+    """Сброс пика RSS (VmHWM, Linux ≥ 4.0), чтобы измерять пик отдельной задачи"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss():
+    """Пиковый RSS процесса с последнего сброса, байт"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def uncompressed_xml_size(path):
+    """Суммарный размер распакованных XML-частей DOCX (их lxml держит в памяти)"""
+    try:
+        with zipfile.ZipFile(path) as zf:
+            return sum(
+                info.file_size for info in zf.infolist()
+                if info.filename.endswith(('.xml', '.rels'))
+            )
+    except (OSError, zipfile.BadZipFile):
+        return 0
+
+
+def estimate_render_memory(template_path, snippet_paths=()):
+    """Оценка прироста памяти на рендеринг: шаблон плюс вставляемые фрагменты"""
+    total = uncompressed_xml_size(template_path)
+    for path in snippet_paths:
+        if path:
+            total += uncompressed_xml_size(path)
+    return int(total * RENDER_MEMORY_FACTOR)
+
+
+# ===== Задачи (выполняются в процессах пула) =====
+
+def _render_task(template_path, context, snippets, output_path, images=False):
+    """Рендеринг шаблона, вставка фрагментов и сохранение результата"""
+    from rendering import render_document, apply_snippets
+
+    doc = render_document(template_path, context, images=images)
+    applied = apply_snippets(doc.docx, snippets) if snippets else []
+    doc.save(output_path)
+    return {'applied_snippets': applied}
+
+
+def _preview_task(template_path, context, snippets, blocks_per_page, max_pages, images=False):
+    """Рендеринг в памяти и HTML-превью: без сохранения DOCX"""
+    from rendering import render_document, apply_snippets
+    from preview import document_pages
+
+    doc = render_document(template_path, context, detach_body=True, images=images)
+    if snippets:
+        apply_snippets(doc.docx, snippets, body=doc.body)
+    pages, truncated = document_pages(doc.docx, blocks_per_page, max_pages, body=doc.body)
+    return {'pages': pages, 'truncated': truncated}
+
+
+def _extract_variables_task(template_path):
+    """Извлечение переменных шаблона"""
+    from template_variables import extract_template_variables
+    return extract_template_variables(template_path)
+
+
+def _extract_text_task(document_path):
+    """Текст документа для поискового индекса"""
+    from rendering import extract_document_text
+    return extract_document_text(document_path)
+
+
+def _resize_image_task(source_path, output_path, pixels):
+    """Вариант изображения под целевой размер"""
+    from media import resize_image
+    resize_image(source_path, output_path, pixels)
+    return {'size': os.path.getsize(output_path)}
+
+
+TASKS = {
+    'render': _render_task,
+    'preview': _preview_task,
+    'extract_variables': _extract_variables_task,
+    'extract_text': _extract_text_task,
+    'resize_image': _resize_image_task,
+}
+
+
+def _execute(task_name, args):
+    """
+    Точка входа процесса пула: все исключения превращаются в RenderError.
+
+    Returns:
+        tuple: (результат задачи, статистика памяти процесса)
+    """
+    _reset_peak_rss()
+    rss_before = _current_rss()
+    started = time.monotonic()
+    try:
+        result = TASKS[task_name](*args)
+    except Exception as e:
+        raise RenderError(str(e)) from None
+    stats = {
+        'pid': os.getpid(),
+        'rss_before': rss_before,
+        'peak_rss': _peak_rss(),
+        'rss': _current_rss(),
+        'duration': time.monotonic() - started,
+    }
+    return result, stats
+
+
+def _init_worker():
+    """Предзагрузка тяжёлых модулей при старте процесса пула"""
+    import rendering  # noqa: F401
+    import preview  # noqa: F401
+
+
+def _worker_main(connection, initializer):
+    """
+    Цикл процесса пула: задача из pipe → ('ok', (результат, статистика)) или
+    ('error', текст); None или закрытый pipe — завершение процесса.
+    """
+    if initializer is not None:
+        initializer()
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):
+            return
+        if message is None:
+            return
+        task_name, args = message
+        try:
+            reply = ('ok', _execute(task_name, args))
+        except RenderError as e:
+            reply = ('error', str(e))
+        try:
+            connection.send(reply)
+        except Exception as e:
+            # Результат не сериализуется: сообщаем ошибку, процесс остаётся рабочим
+            connection.send(('error', f"Render result could not be sent: {e}"))
+
+
+# ===== Управление пулом (в веб-воркере) =====
+
+class _WorkerLost(Exception):
+    """Процесс пула не вернул результат: таймаут или аварийное завершение"""
+    pass
+
+
+class _Worker:
+    """Процесс пула со своим pipe: одна задача за раз"""
+
+    def __init__(self, context, initializer):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_connection, initializer), name='render-worker', daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+        self.tasks = 0
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def call(self, task_name, args, timeout):
+        """
+        Raises:
+            RenderError: ошибка задачи
+            _WorkerLost: нет результата за timeout секунд или процесс завершился
+        """
+        self.tasks += 1
+        try:
+            self.connection.send((task_name, args))
+            if not self.connection.poll(timeout):
+                raise _WorkerLost('timeout')
+            status, payload = self.connection.recv()
+        except (EOFError, OSError):
+            raise _WorkerLost('crash') from None
+        if status == 'error':
+            raise RenderError(payload)
+        return payload
+
+    def stop(self, force=False):
+        """Остановка: простаивающий процесс выходит сам по сигналу в pipe, зависший — завершается"""
+        if not force:
+            try:
+                self.connection.send(None)
+            except OSError:
+                pass
+            self.process.join(5)
+        self.connection.close()
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(5)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+
+
+class RenderPool:
+    """
+    Процессы рендеринга веб-воркера. Задача занимает свободный процесс
+    (или ждёт его); после задачи процесс заменяется новым по отдельности,
+    а не весь пул сразу, поэтому процессов никогда не больше size:
+        rss       — RSS после задачи выше max_rss_bytes
+        max_tasks — выполнено max_tasks задач
+        timeout   — задача не уложилась в таймаут: зависший процесс завершается
+        crash     — процесс упал (например, убит OOM killer)
+    """
+
+    def __init__(self, size, max_tasks=None, max_rss_bytes=None, context=None, initializer=_init_worker):
+        # forkserver: веб-воркер многопоточный, fork из него небезопасен
+        self._context = context or multiprocessing.get_context('forkserver')
+        self._initializer = initializer
+        self.max_tasks = max_tasks or None
+        self.max_rss_bytes = max_rss_bytes or None
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = set()
+        self._closed = False
+        for _ in range(size):
+            self._release(self._spawn())
+
+    def _spawn(self):
+        worker = _Worker(self._context, self._initializer)
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def _release(self, worker):
+        with self._lock:
+            closed = self._closed
+        if closed:
+            self._retire(worker)
+        else:
+            self._idle.put(worker)
+
+    def _retire(self, worker, force=False):
+        with self._lock:
+            self._workers.discard(worker)
+        worker.stop(force=force)
+
+    def _replace(self, worker, reason, force=False):
+        """Замена одного процесса: старый останавливается до запуска нового"""
+        metrics.inc('render_workers_recycled_total', labels={'reason': reason})
+        self._retire(worker, force=force)
+        with self._lock:
+            if self._closed:
+                return None
+        return self._spawn()
+
+    def run(self, task_name, args, timeout):
+        """
+        Выполнение задачи в свободном процессе.
+
+        Returns:
+            tuple: (результат задачи, статистика памяти процесса)
+
+        Raises:
+            RenderError: ошибка задачи, таймаут (включая ожидание свободного процесса)
+                         или аварийное завершение процесса
+        """
+        deadline = time.monotonic() + timeout
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise RenderError(f"Render timed out after {timeout:.0f}s") from None
+
+        try:
+            result, stats = worker.call(task_name, args, max(0.0, deadline - time.monotonic()))
+        except _WorkerLost as e:
+            reason = str(e)
+            logger.warning("render worker %s lost (%s) in %s, replacing it", worker.pid, reason, task_name)
+            replacement = self._replace(worker, reason, force=True)
+            if replacement is not None:
+                self._release(replacement)
+            if reason == 'timeout':
+                raise RenderError(f"Render timed out after {timeout:.0f}s") from None
+            raise RenderError('Render worker terminated unexpectedly') from None
+        except BaseException:
+            # Ошибка задачи или аргументов: процесс исправен
+            self._release_checked(worker, None, task_name)
+            raise
+
+        self._release_checked(worker, stats, task_name)
+        return result, stats
+
+    def _release_checked(self, worker, stats, task_name):
+        """Возврат процесса в пул или его замена по RSS / числу задач"""
+        if stats is not None and self.max_rss_bytes and stats['rss'] > self.max_rss_bytes:
+            logger.warning(
+                "render worker %s RSS %.0fMB exceeds %.0fMB after %s, replacing it",
+                worker.pid, stats['rss'] / MB, self.max_rss_bytes / MB, task_name,
+            )
+            worker = self._replace(worker, 'rss')
+        elif self.max_tasks and worker.tasks >= self.max_tasks:
+            worker = self._replace(worker, 'max_tasks')
+        if worker is not None:
+            self._release(worker)
+
+    def pids(self):
+        """PID процессов пула"""
+        with self._lock:
+            return sorted(worker.pid for worker in self._workers)
+
+    def close(self):
+        """Остановка: свободные процессы сразу, занятые — по завершении задачи"""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._retire(worker)
+
+
+def get_pool():
+    """Пул процессов текущего веб-воркера (создаётся при первом обращении)"""
+    global _pool
+    if RENDER_POOL_SIZE <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = RenderPool(
+                    RENDER_POOL_SIZE,
+                    max_tasks=RENDER_POOL_MAX_TASKS,
+                    max_rss_bytes=RENDER_WORKER_MAX_RSS_MB * MB,
+                )
+    return _pool
+
+
+def start():
+    """
+    Запуск пула заранее (хук post_worker_init), чтобы первый запрос не ждал:
+    процессы поднимаются сразу, каждый импортирует docxtpl при старте.
+    """
+    get_pool()
+
+
+def _record_memory(task_name, label, stats):
+    """Лог и метрики памяти процесса по шаблону"""
+    metrics.set_gauge('render_worker_rss_bytes', stats['rss'])
+    metrics.set_gauge('render_job_peak_rss_bytes', stats['peak_rss'])
+    logger.info(
+        "render memory: task=%s template=%s pid=%s peak=%.1fMB growth=%.1fMB rss=%.1fMB duration=%.2fs",
+        task_name, label, stats['pid'], stats['peak_rss'] / MB,
+        (stats['peak_rss'] - stats['rss_before']) / MB, stats['rss'] / MB, stats['duration'],
+    )
+
+
+def shutdown():
+    """Остановка пула при завершении веб-воркера"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+atexit.register(shutdown)
+
+
+def run(task_name, *args, timeout=None, label=None):
+    """
+    Выполнение задачи в пуле (или в текущем потоке при RENDER_POOL_SIZE=0).
+
+    Args:
+        label: имя шаблона для статистики памяти в логе
+
+    Raises:
+        RenderError: ошибка задачи или таймаут
+    """
+    pool = get_pool()
+    if pool is None:
+        result, stats = _execute(task_name, args)
+    else:
+        result, stats = pool.run(task_name, args, timeout or RENDER_TIMEOUT)
+
+    _record_memory(task_name, label or (os.path.basename(args[0]) if args else '-'), stats)
+    return result
+
+
+def check_memory_budget(template_path, snippet_paths=()):
+    """
+    Отказ до запуска, если задача заведомо не уложится в бюджет памяти.
+
+    Raises:
+        RenderTooLarge: оценка превышает RENDER_JOB_MAX_MEMORY_MB
+    """
+    if RENDER_JOB_MAX_MEMORY_MB <= 0:
+        return
+    estimated = estimate_render_memory(template_path, snippet_paths)
+    limit = RENDER_JOB_MAX_MEMORY_MB * MB
+    if estimated > limit:
+        metrics.inc('render_too_large_total')
+        raise RenderTooLarge(estimated, limit)
+
+
+def render(template_path, context, snippets, output_path, images=False, timeout=None, label=None):
+    """
+    Рендеринг в пуле: результат сохраняется в output_path.
+
+    Args:
+        images: В контексте есть варианты изображений (media.substitute_images)
+
+    Raises:
+        RenderTooLarge: шаблон с фрагментами не укладывается в бюджет памяти
+        RenderError: ошибка рендеринга или таймаут
+    """
+    check_memory_budget(template_path, (snippets or {}).values())
+    return run('render', template_path, context, snippets, output_path, images, timeout=timeout, label=label)
+
+
+def preview(template_path, context, snippets, blocks_per_page, max_pages, images=False, timeout=None, label=None):
+    """
+    HTML-превью в пуле: рендеринг без сохранения файла.
+
+    Returns:
+        dict: {'pages': [HTML страниц], 'truncated': bool}
+
+    Raises:
+        RenderTooLarge: шаблон с фрагментами не укладывается в бюджет памяти
+        RenderError: ошибка рендеринга или таймаут
+    """
+    check_memory_budget(template_path, (snippets or {}).values())
+    return run(
+        'preview', template_path, context, snippets, blocks_per_page, max_pages, images,
+        timeout=timeout, label=label,
+    )
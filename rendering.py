@@ -0,0 +1,236 @@
+"""
+Рендеринг DOCX шаблонов и вставка фрагментов по SNIPPET-меткам.
+
+Модуль не зависит от Flask, БД и S3: его используют и веб-приложение,
+и офлайн-генерация (batch_generate.py).
+"""
+import os
+import re
+import logging
+from docx import Document
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml.ns import qn
+from docxtpl import DocxTemplate
+import snippet_cache
+from package_writer import save_package
+
+logger = logging.getLogger(__name__)
+
+# Метка фрагмента: {{SNIPPET:name}}
+SNIPPET_MARKER_PATTERN = re.compile(r'\{\{\s*SNIPPET\s*:\s*([a-zA-Zа-яА-ЯёЁ0-9_]+)\s*\}\}')
+# Та же метка после patch_xml: {_{SNIPPET:name}_}
+SNIPPET_ESCAPED_PATTERN = re.compile(r'\{_\{SNIPPET:([a-zA-Zа-яА-ЯёЁ0-9_]+)\}_\}')
+# Метка в тексте документа после рендеринга (snippet_marker_text)
+RENDERED_MARKER_PATTERN = re.compile(r'\{\{SNIPPET:([a-zA-Zа-яА-ЯёЁ0-9_]+)\}\}')
+
+W_P = qn('w:p')
+W_T = qn('w:t')
+W_TBL = qn('w:tbl')
+
+
+def snippet_marker_text(marker_name):
+    """Текст метки в документе после рендеринга"""
+    return '{{SNIPPET:' + marker_name + '}}'
+
+
+def _is_reopenable(source):
+    """Шаблон можно перечитать при сохранении: путь или поток с seek"""
+    return isinstance(source, (str, os.PathLike)) or hasattr(source, 'seek')
+
+
+class SnippetAwareTemplate(DocxTemplate):
+    """
+    DocxTemplate, который пропускает SNIPPET-метки через Jinja2 без изменений.
+    {{SNIPPET:name}} не является валидным выражением Jinja2, поэтому метка
+    экранируется как {_{...}_} — docxtpl возвращает ей исходный вид после рендеринга.
+    """
+
+    # Тело не переносится в документ (для превью): перенос большого дерева lxml
+    # между документами занимает до трети времени рендеринга
+    detach_body = False
+    rendered_body = None
+
+    def patch_xml(self, src_xml):
+        xml = super().patch_xml(src_xml)
+        return SNIPPET_MARKER_PATTERN.sub(lambda m: '{_{SNIPPET:' + m.group(1) + '}_}', xml)
+
+    def map_tree(self, tree):
+        if self.detach_body:
+            self.rendered_body = tree
+            return
+        super().map_tree(tree)
+
+    @property
+    def body(self):
+        """Отрендеренный элемент w:body (в документе или отдельный)"""
+        return self.rendered_body if self.rendered_body is not None else self.docx.element.body
+
+    def save(self, filename, *args, **kwargs):
+        """
+        Сохранение в файл: неизменённые части (изображения, шрифты, темы)
+        копируются из шаблона без перепаковки (package_writer).
+        """
+        if args or kwargs or not self.is_rendered or not _is_reopenable(self.template_file):
+            return super().save(filename, *args, **kwargs)
+        self.pre_processing()
+        save_package(self.docx, filename, self.template_file)
+        self.post_processing(filename)
+        self.is_saved = True
+
+
+def render_document(template_source, context, jinja_env=None, detach_body=False, images=False):
+    """
+    Рендеринг шаблона с контекстом.
+
+    Args:
+        template_source: Путь к DOCX или file-like объект
+        context: Словарь данных для Jinja2
+        detach_body: Не переносить тело в документ — только для чтения (doc.body),
+                     такой документ нельзя сохранить
+        images: В контексте есть варианты изображений (media.substitute_images)
+
+    Returns:
+        SnippetAwareTemplate: отрендеренный документ (python-docx Document в .docx)
+    """
+    doc = SnippetAwareTemplate(template_source)
+    doc.detach_body = detach_body
+    if images:
+        from media import bind_images
+        context = bind_images(doc, context)
+    doc.render(context, jinja_env)
+    return doc
+
+
+def _paragraph_text(paragraph_element):
+    """Текст параграфа из w:t узлов"""
+    return ''.join(t.text or '' for t in paragraph_element.iter(W_T))
+
+
+def _marker_containers(document, body=None):
+    """
+    Где искать метки: (элемент, часть пакета) для тела, затем для колонтитулов.
+    Части берутся через rels: docxtpl подменяет цели связей отрендеренными частями.
+    """
+    if not hasattr(document, 'element'):
+        # Передан уже элемент тела: часть неизвестна
+        return [(document, None)]
+    containers = [(body if body is not None else document.element.body, document.part)]
+    for rel in document.part.rels.values():
+        if not rel.is_external and rel.reltype in (RT.HEADER, RT.FOOTER):
+            containers.append((rel.target_part.element, rel.target_part))
+    return containers
+
+
+def _index_markers(document, body=None):
+    """{имя метки: (параграф, часть пакета)} в порядке документа"""
+    index = {}
+    for container, part in _marker_containers(document, body):
+        for paragraph_element in container.iter(W_P):
+            text = _paragraph_text(paragraph_element)
+            if 'SNIPPET:' not in text:
+                continue
+            for match in RENDERED_MARKER_PATTERN.finditer(text):
+                index.setdefault(match.group(1), (paragraph_element, part))
+    return index
+
+
+def build_marker_index(document, body=None):
+    """
+    Индекс SNIPPET-меток за один проход по документу: тело, таблицы
+    (в том числе вложенные), колонтитулы.
+
+    Args:
+        document: python-docx Document или элемент w:body
+        body: Отрендеренное тело, если оно не перенесено в документ (SnippetAwareTemplate.body)
+
+    Returns:
+        dict: {имя метки: элемент параграфа} в порядке документа (первое вхождение метки)
+    """
+    return {name: paragraph_element for name, (paragraph_element, _) in _index_markers(document, body).items()}
+
+
+def _load_snippet_document(snippet_source):
+    """Фрагмент может быть передан путём, потоком или уже открытым Document"""
+    if hasattr(snippet_source, 'element'):
+        return snippet_source
+    return Document(snippet_source)
+
+
+def apply_snippets(document, snippets, body=None):
+    """
+    Обработка всех SNIPPET-меток документа по индексу меток (один проход).
+
+    Параграф с меткой заменяется элементами фрагмента (цепочкой addnext,
+    без вычисления индексов в родителе). Разобранные фрагменты берутся из
+    кэша процесса (snippet_cache); стили, нумерация и изображения
+    фрагмента переносятся в документ.
+
+    Args:
+        document: python-docx Document или элемент w:body
+        snippets: {имя_метки: путь/поток/Document фрагмента или None — удалить метку}
+        body: Отрендеренное тело, если оно не перенесено в документ (SnippetAwareTemplate.body)
+
+    Returns:
+        list: имена меток, которые были найдены и обработаны (в порядке документа)
+    """
+    if not snippets:
+        return []
+
+    index = _index_markers(document, body)
+    importer = snippet_cache.Importer(document if hasattr(document, 'element') else None)
+    applied = []
+    for marker_name, (paragraph_element, part) in index.items():
+        if marker_name not in snippets or paragraph_element.getparent() is None:
+            # Метка без выбора или параграф уже заменён по другой метке в нём
+            continue
+        snippet_source = snippets[marker_name]
+        if snippet_source is not None:
+            importer.insert_after(paragraph_element, snippet_cache.load(snippet_source), part)
+        paragraph_element.getparent().remove(paragraph_element)
+        applied.append(marker_name)
+    return applied
+
+
+def insert_snippet(document, marker_name, snippet_source):
+    """
+    Вставляет содержимое DOCX-фрагмента на место метки в открытом документе.
+    Параграф с меткой заменяется всеми параграфами и таблицами фрагмента.
+
+    Returns:
+        bool: True если метка найдена
+    """
+    return bool(apply_snippets(document, {marker_name: snippet_source}))
+
+
+def remove_snippet_marker(document, marker_name):
+    """Удаляет параграф с меткой ("Не вставлять")"""
+    return bool(apply_snippets(document, {marker_name: None}))
+
+
+def insert_snippet_into_doc(doc_path, snippet_marker, snippet_doc_path):
+    """
+    Вставляет содержимое DOCX-фрагмента на место метки в документе на диске.
+    Метка: {{SNIPPET:name}} — заменяется всеми параграфами и таблицами из фрагмента.
+    """
+    doc = Document(doc_path)
+    found = insert_snippet(doc, snippet_marker, snippet_doc_path)
+    doc.save(doc_path)
+    return found
+
+
+def extract_document_text(source):
+    """
+    Текст документа для поиска: параграфы тела (в том числе в таблицах),
+    колонтитулы не включаются.
+
+    Args:
+        source: Путь, поток или открытый Document
+    """
+    document = _load_snippet_document(source)
+    lines = []
+    for paragraph_element in document.element.body.iter(W_P):
+        text = _paragraph_text(paragraph_element).strip()
+        if text:
+            lines.append(text)
+    return '\n'.join(lines)
+
@@ -1,11 +1,13 @@
 """
 MinIO S3 клиент для работы с хранилищем шаблонов
+(бэкенд хранилища s3, см. storage.py)
 """
 import boto3
 from botocore.client import Config
 from botocore.exceptions import ClientError
 import os
 import logging
+from storage import StorageBackend
 
 
 class S3ConfigurationError(Exception):
@@ -13,7 +15,7 @@ class S3ConfigurationError(Exception):
 	pass
 
 
-class S3Client:
+class S3Client(StorageBackend):
 	# Список небезопасных дефолтных credentials
 	INSECURE_CREDENTIALS = {'minioadmin', 'admin', 'root', 'password', '123456'}
 
@@ -96,11 +98,50 @@ class S3Client:
 			logging.error(f"Error deleting file: {e}")
 			return False
 
-	def list_files(self):
-		"""Список всех файлов в bucket"""
+	def file_exists(self, object_name):
+		"""Проверка наличия объекта в S3"""
 		try:
-			response = self.client.list_objects_v2(Bucket=self.bucket)
-			return response.get('Contents', [])
+			self.client.head_object(Bucket=self.bucket, Key=object_name)
+			return True
+		except ClientError:
+			return False
+
+	def touch(self, object_name):
+		"""Обновление LastModified: копирование объекта в себя (REPLACE обязателен для копии без изменений)"""
+		try:
+			self.client.copy_object(
+				Bucket=self.bucket, Key=object_name,
+				CopySource={'Bucket': self.bucket, 'Key': object_name},
+				MetadataDirective='REPLACE',
+			)
+			return True
+		except ClientError as e:
+			logging.error(f"Error touching file: {e}")
+			return False
+
+	def presigned_url(self, object_name, expires=60, content_type=None, content_disposition=None):
+		"""Подписанная ссылка GET на объект (хост — S3_ENDPOINT)"""
+		params = {'Bucket': self.bucket, 'Key': object_name}
+		if content_type:
+			params['ResponseContentType'] = content_type
+		if content_disposition:
+			params['ResponseContentDisposition'] = content_disposition
+		try:
+			return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=expires)
+		except ClientError as e:
+			logging.error(f"Error signing URL: {e}")
+			return None
+
+	def list_files(self, prefix=None):
+		"""Список файлов в bucket (все страницы), опционально по префиксу"""
+		try:
+			params = {'Bucket': self.bucket}
+			if prefix:
+				params['Prefix'] = prefix
+			files = []
+			for page in self.client.get_paginator('list_objects_v2').paginate(**params):
+				files.extend(page.get('Contents', []))
+			return files
 		except ClientError as e:
 			logging.error(f"Error listing files: {e}")
 			return []
@@ -0,0 +1,176 @@
+"""
+JSON-сериализация для контекстов генерации и истории.
+
+Если установлен orjson, используется он (в разы быстрее на контекстах
+в мегабайты), иначе — стандартный json. Все модули (app.py, db.py)
+работают с JSON только через этот модуль, чтобы реализация менялась
+в одном месте.
+
+Контекст генерации можно прислать сжатым gzip (см. read_json_field).
+"""
+import io
+import gzip
+import json
+import zlib
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - зависит от окружения
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+# Размер куска потокового ответа
+STREAM_CHUNK_SIZE = 64 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+
+JSONDecodeError = json.JSONDecodeError
+
+
+class PayloadTooLarge(ValueError):
+    """Распакованные данные превышают допустимый размер"""
+    pass
+
+
+def loads(data):
+    """
+    Разбор JSON из str или bytes.
+
+    Raises:
+        JSONDecodeError: некорректный JSON (orjson.JSONDecodeError — его подкласс)
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def dumps(obj):
+    """Сериализация в str (для хранения в БД), UTF-8 без \\u-экранирования"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def dumps_bytes(obj):
+    """Сериализация в bytes (для ответов)"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def is_json(raw):
+    """
+    Является ли сохранённый текст валидным JSON (str или bytes). Разбор без
+    повторной сериализации: для проверки текста перед вставкой в ответ как есть.
+    """
+    try:
+        loads(raw)
+    except (JSONDecodeError, UnicodeDecodeError, TypeError):
+        return False
+    return True
+
+
+INVALID_JSON_ERROR = 'Stored data is not valid JSON'
+
+
+def iter_object(fields, raw_fields, validate=False):
+    """
+    Потоковое кодирование JSON-объекта из обычных полей и полей, уже
+    сериализованных в JSON (например, json_data из БД): сохранённый текст
+    отдаётся кусками по STREAM_CHUNK_SIZE без повторной сериализации.
+
+    Args:
+        fields: {ключ: значение}
+        raw_fields: {ключ: str/bytes с JSON или None}
+        validate: Проверить текст raw_fields (старые записи могут хранить не-JSON):
+                  некорректный выводится как null, а в <ключ>_error — причина
+
+    Yields:
+        bytes
+    """
+    if validate:
+        fields = dict(fields)
+        raw_fields = dict(raw_fields)
+        for key, raw in raw_fields.items():
+            if raw is not None and not is_json(raw):
+                raw_fields[key] = None
+                fields[f'{key}_error'] = INVALID_JSON_ERROR
+    parts = [dumps_bytes(key) + b':' + dumps_bytes(value) for key, value in fields.items()]
+    yield b'{' + b','.join(parts)
+    for index, (key, raw) in enumerate(raw_fields.items()):
+        separator = b',' if parts or index else b''
+        yield separator + dumps_bytes(key) + b':'
+        if raw is None:
+            yield b'null'
+            continue
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+        for offset in range(0, len(raw), STREAM_CHUNK_SIZE):
+            yield raw[offset:offset + STREAM_CHUNK_SIZE]
+    yield b'}'
+
+
+def decompress_limited(data, max_bytes):
+    """
+    Распаковка gzip с ограничением размера результата (защита от gzip-бомб).
+
+    Raises:
+        PayloadTooLarge: распакованные данные больше max_bytes
+        ValueError: повреждённые gzip-данные
+    """
+    try:
+        with gzip.GzipFile(fileobj=io.BytesIO(data)) as f:
+            result = f.read(max_bytes + 1)
+    except (OSError, EOFError, zlib.error) as e:
+        raise ValueError(f"Invalid gzip data: {e}") from None
+    if len(result) > max_bytes:
+        raise PayloadTooLarge(f"Decompressed payload exceeds {max_bytes // (1024 * 1024)} MB")
+    return result
+
+
+def read_json_field(form, files, name, default='{}', max_decompressed=50 * 1024 * 1024):
+    """
+    JSON из поля формы или файловой части с тем же именем.
+    Файловая часть может быть сжата gzip (определяется по сигнатуре).
+
+    Returns:
+        tuple: (разобранное значение, исходный текст JSON) — текст можно
+               сохранить в БД без повторной сериализации
+
+    Raises:
+        JSONDecodeError: некорректный JSON
+        PayloadTooLarge: превышен размер после распаковки
+    """
+    upload = files.get(name)
+    if upload is not None:
+        data = upload.read()
+        if data[:2] == GZIP_MAGIC:
+            data = decompress_limited(data, max_decompressed)
+        data = data.decode('utf-8')
+    else:
+        data = form.get(name, default)
+    return loads(data), data
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON-провайдер Flask (jsonify, request.get_json) на orjson.
+    Формат совпадает со стандартным провайдером: даты — HTTP-date,
+    Decimal/UUID/dataclass — через DefaultJSONProvider.default.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
@@ -0,0 +1,140 @@
+"""
+Общее хранилище шаблонов сессии (загруженных для заполнения).
+
+Файл после /parse-template или загрузки из библиотеки именуется по хешу
+содержимого и кладётся в S3 (sessions/<sha256>.docx), поэтому последующий
+/generate может обслужить любой узел: файл читается через локальный кэш,
+а при промахе скачивается из S3. Одинаковые загрузки не дублируются.
+
+Клиент получает токен session_<sha256>_<имя файла>: хеш адресует
+содержимое, имя нужно для имени результата.
+"""
+import os
+import re
+import time
+import hashlib
+import logging
+from template_variables import VARIABLES_META
+
+logger = logging.getLogger(__name__)
+
+SESSION_PREFIX = 'sessions/'
+SESSION_TOKEN_PATTERN = re.compile(r'^session_([0-9a-f]{64})_(.+)$')
+
+
+class InvalidSessionToken(ValueError):
+    """Токен шаблона сессии имеет неверный формат"""
+    pass
+
+
+def content_hash(path):
+    """SHA-256 содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def session_key(digest):
+    """Ключ объекта в S3 и в локальном кэше"""
+    return f"{SESSION_PREFIX}{digest}.docx"
+
+
+def make_token(digest, filename):
+    return f"session_{digest}_{filename}"
+
+
+def parse_token(token):
+    """
+    Разбор токена на (хеш, имя файла).
+
+    Raises:
+        InvalidSessionToken: формат не совпадает (в том числе попытки path traversal)
+    """
+    match = SESSION_TOKEN_PATTERN.match(token or '')
+    if not match or '/' in match.group(2) or '\\' in match.group(2):
+        raise InvalidSessionToken(f"Invalid session template token: {token!r}")
+    return match.group(1), match.group(2)
+
+
+class SessionTemplateStore:
+    """Шаблоны сессии в S3 с локальным кэшем на чтение"""
+
+    def __init__(self, s3_client, cache):
+        self.s3_client = s3_client
+        self.cache = cache
+
+    def put(self, path, filename, keep_source=False):
+        """
+        Сохранение файла шаблона. Исходный файл перемещается в локальный кэш
+        (копируется при keep_source).
+
+        Returns:
+            str: токен для последующих запросов
+
+        Raises:
+            IOError: не удалось загрузить файл в общее хранилище
+        """
+        digest = content_hash(path)
+        key = session_key(digest)
+
+        # Объект в S3 проверяется и при попадании в локальный кэш: cleanup() удаляет
+        # его из S3, а копия на этом узле остаётся, и другие узлы шаблон бы не нашли.
+        # Существующий объект "освежается": cleanup() считает возраст по LastModified
+        # и иначе удалил бы только что повторно загруженный шаблон
+        stored = self.s3_client.file_exists(key) and self.s3_client.touch(key)
+        if not stored and not self.s3_client.upload_file(path, key):
+            raise IOError('Failed to store session template')
+
+        if self.cache.get(key) is not None:
+            if not keep_source:
+                os.remove(path)
+        else:
+            self.cache.put(key, path, move=not keep_source)
+
+        return make_token(digest, filename)
+
+    def get_path(self, token):
+        """
+        Локальный путь к шаблону сессии (из кэша или скачанный из S3).
+
+        Returns:
+            str: путь или None, если шаблона нет в хранилище
+
+        Raises:
+            InvalidSessionToken: неверный формат токена
+        """
+        digest, _ = parse_token(token)
+        return self.cache.fetch(session_key(digest), self.s3_client.download_file)
+
+    def get_variables(self, token):
+        """Закэшированные переменные шаблона сессии или None"""
+        digest, _ = parse_token(token)
+        return self.cache.get_meta(session_key(digest), VARIABLES_META)
+
+    def set_variables(self, token, variables):
+        digest, _ = parse_token(token)
+        self.cache.set_meta(session_key(digest), VARIABLES_META, variables)
+
+    def cleanup(self, max_age_seconds, keep=()):
+        """
+        Удаление шаблонов сессии старше max_age_seconds из S3.
+
+        Args:
+            keep: Хеши шаблонов, которые удалять нельзя (на них ссылается история)
+
+        Returns:
+            int: число удалённых объектов
+        """
+        cutoff = time.time() - max_age_seconds
+        keep_keys = {session_key(digest) for digest in keep}
+        removed = 0
+        for item in self.s3_client.list_files(prefix=SESSION_PREFIX):
+            if item['Key'] in keep_keys:
+                continue
+            if item['LastModified'].timestamp() < cutoff:
+                if self.s3_client.delete_file(item['Key']):
+                    removed += 1
+        logger.info(f"Session templates cleanup: removed {removed}")
+        return removed
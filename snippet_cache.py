@@ -0,0 +1,322 @@
+"""
+Кэш разобранных фрагментов в процессе (процессы пула рендеринга).
+
+Открытие DOCX фрагмента (python-docx Document) стоит намного дороже, чем
+копирование его тела, а популярные фрагменты (стандартные условия
+ответственности и т. п.) вставляются почти в каждый документ. Поэтому
+тело фрагмента разбирается один раз: в кэше лежат готовые элементы
+w:p/w:tbl и всё, что им нужно из пакета фрагмента, — стили, нумерация
+и связи (изображения, внешние ссылки). Вставка — одна deepcopy на использование.
+
+Ключ — путь к файлу, inode и размер: файлы локального кэша S3 неизменяемы
+и заменяются атомарно (новый inode). Бюджет — оценка памяти деревьев lxml
+(SNIPPET_CACHE_MAX_MB), вытесняются давно не использованные фрагменты.
+"""
+import os
+import threading
+from collections import OrderedDict
+from copy import deepcopy
+from io import BytesIO
+from docx import Document
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml.ns import qn
+from lxml import etree
+
+SNIPPET_CACHE_MAX_MB = int(os.environ.get('SNIPPET_CACHE_MAX_MB', 64))
+# Байт памяти дерева lxml на байт сериализованного XML (оценка для бюджета)
+MEMORY_FACTOR = 4
+
+MB = 1024 * 1024
+
+W_P = qn('w:p')
+W_TBL = qn('w:tbl')
+W_STYLE = qn('w:style')
+W_STYLE_ID = qn('w:styleId')
+W_VAL = qn('w:val')
+W_NUM = qn('w:num')
+W_NUM_ID = qn('w:numId')
+W_ABSTRACT_NUM = qn('w:abstractNum')
+W_ABSTRACT_NUM_ID = qn('w:abstractNumId')
+
+# Ссылки на стили в теле и в самих стилях (наследование)
+_STYLE_REFERENCES = {qn('w:pStyle'), qn('w:rStyle'), qn('w:tblStyle'), qn('w:basedOn'), qn('w:link'), qn('w:next')}
+# Атрибуты со ссылками на связи части (r:embed — изображения, r:id — ссылки и объекты)
+_RELATIONSHIP_ATTRIBUTES = (qn('r:embed'), qn('r:id'), qn('r:link'))
+
+_cache = OrderedDict()
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+class ParsedSnippet:
+    """
+    Тело фрагмента, отделённое от его документа: элементы и то, на что они
+    ссылаются в пакете фрагмента.
+    """
+
+    def __init__(self, document):
+        body = document.element.body
+        self.elements = [deepcopy(element) for element in body if element.tag in (W_P, W_TBL)]
+        self.styles = _referenced_styles(document, self.elements)
+        self.abstract_nums, self.nums = _referenced_numbering(document, self.elements + self.styles)
+        self.relationships = _referenced_relationships(document.part, self.elements)
+        self.size = MEMORY_FACTOR * sum(
+            len(etree.tostring(element)) for element in self.elements + self.styles + self.abstract_nums + self.nums
+        ) + sum(len(blob) for kind, _, blob in self.relationships.values() if kind == 'image')
+
+
+def _referenced_styles(document, elements):
+    """Определения стилей, на которые ссылаются элементы (с цепочкой basedOn/link/next)"""
+    try:
+        styles_root = document.styles.element
+    except (KeyError, NotImplementedError):
+        return []
+    definitions = {style.get(W_STYLE_ID): style for style in styles_root.iter(W_STYLE)}
+
+    pending = [node.get(W_VAL) for element in elements for node in element.iter(*_STYLE_REFERENCES)]
+    result = OrderedDict()
+    while pending:
+        style_id = pending.pop()
+        if style_id in result or style_id not in definitions:
+            continue
+        style = definitions[style_id]
+        result[style_id] = deepcopy(style)
+        pending.extend(node.get(W_VAL) for node in style.iter(*_STYLE_REFERENCES))
+    return list(result.values())
+
+
+def _referenced_numbering(document, elements):
+    """Определения списков (w:abstractNum и w:num), на которые ссылаются элементы и стили"""
+    num_ids = {node.get(W_VAL) for element in elements for node in element.iter(W_NUM_ID)}
+    num_ids.discard('0')
+    if not num_ids:
+        return [], []
+    try:
+        numbering_root = document.part.part_related_by(RT.NUMBERING).element
+    except KeyError:
+        return [], []
+
+    nums = [deepcopy(num) for num in numbering_root.iter(W_NUM) if num.get(W_NUM_ID) in num_ids]
+    abstract_ids = {num.find(W_ABSTRACT_NUM_ID).get(W_VAL) for num in nums if num.find(W_ABSTRACT_NUM_ID) is not None}
+    abstract_nums = [
+        deepcopy(abstract) for abstract in numbering_root.iter(W_ABSTRACT_NUM)
+        if abstract.get(W_ABSTRACT_NUM_ID) in abstract_ids
+    ]
+    return abstract_nums, nums
+
+
+def _referenced_relationships(part, elements):
+    """
+    Связи, на которые ссылаются элементы.
+
+    Returns:
+        dict: {rId: ('image', тип связи, содержимое) или ('external', тип связи, адрес)}
+    """
+    result = {}
+    for element in elements:
+        for node in element.iter():
+            for attribute in _RELATIONSHIP_ATTRIBUTES:
+                rid = node.get(attribute)
+                if rid is None or rid in result or rid not in part.rels:
+                    continue
+                rel = part.rels[rid]
+                if rel.is_external:
+                    result[rid] = ('external', rel.reltype, rel.target_ref)
+                elif rel.reltype == RT.IMAGE:
+                    result[rid] = ('image', rel.reltype, rel.target_part.blob)
+    return result
+
+
+def _cache_key(source):
+    """Ключ кэша для пути к файлу или None (поток, открытый Document — не кэшируются)"""
+    if not isinstance(source, (str, os.PathLike)):
+        return None
+    path = os.path.abspath(source)
+    stat = os.stat(path)
+    return path, stat.st_ino, stat.st_size
+
+
+def load(source):
+    """
+    Разобранный фрагмент из кэша или из файла.
+
+    Args:
+        source: Путь, поток или открытый Document
+    """
+    global _cache_bytes
+    if hasattr(source, 'element'):
+        return ParsedSnippet(source)
+    key = _cache_key(source)
+    if key is None:
+        return ParsedSnippet(Document(source))
+
+    with _cache_lock:
+        parsed = _cache.get(key)
+        if parsed is not None:
+            _cache.move_to_end(key)
+            _stats['hits'] += 1
+            return parsed
+        _stats['misses'] += 1
+
+    parsed = ParsedSnippet(Document(source))
+
+    limit = SNIPPET_CACHE_MAX_MB * MB
+    with _cache_lock:
+        if parsed.size <= limit and key not in _cache:
+            _cache[key] = parsed
+            _cache_bytes += parsed.size
+            while _cache_bytes > limit:
+                _, evicted = _cache.popitem(last=False)
+                _cache_bytes -= evicted.size
+                _stats['evictions'] += 1
+    return parsed
+
+
+def cache_info():
+    """Статистика кэша процесса: попадания, промахи, вытеснения, размер"""
+    with _cache_lock:
+        return dict(_stats, entries=len(_cache), bytes=_cache_bytes)
+
+
+def clear():
+    """Очистка кэша процесса и статистики"""
+    global _cache_bytes
+    with _cache_lock:
+        _cache.clear()
+        _cache_bytes = 0
+        for name in _stats:
+            _stats[name] = 0
+
+
+class Importer:
+    """
+    Перенос зависимостей фрагментов в документ: стили, нумерация, связи.
+    Один экземпляр на документ: каждый фрагмент переносится в него один раз,
+    повторные вставки того же фрагмента используют те же стили и списки.
+    """
+
+    def __init__(self, document):
+        """
+        Args:
+            document: python-docx Document или None (только элементы, без зависимостей)
+        """
+        self.document = document
+        self._style_ids = None
+        self._numbering = {}
+        self._relationships = {}
+
+    def _import_styles(self, parsed, num_map):
+        try:
+            styles_root = self.document.styles.element
+        except (KeyError, NotImplementedError):
+            return
+        if self._style_ids is None:
+            self._style_ids = {style.get(W_STYLE_ID) for style in styles_root.iter(W_STYLE)}
+        for style in parsed.styles:
+            style_id = style.get(W_STYLE_ID)
+            # Стиль с тем же id в документе имеет приоритет (как при вставке в Word)
+            if style_id in self._style_ids:
+                continue
+            copy = deepcopy(style)
+            _remap_num_ids(copy, num_map)
+            styles_root.append(copy)
+            self._style_ids.add(style_id)
+
+    def _import_numbering(self, parsed):
+        """Списки фрагмента с новыми id: {старый numId: новый numId}"""
+        if not parsed.nums:
+            return {}
+        try:
+            numbering_root = self.document.part.numbering_part.element
+        except NotImplementedError:
+            # Пакет без части нумерации: python-docx не умеет её создать
+            return {}
+
+        next_abstract = 1 + max((int(a.get(W_ABSTRACT_NUM_ID)) for a in numbering_root.iter(W_ABSTRACT_NUM)), default=-1)
+        next_num = 1 + max((int(n.get(W_NUM_ID)) for n in numbering_root.iter(W_NUM)), default=0)
+
+        abstract_map = {}
+        existing_abstracts = list(numbering_root.iter(W_ABSTRACT_NUM))
+        anchor = existing_abstracts[-1] if existing_abstracts else None
+        for abstract in parsed.abstract_nums:
+            copy = deepcopy(abstract)
+            abstract_map[abstract.get(W_ABSTRACT_NUM_ID)] = str(next_abstract)
+            copy.set(W_ABSTRACT_NUM_ID, str(next_abstract))
+            next_abstract += 1
+            # w:abstractNum должны идти перед w:num
+            if anchor is not None:
+                anchor.addnext(copy)
+            else:
+                numbering_root.insert(0, copy)
+            anchor = copy
+
+        num_map = {}
+        for num in parsed.nums:
+            copy = deepcopy(num)
+            num_map[num.get(W_NUM_ID)] = str(next_num)
+            copy.set(W_NUM_ID, str(next_num))
+            next_num += 1
+            abstract_ref = copy.find(W_ABSTRACT_NUM_ID)
+            if abstract_ref is not None and abstract_ref.get(W_VAL) in abstract_map:
+                abstract_ref.set(W_VAL, abstract_map[abstract_ref.get(W_VAL)])
+            numbering_root.append(copy)
+        return num_map
+
+    def _import_relationships(self, parsed, part):
+        """Связи фрагмента в части, куда идёт вставка: {старый rId: новый rId}"""
+        rid_map = {}
+        for rid, (kind, reltype, value) in parsed.relationships.items():
+            if kind == 'external':
+                rid_map[rid] = part.relate_to(value, reltype, is_external=True)
+            else:
+                # Одинаковые изображения хранятся в пакете один раз (по SHA1)
+                image_part = part.package.get_or_add_image_part(BytesIO(value))
+                rid_map[rid] = part.relate_to(image_part, RT.IMAGE)
+        return rid_map
+
+    def prepare(self, parsed, part):
+        """
+        Перенос зависимостей фрагмента (один раз на документ и часть).
+
+        Returns:
+            tuple: ({старый rId: новый}, {старый numId: новый})
+        """
+        if self.document is None:
+            return {}, {}
+        key = id(parsed)
+        if key not in self._numbering:
+            num_map = self._import_numbering(parsed)
+            self._import_styles(parsed, num_map)
+            # Ссылка на parsed держит id уникальным (фрагменты из потоков не кэшируются)
+            self._numbering[key] = (parsed, num_map)
+        rel_key = (key, id(part))
+        if rel_key not in self._relationships:
+            self._relationships[rel_key] = self._import_relationships(parsed, part) if part is not None else {}
+        return self._relationships[rel_key], self._numbering[key][1]
+
+    def insert_after(self, anchor, parsed, part):
+        """Копии элементов фрагмента после anchor (цепочкой addnext)"""
+        rid_map, num_map = self.prepare(parsed, part)
+        for element in parsed.elements:
+            copy = deepcopy(element)
+            if rid_map:
+                _remap_relationships(copy, rid_map)
+            if num_map:
+                _remap_num_ids(copy, num_map)
+            anchor.addnext(copy)
+            anchor = copy
+
+
+def _remap_relationships(element, rid_map):
+    for node in element.iter():
+        for attribute in _RELATIONSHIP_ATTRIBUTES:
+            rid = node.get(attribute)
+            if rid in rid_map:
+                node.set(attribute, rid_map[rid])
+
+
+def _remap_num_ids(element, num_map):
+    for node in element.iter(W_NUM_ID):
+        if node.get(W_VAL) in num_map:
+            node.set(W_VAL, num_map[node.get(W_VAL)])
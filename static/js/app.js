@@ -75,6 +75,7 @@ document.addEventListener('DOMContentLoaded', function() {
     setupFileInput();
     setupJsonValidation();
     setupModeSwitch();
+    setupImages();
     checkFirstVisit();
     // Проверка, не пришел ли пользователь со страницы шаблонов
     checkLoadTemplate();
@@ -386,7 +387,7 @@ function buildJsonFromForm() {
             if (input.type === 'checkbox') {
                 data[name] = input.checked;
             } else {
-                data[name] = input.value;
+                data[name] = fieldValue(input.value);
             }
         }
     });
@@ -410,7 +411,7 @@ function buildJsonFromForm() {
                                 const match = name.match(/\[(\d+)\]\.(.+)/);
                                 if (match) {
                                     const fieldName = match[2];
-                                    item[fieldName] = input.value;
+                                    item[fieldName] = fieldValue(input.value);
                                 }
                             }
                         });
@@ -480,12 +481,25 @@ function validateJson() {
     }
 }
 
-// Генерация документа
-async function generateDocument() {
+// Большой JSON отправляется сжатым gzip файловой частью (сервер определяет сжатие по сигнатуре)
+const GZIP_JSON_THRESHOLD = 256 * 1024;
+
+async function appendJsonData(formData, jsonData) {
+    if (jsonData.length < GZIP_JSON_THRESHOLD || typeof CompressionStream === 'undefined') {
+        formData.append('data', jsonData);
+        return;
+    }
+    const stream = new Blob([jsonData]).stream().pipeThrough(new CompressionStream('gzip'));
+    const compressed = await new Response(stream).blob();
+    formData.append('data', compressed, 'data.json.gz');
+}
+
+// Данные запроса /generate (шаблон, JSON, выбранные фрагменты); null — если данные не готовы
+async function buildGenerateFormData() {
     // Проверка наличия файла
     if (!uploadedFile && !templateFile) {
         showAlert('danger', 'Пожалуйста, загрузите DOCX шаблон');
-        return;
+        return null;
     }
 
     let jsonData;
@@ -500,23 +514,14 @@ async function generateDocument() {
         jsonData = document.getElementById('jsonData').value.trim();
         if (!jsonData) {
             showAlert('warning', 'Пожалуйста, введите JSON данные');
-            return;
+            return null;
         }
         if (!validateJson()) {
             showAlert('danger', 'Пожалуйста, исправьте ошибки в JSON');
-            return;
+            return null;
         }
     }
 
-    // Отключение кнопки и показ спиннера
-    const generateBtn = document.getElementById('generateBtn');
-    const btnText = document.getElementById('btnText');
-    const btnSpinner = document.getElementById('btnSpinner');
-
-    generateBtn.disabled = true;
-    btnText.textContent = 'Генерация...';
-    btnSpinner.style.display = 'inline-block';
-
     // Подготовка данных для отправки
     const formData = new FormData();
 
@@ -528,7 +533,7 @@ async function generateDocument() {
         formData.append('template', uploadedFile);
     }
 
-    formData.append('data', jsonData);
+    await appendJsonData(formData, jsonData);
 
     // Добавляем выбранные SNIPPET-фрагменты
     const snippetSelections = {};
@@ -537,6 +542,24 @@ async function generateDocument() {
         snippetSelections[snippetName] = select.value;
     });
     formData.append('snippets', JSON.stringify(snippetSelections));
+    return formData;
+}
+
+// Генерация документа
+async function generateDocument() {
+    const formData = await buildGenerateFormData();
+    if (!formData) {
+        return;
+    }
+
+    // Отключение кнопки и показ спиннера
+    const generateBtn = document.getElementById('generateBtn');
+    const btnText = document.getElementById('btnText');
+    const btnSpinner = document.getElementById('btnSpinner');
+
+    generateBtn.disabled = true;
+    btnText.textContent = 'Генерация...';
+    btnSpinner.style.display = 'inline-block';
 
     try {
         const response = await fetchWithAuth('/generate', {
@@ -566,6 +589,57 @@ async function generateDocument() {
     }
 }
 
+// ===== Предпросмотр документа =====
+
+let previewPages = [];
+let previewPageIndex = 0;
+
+// Предпросмотр: рендеринг на сервере без сохранения файла и истории
+async function previewDocument() {
+    const formData = await buildGenerateFormData();
+    if (!formData) {
+        return;
+    }
+
+    const previewBtn = document.getElementById('previewBtn');
+    previewBtn.disabled = true;
+
+    try {
+        const response = await fetchWithAuth('/generate?preview=1', {
+            method: 'POST',
+            body: formData
+        });
+
+        const result = await response.json();
+
+        if (response.ok && result.success) {
+            previewPages = result.pages;
+            previewPageIndex = 0;
+            document.getElementById('previewTruncated').style.display = result.truncated ? 'block' : 'none';
+            showPreviewPage();
+            bootstrap.Modal.getOrCreateInstance(document.getElementById('documentPreviewModal')).show();
+        } else {
+            showAlert('danger', '❌ Ошибка: ' + (result.error || 'Unknown error'));
+        }
+    } catch (error) {
+        showAlert('danger', '❌ Ошибка сети: ' + error.message);
+    } finally {
+        previewBtn.disabled = false;
+    }
+}
+
+function showPreviewPage() {
+    document.getElementById('documentPreviewContent').innerHTML = previewPages[previewPageIndex] || '';
+    document.getElementById('previewPageInfo').textContent = `Страница ${previewPageIndex + 1} из ${previewPages.length}`;
+    document.getElementById('previewPrevBtn').disabled = previewPageIndex === 0;
+    document.getElementById('previewNextBtn').disabled = previewPageIndex >= previewPages.length - 1;
+}
+
+function changePreviewPage(delta) {
+    previewPageIndex = Math.min(Math.max(previewPageIndex + delta, 0), previewPages.length - 1);
+    showPreviewPage();
+}
+
 // Показ уведомления
 function showAlert(type, message) {
     const resultAlert = document.getElementById('resultAlert');
@@ -724,6 +798,105 @@ function escapeHtml(text) {
     return div.innerHTML;
 }
 
+// ===== Изображения =====
+
+// Значение поля формы: ссылка на изображение {"$image": id, ...} передаётся объектом
+function fieldValue(value) {
+    const trimmed = value.trim();
+    if (trimmed.startsWith('{') && trimmed.includes('"$image"')) {
+        try {
+            return JSON.parse(trimmed);
+        } catch (e) {
+            return value;
+        }
+    }
+    return value;
+}
+
+function setupImages() {
+    const panel = document.getElementById('imagesPanel');
+    const input = document.getElementById('imageInput');
+    if (!panel || !input) return;
+
+    // Список загружается при первом раскрытии панели
+    panel.addEventListener('toggle', () => {
+        if (panel.open && !panel.dataset.loaded) {
+            panel.dataset.loaded = '1';
+            loadImages();
+        }
+    });
+    input.addEventListener('change', async () => {
+        if (input.files.length) {
+            await uploadImage(input.files[0]);
+            input.value = '';
+        }
+    });
+}
+
+async function loadImages() {
+    const list = document.getElementById('imagesList');
+    try {
+        const response = await fetchWithAuth('/images');
+        const result = await response.json();
+        if (!response.ok) throw new Error(result.error || 'Failed to load images');
+
+        if (!result.images.length) {
+            list.innerHTML = '<div class="small text-muted">Изображений пока нет</div>';
+            return;
+        }
+        list.innerHTML = result.images.map(image => `
+            <div class="image-item">
+                <img src="/images/${image.id}" alt="" loading="lazy">
+                <div class="image-item-info small">
+                    <div>${escapeHtml(image.name)}</div>
+                    <div class="text-muted">#${image.id} · ${image.width}×${image.height}</div>
+                </div>
+                <button type="button" class="btn btn-sm btn-outline-primary" onclick="copyImageReference(${image.id})">Копировать ссылку</button>
+                <button type="button" class="btn btn-sm btn-link text-danger" onclick="deleteImage(${image.id})">Удалить</button>
+            </div>
+        `).join('');
+    } catch (error) {
+        list.innerHTML = `<div class="small text-danger">${escapeHtml(error.message)}</div>`;
+    }
+}
+
+async function uploadImage(file) {
+    const formData = new FormData();
+    formData.append('file', file);
+    try {
+        const response = await fetchWithAuth('/images', { method: 'POST', body: formData });
+        const result = await response.json();
+        if (!response.ok) throw new Error(result.error || 'Upload failed');
+        showToast('success', 'Изображение загружено', `Ссылка: {"$image": ${result.image_id}}`);
+        loadImages();
+    } catch (error) {
+        showToast('error', 'Ошибка загрузки', error.message);
+    }
+}
+
+async function copyImageReference(imageId) {
+    const reference = JSON.stringify({ '$image': imageId, 'width_mm': 40 });
+    try {
+        await navigator.clipboard.writeText(reference);
+        showToast('success', 'Скопировано', reference, 3000);
+    } catch (e) {
+        showToast('success', 'Ссылка на изображение', reference);
+    }
+}
+
+function deleteImage(imageId) {
+    showConfirmDialog('Удалить изображение? Документы, которые на него ссылаются, нельзя будет перегенерировать.', async () => {
+        try {
+            const response = await fetchWithAuth(`/images/${imageId}`, { method: 'DELETE' });
+            const result = await response.json();
+            if (!response.ok) throw new Error(result.error || 'Delete failed');
+            loadImages();
+        } catch (error) {
+            showToast('error', 'Ошибка удаления', error.message);
+        }
+    });
+}
+
 // ===== Модальное окно подтверждения =====
 
 let confirmCallback = null;
@@ -761,44 +934,74 @@ document.getElementById('confirmDeleteBtn')?.addEventListener('click', function(
 // ===== Функции для SNIPPET-меток =====
 
 async function buildSnippetSelectors(snippets) {
-    // Загружаем список фрагментов пользователя
-    try {
-        const response = await fetchWithAuth('/snippets/items');
-        const data = await response.json();
+    // Фрагменты подбираются поиском по мере ввода (/snippets/search),
+    // без загрузки всего справочника; до ввода — самые часто выбираемые
+    const dynamicForm = document.getElementById('dynamicForm');
 
-        if (!data.success) return;
+    for (const snippet of snippets) {
+        const fieldGroup = document.createElement('div');
+        fieldGroup.className = 'snippet-field';
+        fieldGroup.id = `snippet_field_${snippet.name}`;
+
+        const displayName = formatFieldName(snippet.name);
+        fieldGroup.innerHTML = `
+            <label class="form-label">
+                SNIPPET: ${displayName}
+            </label>
+            <span class="snippet-hint">Фрагмент из справочника</span>
+            <input type="search" class="form-control snippet-search" placeholder="Поиск по названию или тексту фрагмента...">
+            <select class="form-select snippet-selector" name="snippet_${snippet.name}" data-snippet-name="${snippet.name}">
+                <option value="">— Не вставлять —</option>
+            </select>
+            <div class="snippet-match"></div>
+        `;
 
-        const dynamicForm = document.getElementById('dynamicForm');
-        const grouped = data.snippets; // {category_name: [{id, name, description}, ...]}
+        const input = fieldGroup.querySelector('.snippet-search');
+        const select = fieldGroup.querySelector('.snippet-selector');
+        const match = fieldGroup.querySelector('.snippet-match');
+        let timer = null;
 
-        for (const snippet of snippets) {
-            const fieldGroup = document.createElement('div');
-            fieldGroup.className = 'snippet-field';
-            fieldGroup.id = `snippet_field_${snippet.name}`;
+        input.addEventListener('input', () => {
+            clearTimeout(timer);
+            timer = setTimeout(() => searchSnippetOptions(input.value.trim(), select, match), 250);
+        });
+        select.addEventListener('change', () => {
+            const option = select.selectedOptions[0];
+            // headline приходит с сервера уже экранированным, с тегами <mark>
+            match.innerHTML = option && option.dataset.headline ? option.dataset.headline : '';
+        });
 
-            let optionsHtml = '<option value="">— Не вставлять —</option>';
-            for (const [catName, items] of Object.entries(grouped)) {
-                optionsHtml += `<optgroup label="${escapeHtml(catName)}">`;
-                for (const item of items) {
-                    optionsHtml += `<option value="${item.id}">${escapeHtml(item.name)}</option>`;
-                }
-                optionsHtml += '</optgroup>';
-            }
+        dynamicForm.appendChild(fieldGroup);
+        searchSnippetOptions('', select, match);
+    }
+}
 
-            const displayName = formatFieldName(snippet.name);
-            fieldGroup.innerHTML = `
-                <label class="form-label">
-                    SNIPPET: ${displayName}
-                </label>
-                <span class="snippet-hint">Фрагмент из справочника</span>
-                <select class="form-select snippet-selector" name="snippet_${snippet.name}" data-snippet-name="${snippet.name}">
-                    ${optionsHtml}
-                </select>
-            `;
+async function searchSnippetOptions(query, select, match) {
+    try {
+        const response = await fetchWithAuth('/snippets/search?q=' + encodeURIComponent(query));
+        const data = await response.json();
+        if (!data.success) return;
 
-            dynamicForm.appendChild(fieldGroup);
+        // Выбранный фрагмент остаётся в списке, даже если не попал в результаты
+        const selected = select.selectedOptions[0];
+        const keep = selected && selected.value ? selected.cloneNode(true) : null;
+
+        select.innerHTML = '<option value="">— Не вставлять —</option>';
+        if (keep) select.appendChild(keep);
+        for (const item of data.snippets) {
+            if (keep && String(item.id) === keep.value) continue;
+            const option = document.createElement('option');
+            option.value = item.id;
+            option.textContent = `${item.name} — ${item.category_name}`;
+            if (item.headline) option.dataset.headline = item.headline;
+            select.appendChild(option);
+        }
+        if (keep) {
+            select.value = keep.value;
+        } else {
+            match.innerHTML = '';
         }
     } catch (error) {
-        console.error('Error loading snippets for selectors:', error);
+        console.error('Error searching snippets:', error);
     }
 }
@@ -1,8 +1,85 @@
 // Страница истории документов
+let searchTimer = null;
+let searchQuery = '';
+
 document.addEventListener('DOMContentLoaded', function() {
     loadHistory();
+    document.getElementById('historySearch').addEventListener('input', function() {
+        clearTimeout(searchTimer);
+        const query = this.value.trim();
+        searchTimer = setTimeout(() => {
+            searchQuery = query;
+            if (query) {
+                searchHistory(query, null);
+            } else {
+                loadHistory();
+            }
+        }, 300);
+    });
 });
 
+function searchHistory(query, cursor) {
+    let url = '/history/search?q=' + encodeURIComponent(query);
+    if (cursor) url += '&cursor=' + encodeURIComponent(cursor);
+    fetch(url)
+        .then(r => {
+            if (r.status === 401) { window.location.href = '/login'; return; }
+            return r.json();
+        })
+        .then(data => {
+            // Ответ на устаревший запрос (пользователь уже ввёл другой) не показываем
+            if (!data || query !== searchQuery) return;
+            const container = document.getElementById('historyListContainer');
+            if (!cursor) {
+                if (!data.success || data.documents.length === 0) {
+                    container.innerHTML = `
+                        <div class="empty-state">
+                            <p class="empty-state-text">Ничего не найдено</p>
+                        </div>`;
+                    return;
+                }
+                container.innerHTML = '<table class="items-table"><thead><tr>' +
+                    '<th>Файл</th><th>Совпадение</th><th>Размер</th><th>Дата</th><th></th>' +
+                    '</tr></thead><tbody id="searchResults"></tbody></table>' +
+                    '<div class="text-center p-3" id="searchMore"></div>';
+            }
+            const tbody = document.getElementById('searchResults');
+            // headline приходит с сервера уже экранированным, с тегами <mark>
+            data.documents.forEach(doc => {
+                tbody.insertAdjacentHTML('beforeend', renderDocumentRow(doc, doc.headline));
+            });
+            const more = document.getElementById('searchMore');
+            more.innerHTML = '';
+            if (data.next_cursor) {
+                const btn = document.createElement('button');
+                btn.className = 'btn btn-sm btn-outline-secondary';
+                btn.textContent = 'Показать ещё';
+                btn.onclick = () => searchHistory(query, data.next_cursor);
+                more.appendChild(btn);
+            }
+        })
+        .catch(err => {
+            document.getElementById('historyListContainer').innerHTML =
+                '<div class="alert alert-danger m-3">Ошибка поиска</div>';
+        });
+}
+
+function renderDocumentRow(doc, secondColumnHtml) {
+    const date = doc.created_at ? new Date(doc.created_at).toLocaleDateString('ru-RU') : '';
+    const size = doc.file_size ? formatFileSize(doc.file_size) : '';
+    return `<tr>
+        <td><strong>${escapeHtml(doc.output_filename)}</strong></td>
+        <td style="color: var(--color-text-secondary);">${secondColumnHtml}</td>
+        <td style="color: var(--color-text-muted);">${size}</td>
+        <td style="color: var(--color-text-muted); white-space: nowrap;">${date}</td>
+        <td style="text-align: right; white-space: nowrap;">
+            <a href="/history/${doc.id}/download" class="btn btn-sm btn-outline-primary">Скачать</a>
+            ${doc.can_regenerate ? `<button class="btn btn-sm btn-outline-secondary ms-1" onclick="openRegenerate(${doc.id})">Исправить</button>` : ''}
+            <button class="btn btn-sm btn-outline-danger ms-1" onclick="confirmDeleteDoc(${doc.id}, '${escapeHtml(doc.output_filename)}')">Удалить</button>
+        </td>
+    </tr>`;
+}
+
 function loadHistory() {
     fetch('/history')
         .then(r => {
@@ -25,18 +102,7 @@ function loadHistory() {
             html += '<th>Файл</th><th>Шаблон</th><th>Размер</th><th>Дата</th><th></th>';
             html += '</tr></thead><tbody>';
             data.documents.forEach(doc => {
-                const date = doc.created_at ? new Date(doc.created_at).toLocaleDateString('ru-RU') : '';
-                const size = doc.file_size ? formatFileSize(doc.file_size) : '';
-                html += `<tr>
-                    <td><strong>${escapeHtml(doc.output_filename)}</strong></td>
-                    <td style="color: var(--color-text-secondary);">${escapeHtml(doc.template_name || '')}</td>
-                    <td style="color: var(--color-text-muted);">${size}</td>
-                    <td style="color: var(--color-text-muted); white-space: nowrap;">${date}</td>
-                    <td style="text-align: right; white-space: nowrap;">
-                        <a href="/history/${doc.id}/download" class="btn btn-sm btn-outline-primary">Скачать</a>
-                        <button class="btn btn-sm btn-outline-danger ms-1" onclick="confirmDeleteDoc(${doc.id}, '${escapeHtml(doc.output_filename)}')">Удалить</button>
-                    </td>
-                </tr>`;
+                html += renderDocumentRow(doc, escapeHtml(doc.template_name || ''));
             });
             html += '</tbody></table>';
             container.innerHTML = html;
@@ -56,12 +122,104 @@ function confirmDeleteDoc(id, name) {
             .then(r => r.json())
             .then(data => {
                 bootstrap.Modal.getInstance(document.getElementById('confirmDeleteModal')).hide();
-                if (data.success) { loadHistory(); }
+                if (data.success) {
+                    if (searchQuery) { searchHistory(searchQuery, null); } else { loadHistory(); }
+                }
             });
     };
     new bootstrap.Modal(document.getElementById('confirmDeleteModal')).show();
 }
 
+// ===== Перегенерация с JSON Patch =====
+
+// Операции RFC 6902, превращающие before в after (массивы разной длины заменяются целиком)
+function jsonDiff(before, after, path = '') {
+    if (before === after) return [];
+    const isObject = v => v !== null && typeof v === 'object' && !Array.isArray(v);
+    const escapeToken = key => String(key).replace(/~/g, '~0').replace(/\//g, '~1');
+
+    if (isObject(before) && isObject(after)) {
+        const ops = [];
+        Object.keys(before).forEach(key => {
+            if (!(key in after)) ops.push({ op: 'remove', path: path + '/' + escapeToken(key) });
+        });
+        Object.keys(after).forEach(key => {
+            const childPath = path + '/' + escapeToken(key);
+            if (!(key in before)) {
+                ops.push({ op: 'add', path: childPath, value: after[key] });
+            } else {
+                ops.push(...jsonDiff(before[key], after[key], childPath));
+            }
+        });
+        return ops;
+    }
+    if (Array.isArray(before) && Array.isArray(after) && before.length === after.length) {
+        const ops = [];
+        after.forEach((item, index) => ops.push(...jsonDiff(before[index], item, path + '/' + index)));
+        return ops;
+    }
+    if (JSON.stringify(before) === JSON.stringify(after)) return [];
+    return [{ op: 'replace', path: path, value: after }];
+}
+
+let regenerateOriginal = null;
+
+function openRegenerate(id) {
+    const textarea = document.getElementById('regenerateData');
+    document.getElementById('regenerateError').style.display = 'none';
+    document.getElementById('regenerateResult').style.display = 'none';
+    textarea.value = '';
+    fetch('/history/' + id + '/data')
+        .then(r => r.json())
+        .then(data => {
+            regenerateOriginal = data.json_data || {};
+            textarea.value = JSON.stringify(regenerateOriginal, null, 2);
+        });
+    document.getElementById('confirmRegenerateBtn').onclick = () => submitRegenerate(id);
+    new bootstrap.Modal(document.getElementById('regenerateModal')).show();
+}
+
+function submitRegenerate(id) {
+    const errorBox = document.getElementById('regenerateError');
+    const resultBox = document.getElementById('regenerateResult');
+    errorBox.style.display = 'none';
+    resultBox.style.display = 'none';
+
+    let edited;
+    try {
+        edited = JSON.parse(document.getElementById('regenerateData').value);
+    } catch (e) {
+        errorBox.textContent = 'Ошибка JSON: ' + e.message;
+        errorBox.style.display = 'block';
+        return;
+    }
+
+    const btn = document.getElementById('confirmRegenerateBtn');
+    btn.disabled = true;
+    fetch('/history/' + id + '/regenerate', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json-patch+json' },
+        body: JSON.stringify(jsonDiff(regenerateOriginal, edited))
+    })
+        .then(r => r.json())
+        .then(data => {
+            if (data.success) {
+                resultBox.innerHTML = `Документ сгенерирован
+                    <a href="/download/${encodeURIComponent(data.filename)}" class="btn btn-success btn-sm ms-2">Скачать</a>`;
+                resultBox.style.display = 'block';
+                if (searchQuery) { searchHistory(searchQuery, null); } else { loadHistory(); }
+            } else {
+                errorBox.textContent = data.error || 'Ошибка генерации';
+                errorBox.style.display = 'block';
+            }
+        })
+        .catch(() => {
+            errorBox.textContent = 'Ошибка сети';
+            errorBox.style.display = 'block';
+        })
+        .finally(() => { btn.disabled = false; });
+}
+
 function formatFileSize(bytes) {
     if (bytes < 1024) return bytes + ' Б';
     if (bytes < 1024 * 1024) return (bytes / 1024).toFixed(1) + ' КБ';
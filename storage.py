@@ -0,0 +1,292 @@
+"""
+Хранилище объектов: интерфейс и бэкенд на локальной файловой системе.
+
+Приложение работает с объектами (шаблоны, фрагменты, изображения,
+сгенерированные документы) через интерфейс StorageBackend по ключам вида
+snippets/<uuid>_name.docx. Бэкенд выбирается переменной STORAGE_BACKEND:
+
+    s3          — S3/MinIO через boto3 (s3_client.S3Client, по умолчанию)
+    filesystem  — директория STORAGE_PATH на диске узла (FilesystemStorage):
+                  для установки на одном сервере и для тестов без S3
+
+FilesystemStorage хранит объект обычным файлом: <STORAGE_PATH>/<путь ключа>/<шард>/<имя>,
+где шард — первые два символа sha256 ключа (не больше ~1/256 файлов префикса
+в одной директории). Путь к файлу можно отдать sendfile/nginx как есть
+(local_path). Запись атомарна: временный файл в той же директории и os.replace.
+С STORAGE_DEDUP=1 одинаковые файлы хранятся один раз: объект — жёсткая ссылка
+на файл в .blobs/ по sha256 содержимого. Файлы объектов никогда не меняются
+на месте, только заменяются, поэтому общий inode безопасен.
+"""
+import os
+import uuid
+import shutil
+import hashlib
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKENDS = ('s3', 'filesystem')
+BLOBS_DIRECTORY = '.blobs'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class StorageBackend:
+    """
+    Интерфейс хранилища объектов. Ошибки хранилища не выбрасываются:
+    методы возвращают False (как S3Client), подробности — в лог.
+    """
+
+    def upload_file(self, file_path, object_name):
+        """Загрузка локального файла под ключом object_name"""
+        raise NotImplementedError
+
+    def download_file(self, object_name, file_path):
+        """Скачивание объекта в локальный файл"""
+        raise NotImplementedError
+
+    def delete_file(self, object_name):
+        """Удаление объекта (отсутствующий объект — не ошибка)"""
+        raise NotImplementedError
+
+    def file_exists(self, object_name):
+        """Проверка наличия объекта"""
+        raise NotImplementedError
+
+    def touch(self, object_name):
+        """Обновление LastModified существующего объекта без перезагрузки содержимого"""
+        raise NotImplementedError
+
+    def list_files(self, prefix=None):
+        """
+        Объекты, опционально по префиксу ключа.
+
+        Returns:
+            list: [{'Key', 'Size', 'LastModified' (datetime с часовым поясом)}]
+        """
+        raise NotImplementedError
+
+    def local_path(self, object_name):
+        """Путь к файлу объекта на диске узла, если бэкенд локальный, иначе None"""
+        return None
+
+    def presigned_url(self, object_name, expires=60, content_type=None, content_disposition=None):
+        """
+        Временная ссылка на объект (для отдачи через nginx), если бэкенд их поддерживает.
+
+        Args:
+            content_type, content_disposition: Заголовки, с которыми хранилище отдаст объект
+        """
+        return None
+
+
+class InvalidObjectName(ValueError):
+    """Ключ объекта нельзя отобразить в путь внутри хранилища"""
+    pass
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FilesystemStorage(StorageBackend):
+    """Объекты — файлы в шардированных директориях на локальном диске"""
+
+    def __init__(self, root, dedup=False):
+        """
+        Args:
+            root: Корневая директория хранилища
+            dedup: Хранить одинаковое содержимое один раз (жёсткие ссылки на .blobs/)
+        """
+        self.root = os.path.abspath(root)
+        self.dedup = dedup
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def _shard(object_name):
+        return hashlib.sha256(object_name.encode('utf-8')).hexdigest()[:2]
+
+    def path_for(self, object_name):
+        """
+        Путь файла объекта.
+
+        Raises:
+            InvalidObjectName: пустой ключ, абсолютный путь, '..' или служебная директория
+        """
+        parts = object_name.split('/') if isinstance(object_name, str) else []
+        if not parts or any(part in ('', '.', '..') or '\\' in part or '\x00' in part for part in parts) \
+                or parts[0] == BLOBS_DIRECTORY or parts[-1].endswith('.tmp'):
+            raise InvalidObjectName(f"Invalid object name: {object_name!r}")
+        return os.path.join(self.root, *parts[:-1], self._shard(object_name), parts[-1])
+
+    def local_path(self, object_name):
+        try:
+            path = self.path_for(object_name)
+        except InvalidObjectName:
+            return None
+        return path if os.path.isfile(path) else None
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, BLOBS_DIRECTORY, digest[:2], digest)
+
+    def _store_blob(self, file_path):
+        """Файл содержимого в .blobs/ (создаётся, если такого ещё нет)"""
+        blob_path = self._blob_path(_file_sha256(file_path))
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            temp_path = f"{blob_path}.{uuid.uuid4().hex}.tmp"
+            try:
+                shutil.copyfile(file_path, temp_path)
+                os.replace(temp_path, blob_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        return blob_path
+
+    def upload_file(self, file_path, object_name):
+        try:
+            path = self.path_for(object_name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                if self.dedup:
+                    os.link(self._store_blob(file_path), temp_path)
+                else:
+                    # copyfile на Linux копирует через sendfile, без чтения в Python
+                    shutil.copyfile(file_path, temp_path)
+                replaced = self._dedup_blob(path)
+                os.replace(temp_path, path)
+                if replaced:
+                    self._release_blob(*replaced)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            return True
+        except (OSError, InvalidObjectName) as e:
+            logger.error(f"Error uploading file: {e}")
+            return False
+
+    def download_file(self, object_name, file_path):
+        try:
+            shutil.copyfile(self.path_for(object_name), file_path)
+            return True
+        except (OSError, InvalidObjectName) as e:
+            logger.error(f"Error downloading file: {e}")
+            return False
+
+    def _dedup_blob(self, path):
+        """
+        Файл в .blobs/, на который ссылается объект (при dedup), — до его
+        замены или удаления, чтобы освободить содержимое без ссылок.
+
+        Returns:
+            tuple: (путь blob, inode) или None
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if stat.st_nlink < 2:
+            return None
+        blob_path = self._blob_path(_file_sha256(path))
+        try:
+            if os.stat(blob_path).st_ino == stat.st_ino:
+                return blob_path, stat.st_ino
+        except FileNotFoundError:
+            pass
+        return None
+
+    @staticmethod
+    def _release_blob(blob_path, inode):
+        """Удаление содержимого, на которое больше не ссылается ни один объект"""
+        try:
+            stat = os.stat(blob_path)
+            if stat.st_ino == inode and stat.st_nlink == 1:
+                os.remove(blob_path)
+        except FileNotFoundError:
+            pass
+
+    def delete_file(self, object_name):
+        try:
+            path = self.path_for(object_name)
+            blob = self._dedup_blob(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            if blob:
+                self._release_blob(*blob)
+            return True
+        except (OSError, InvalidObjectName) as e:
+            logger.error(f"Error deleting file: {e}")
+            return False
+
+    def file_exists(self, object_name):
+        return self.local_path(object_name) is not None
+
+    def touch(self, object_name):
+        try:
+            os.utime(self.path_for(object_name))
+            return True
+        except (OSError, InvalidObjectName) as e:
+            logger.error(f"Error touching file: {e}")
+            return False
+
+    def list_files(self, prefix=None):
+        # Обход только поддерева префикса: директории ключа до последнего '/'
+        start = self.root
+        if prefix and '/' in prefix:
+            directory = prefix.rsplit('/', 1)[0]
+            if any(part in ('', '.', '..') for part in directory.split('/')):
+                return []
+            start = os.path.join(self.root, *directory.split('/'))
+
+        files = []
+        for directory, subdirectories, filenames in os.walk(start):
+            if directory == self.root:
+                subdirectories[:] = [name for name in subdirectories if name != BLOBS_DIRECTORY]
+            relative = os.path.relpath(directory, self.root).replace(os.sep, '/')
+            if relative == '.':
+                continue
+            # Последний компонент пути — шард, он не входит в ключ
+            key_directory, _, shard = relative.rpartition('/')
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue
+                key = f"{key_directory}/{filename}" if key_directory else filename
+                if self._shard(key) != shard or (prefix and not key.startswith(prefix)):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(directory, filename))
+                except FileNotFoundError:
+                    continue
+                files.append({
+                    'Key': key,
+                    'Size': stat.st_size,
+                    'LastModified': datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc),
+                })
+        files.sort(key=lambda item: item['Key'])
+        return files
+
+
+def create_storage(backend=None):
+    """
+    Хранилище по STORAGE_BACKEND (s3 — по умолчанию).
+
+    Raises:
+        ValueError: неизвестный бэкенд
+    """
+    backend = (backend or os.environ.get('STORAGE_BACKEND', 's3')).strip().lower()
+    if backend == 'filesystem':
+        return FilesystemStorage(
+            os.environ.get('STORAGE_PATH', 'data/storage'),
+            dedup=os.environ.get('STORAGE_DEDUP', '0').lower() in ('1', 'true', 'yes'),
+        )
+    if backend == 's3':
+        from s3_client import S3Client
+        return S3Client()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}. Available: {', '.join(STORAGE_BACKENDS)}")
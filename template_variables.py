@@ -0,0 +1,502 @@
+"""
+Извлечение переменных DOCX шаблона по AST Jinja2.
+
+Исходник шаблона собирается так же, как перед рендерингом: docxtpl
+склеивает разбитые по runs теги и превращает {%tr %}, {%p %} и т. п.
+в обычные теги Jinja (patch_xml). Тело и колонтитулы разбираются парсером
+Jinja один раз, обход AST даёт типизированные поля:
+
+    simple  — выводимое значение {{ x }}, {{ x|upper }}, {{ x == 'a' }}
+    boolean — используется только как условие: {% if x %}, {% if a and not b %}
+    object  — {{ client.name }}: fields — пути атрибутов
+    array   — {% for item in items %}: fields — атрибуты элемента,
+              nested — вложенные циклы по атрибутам элемента
+
+position — порядок первого появления в документе (начиная с 1).
+Результат кэшируется в процессе по хешу содержимого файла.
+"""
+import re
+import hashlib
+import itertools
+import logging
+import threading
+from collections import OrderedDict
+from copy import deepcopy
+from jinja2 import Environment, nodes
+from jinja2.exceptions import TemplateSyntaxError
+
+logger = logging.getLogger(__name__)
+
+# Версия формата результата: входит в имя закэшированных метаданных (local_cache),
+# чтобы результаты прежнего извлечения не использовались
+EXTRACTOR_VERSION = 2
+VARIABLES_META = f'variables.v{EXTRACTOR_VERSION}'
+
+# Сколько результатов держать в памяти процесса
+CACHE_SIZE = 128
+
+# Имена, которые Jinja предоставляет сама
+_JINJA_GLOBALS = {'range', 'dict', 'lipsum', 'cycler', 'joiner', 'namespace', 'loop', 'caller', 'varargs', 'kwargs'}
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class _Variable:
+    """Переменная или поле: тип определяется по тому, как оно используется"""
+
+    def __init__(self, position):
+        self.position = position
+        self.is_array = False
+        self.as_value = False
+        self.as_test = False
+        # Поля объекта / элемента массива (в порядке появления)
+        self.fields = OrderedDict()
+
+    def field(self, name):
+        if name not in self.fields:
+            self.fields[name] = _Variable(None)
+        return self.fields[name]
+
+    @property
+    def kind(self):
+        if self.is_array:
+            return 'array'
+        if self.fields:
+            return 'object'
+        if self.as_test and not self.as_value:
+            return 'boolean'
+        return 'simple'
+
+    def to_dict(self, top_level=True):
+        result = {'type': self.kind}
+        if self.kind == 'array':
+            result['fields'] = list(self.fields)
+            nested = {name: child.to_dict(False) for name, child in self.fields.items() if child.is_array}
+            if nested:
+                result['nested'] = nested
+        elif self.kind == 'object':
+            result['fields'] = _object_paths(self)
+        if top_level:
+            result['position'] = self.position
+        return result
+
+
+def _object_paths(variable, prefix=''):
+    """Поля объекта как пути через точку: client.address.city → address.city"""
+    paths = []
+    for name, child in variable.fields.items():
+        path = f'{prefix}{name}'
+        if child.fields and not child.is_array:
+            paths.extend(_object_paths(child, path + '.'))
+        else:
+            paths.append(path)
+    return paths
+
+
+class _Collector:
+    """Обход AST с областями видимости: переменные циклов, set, macro"""
+
+    def __init__(self):
+        self.variables = OrderedDict()
+        self.counter = itertools.count(1)
+        # Стек областей: имя → _Variable элемента цикла или None (локальное имя без структуры)
+        self.scopes = [{}]
+
+    def _lookup(self, name):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return True, scope[name]
+        return False, None
+
+    def _root(self, name):
+        if name not in self.variables:
+            self.variables[name] = _Variable(next(self.counter))
+        return self.variables[name]
+
+    @staticmethod
+    def _path(node):
+        """Цепочка name.attr['key'] → (name, [attr, key]) или None"""
+        attrs = []
+        while True:
+            if isinstance(node, nodes.Getattr):
+                attrs.append(node.attr)
+                node = node.node
+            elif isinstance(node, nodes.Getitem) and isinstance(node.arg, nodes.Const) \
+                    and isinstance(node.arg.value, str):
+                attrs.append(node.arg.value)
+                node = node.node
+            elif isinstance(node, nodes.Getitem):
+                # x[i] — индекс по выражению: важна только база
+                node = node.node
+            elif isinstance(node, nodes.Name):
+                return node.name, list(reversed(attrs))
+            else:
+                return None
+
+    def _resolve(self, name, attrs):
+        """_Variable для пути или None (локальное имя без структуры, глобальная функция Jinja)"""
+        found, binding = self._lookup(name)
+        if found:
+            variable = binding
+        elif name in _JINJA_GLOBALS:
+            return None
+        else:
+            variable = self._root(name)
+        if variable is None:
+            return None
+        for attr in attrs:
+            variable = variable.field(attr)
+        return variable
+
+    def reference(self, node, as_test=False):
+        """Обращение к значению; as_test — в условии (if, and/or/not)"""
+        path = self._path(node)
+        if path is not None:
+            variable = self._resolve(*path)
+            if variable is not None:
+                if as_test:
+                    variable.as_test = True
+                else:
+                    variable.as_value = True
+            # Выражения в индексах x[y] тоже могут ссылаться на переменные
+            for child in node.find_all(nodes.Getitem):
+                if not isinstance(child.arg, nodes.Const):
+                    self.reference(child.arg)
+            return
+
+        if as_test and isinstance(node, (nodes.And, nodes.Or)):
+            self.reference(node.left, as_test=True)
+            self.reference(node.right, as_test=True)
+        elif as_test and isinstance(node, nodes.Not):
+            self.reference(node.node, as_test=True)
+        elif isinstance(node, nodes.CondExpr):
+            self.reference(node.test, as_test=True)
+            self.reference(node.expr1)
+            if node.expr2 is not None:
+                self.reference(node.expr2)
+        elif isinstance(node, nodes.Call) and isinstance(node.node, nodes.Getattr) \
+                and node.node.attr in ('items', 'values', 'keys'):
+            # x.items() — обращение к самому x, а не к полю items
+            self.reference(node.node.node, as_test)
+            self._visit_arguments(node)
+        elif isinstance(node, nodes.Call):
+            if not isinstance(node.node, nodes.Name):
+                self.reference(node.node)
+            self._visit_arguments(node)
+        else:
+            for child in node.iter_child_nodes():
+                if isinstance(child, nodes.Expr):
+                    self.reference(child)
+                else:
+                    self.visit(child)
+
+    def _visit_arguments(self, call):
+        for arg in call.args:
+            self.reference(arg)
+        for keyword in call.kwargs:
+            self.reference(keyword.value)
+        for extra in (call.dyn_args, call.dyn_kwargs):
+            if extra is not None:
+                self.reference(extra)
+
+    def _iterable(self, node):
+        """_Variable массива, по которому идёт цикл (с учётом |filter и .items())"""
+        while True:
+            if isinstance(node, (nodes.Filter, nodes.Test)) and node.node is not None:
+                for arg in node.args:
+                    self.reference(arg)
+                node = node.node
+            elif isinstance(node, nodes.Call) and isinstance(node.node, nodes.Getattr) \
+                    and node.node.attr in ('items', 'values', 'keys'):
+                node = node.node.node
+            else:
+                break
+        path = self._path(node)
+        if path is None:
+            self.reference(node)
+            return None
+        variable = self._resolve(*path)
+        if variable is not None:
+            variable.is_array = True
+        return variable
+
+    def _bind(self, target, value, scope):
+        for name_node in target.find_all(nodes.Name) if not isinstance(target, nodes.Name) else [target]:
+            scope[name_node.name] = value
+
+    def visit(self, node):
+        if isinstance(node, nodes.Output):
+            for child in node.nodes:
+                if not isinstance(child, nodes.TemplateData):
+                    self.reference(child)
+        elif isinstance(node, nodes.For):
+            array = self._iterable(node.iter)
+            scope = {'loop': None}
+            # Элемент массива: атрибуты элемента — поля массива
+            item = array if array is not None and isinstance(node.target, nodes.Name) else None
+            self._bind(node.target, item, scope)
+            if isinstance(node.target, nodes.Tuple):
+                # for key, value in x.items(): значения без структуры
+                self._bind(node.target, None, scope)
+            self.scopes.append(scope)
+            if node.test is not None:
+                self.reference(node.test, as_test=True)
+            for child in node.body:
+                self.visit(child)
+            self.scopes.pop()
+            for child in node.else_:
+                self.visit(child)
+        elif isinstance(node, nodes.If):
+            self.reference(node.test, as_test=True)
+            for child in node.body:
+                self.visit(child)
+            for child in node.elif_:
+                self.visit(child)
+            for child in node.else_:
+                self.visit(child)
+        elif isinstance(node, nodes.Assign):
+            self.reference(node.node)
+            self._bind(node.target, None, self.scopes[-1])
+        elif isinstance(node, nodes.AssignBlock):
+            for child in node.body:
+                self.visit(child)
+            self._bind(node.target, None, self.scopes[-1])
+        elif isinstance(node, (nodes.Macro, nodes.CallBlock)):
+            scope = {}
+            for arg in node.args:
+                scope[arg.name] = None
+            if isinstance(node, nodes.CallBlock):
+                self.reference(node.call)
+            for default in node.defaults:
+                self.reference(default)
+            self.scopes.append(scope)
+            for child in node.body:
+                self.visit(child)
+            self.scopes.pop()
+            if isinstance(node, nodes.Macro):
+                self.scopes[-1][node.name] = None
+        elif isinstance(node, nodes.With):
+            scope = {}
+            for target, value in zip(node.targets, node.values):
+                self.reference(value)
+                self._bind(target, None, scope)
+            self.scopes.append(scope)
+            for child in node.body:
+                self.visit(child)
+            self.scopes.pop()
+        elif isinstance(node, nodes.Expr):
+            self.reference(node)
+        else:
+            for child in node.iter_child_nodes():
+                self.visit(child)
+
+
+def template_source(doc_path):
+    """
+    Исходник шаблона в том виде, в каком его видит Jinja при рендеринге:
+    тело и колонтитулы после patch_xml docxtpl.
+
+    Returns:
+        list: исходники частей (тело первым)
+    """
+    from rendering import SnippetAwareTemplate
+
+    template = SnippetAwareTemplate(doc_path)
+    template.init_docx()
+    sources = [template.patch_xml(template.get_xml())]
+    for uri in (template.HEADER_URI, template.FOOTER_URI):
+        for _, part in template.get_headers_footers(uri):
+            sources.append(template.patch_xml(template.get_part_xml(part)))
+    return sources
+
+
+def parse_variables(sources):
+    """
+    Типизированные переменные по исходникам частей шаблона.
+
+    Raises:
+        TemplateSyntaxError: шаблон не разбирается Jinja
+    """
+    from rendering import SNIPPET_ESCAPED_PATTERN
+
+    environment = Environment()
+    collector = _Collector()
+    snippets = []
+    for source in sources:
+        collector.visit(environment.parse(source))
+        for match in SNIPPET_ESCAPED_PATTERN.finditer(source):
+            if match.group(1) not in snippets:
+                snippets.append(match.group(1))
+
+    result = {name: variable.to_dict() for name, variable in collector.variables.items()}
+    result['__snippets__'] = [{'name': name, 'position': index} for index, name in enumerate(snippets, start=1)]
+    return result
+
+
+def _content_hash(doc_path):
+    digest = hashlib.sha256()
+    with open(doc_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def extract_template_variables(doc_path):
+    """
+    Извлечение всех Jinja2 переменных из DOCX шаблона.
+
+    Returns:
+        dict: {имя: {'type', 'position', 'fields'?, 'nested'?}, '__snippets__': [...]}
+              ({} если файл не удалось прочитать)
+    """
+    try:
+        key = _content_hash(doc_path)
+    except OSError as e:
+        logger.error(f"Error extracting variables: {e}")
+        return {}
+
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            # Копия: вызывающий код может менять результат (pop '__snippets__')
+            return deepcopy(_cache[key])
+
+    try:
+        result = parse_variables(template_source(doc_path))
+    except TemplateSyntaxError as e:
+        # Шаблон всё равно не отрендерится, но форму для него показать нужно
+        logger.warning(f"Template syntax error at line {e.lineno}: {e.message}; falling back to regex extraction")
+        result = extract_variables_by_regex(doc_path)
+    except Exception as e:
+        logger.error(f"Error extracting variables: {e}")
+        return {}
+
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return deepcopy(result)
+
+
+def extract_variables_by_regex(doc_path):
+    """
+    Прежнее извлечение регулярными выражениями по тексту параграфов и таблиц.
+    Используется, если шаблон не разбирается парсером Jinja.
+    """
+    from docx import Document
+
+    try:
+        doc = Document(doc_path)
+        text_content = []
+
+        # Извлечение текста из параграфов
+        for paragraph in doc.paragraphs:
+            text_content.append(paragraph.text)
+
+        # Извлечение текста из таблиц
+        for table in doc.tables:
+            for row in table.rows:
+                for cell in row.cells:
+                    text_content.append(cell.text)
+
+        # Объединение всего текста
+        full_text = ' '.join(text_content)
+
+        # Поиск простых переменных {{variable}} (с поддержкой кириллицы) с позициями
+        simple_pattern = r'\{\{\s*([a-zA-Zа-яА-ЯёЁ_][a-zA-Zа-яА-ЯёЁ0-9_\.]*?)\s*(?:\|[^}]*)?\}\}'
+        simple_matches = [(m.group(1), m.start()) for m in re.finditer(simple_pattern, full_text)]
+
+        # Поиск переменных в циклах {% for item in items %} с позициями
+        loop_pattern = r'\{%\s*for\s+[a-zA-Zа-яА-ЯёЁ_][a-zA-Zа-яА-ЯёЁ0-9_]*\s+in\s+([a-zA-Zа-яА-ЯёЁ_][a-zA-Zа-яА-ЯёЁ0-9_]*)\s*%\}'
+        loop_matches = [(m.group(1), m.start()) for m in re.finditer(loop_pattern, full_text)]
+
+        # Поиск переменных в условиях {% if variable %} с позициями
+        if_pattern = r'\{%\s*if\s+([a-zA-Zа-яА-ЯёЁ_][a-zA-Zа-яА-ЯёЁ0-9_]*)\s*%\}'
+        if_matches = [(m.group(1), m.start()) for m in re.finditer(if_pattern, full_text)]
+
+        # Поиск SNIPPET-меток {{SNIPPET:name}}
+        snippet_pattern = r'\{\{\s*SNIPPET\s*:\s*([a-zA-Zа-яА-ЯёЁ0-9_]+)\s*\}\}'
+        snippet_matches = [(m.group(1), m.start()) for m in re.finditer(snippet_pattern, full_text)]
+
+        # Создаем словарь позиций (первое вхождение каждой переменной)
+        var_positions = {}
+        for var, pos in simple_matches + loop_matches + if_matches:
+            if var not in var_positions:
+                var_positions[var] = pos
+
+        # Списки переменных (для определения типов)
+        simple_vars = [m[0] for m in simple_matches]
+        loop_vars = [m[0] for m in loop_matches]
+        if_vars = [m[0] for m in if_matches]
+
+        # Объединение всех переменных
+        all_vars = set(simple_vars + loop_vars + if_vars)
+
+        # Имена SNIPPET-меток (исключаем из обычных переменных)
+        snippet_names = set(m[0] for m in snippet_matches)
+        all_vars = all_vars - snippet_names
+
+        # Разделение на простые переменные и вложенные объекты
+        fields = {}
+        arrays = set()
+
+        for var in all_vars:
+            # Пропускаем переменные цикла (loop.index и т.д.)
+            if var.startswith('loop.'):
+                continue
+
+            # Проверяем, является ли это вложенным объектом
+            if '.' in var:
+                parts = var.split('.')
+                root = parts[0]
+
+                # Если корневая переменная в циклах, это массив объектов
+                if root in loop_vars:
+                    arrays.add(root)
+                    if root not in fields:
+                        fields[root] = {'type': 'array', 'fields': set(), 'position': var_positions.get(root, 9999)}
+                    # Добавляем поле объекта
+                    fields[root]['fields'].add(parts[1])
+                else:
+                    # Простой вложенный объект
+                    if root not in fields:
+                        fields[root] = {'type': 'object', 'fields': set(), 'position': var_positions.get(root, 9999)}
+                    fields[root]['fields'].add('.'.join(parts[1:]))
+            else:
+                # Определяем тип переменной
+                if var in loop_vars:
+                    arrays.add(var)
+                    if var not in fields:
+                        fields[var] = {'type': 'array', 'fields': set(), 'position': var_positions.get(var, 9999)}
+                elif var in if_vars:
+                    # Условная переменная - вероятно boolean
+                    if var not in fields:
+                        fields[var] = {'type': 'boolean', 'position': var_positions.get(var, 9999)}
+                else:
+                    # Простая переменная
+                    if var not in fields:
+                        fields[var] = {'type': 'simple', 'position': var_positions.get(var, 9999)}
+
+        # Преобразуем sets в lists для JSON
+        result = {}
+        for key, value in fields.items():
+            if isinstance(value, dict):
+                if 'fields' in value and isinstance(value['fields'], set):
+                    value['fields'] = sorted(list(value['fields']))
+                result[key] = value
+            else:
+                result[key] = value
+
+        # Добавляем SNIPPET-метки
+        snippets_list = []
+        for name, pos in snippet_matches:
+            if name not in [s['name'] for s in snippets_list]:
+                snippets_list.append({'name': name, 'position': pos})
+        result['__snippets__'] = snippets_list
+
+        return result
+
+    except Exception as e:
+        logger.error(f"Error extracting variables: {e}")
+        return {}
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты контроля допуска к рендерингу (admission)
+"""
+
+import tempfile
+import threading
+import pytest
+from flask_login import login_user
+from admission import AdmissionController, AdmissionRejected
+
+
+def _controller(**options):
+    defaults = {'global_limit': 1, 'per_user_limit': 1, 'queue_size': 1, 'queue_timeout': 5, 'poll_interval': 0.01}
+    defaults.update(options)
+    return AdmissionController(lock_dir=tempfile.mkdtemp(), **defaults)
+
+
+def test_admitted_queued_and_rejected():
+    """Свободный слот — сразу, занятый — очередь до освобождения, сверх очереди и лимита пользователя — отказ"""
+    controller = _controller()
+    first = controller.acquire(1)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire(1)
+    assert rejected.value.reason == 'user_limit'
+
+    queued = {}
+
+    def wait_in_queue():
+        while 'token' not in queued:
+            try:
+                queued['token'] = controller.acquire(2)
+            except AdmissionRejected as e:
+                # Место в очереди могла занять проверка ниже
+                assert e.reason == 'queue_full'
+
+    waiting = threading.Thread(target=wait_in_queue)
+    waiting.start()
+    # Ждём, пока второй запрос займёт место в очереди: тогда третьему места нет
+    for _ in range(500):
+        probe = controller._try_acquire('queue', controller.queue_size)
+        if probe is None:
+            break
+        controller._release(probe)
+        waiting.join(0.01)
+    else:
+        pytest.fail('request was not queued')
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire(3)
+    assert rejected.value.reason == 'queue_full'
+    assert 'token' not in queued
+
+    controller.release(first)
+    waiting.join(5)
+    assert 'token' in queued
+    controller.release(queued['token'])
+
+    short = _controller(queue_timeout=0.1)
+    token = short.acquire(1)
+    with pytest.raises(AdmissionRejected) as rejected:
+        short.acquire(2)
+    assert rejected.value.reason == 'queue_timeout' and rejected.value.retry_after == 5
+    short.release(token)
+    short.release(short.acquire(2))
+
+
+def test_render_admission_responds_429_with_retry_after():
+    """Декоратор тяжёлых endpoint'ов: при исчерпанном лимите — 429 и Retry-After"""
+    from app import create_app, get_admission, render_admission
+    from models import User
+
+    app = create_app({'ADMISSION_LOCK_DIR': tempfile.mkdtemp(), 'RENDER_RETRY_AFTER': 7, 'RENDER_MAX_PER_USER': 1})
+    view = render_admission(lambda: 'rendered')
+
+    with app.test_request_context('/generate', method='POST'):
+        login_user(User(7, 'user', 'user@example.com'))
+        assert view() == 'rendered'
+
+        token = get_admission().acquire(7)
+        try:
+            response = view()
+        finally:
+            get_admission().release(token)
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '7'
+        assert response.get_json()['reason'] == 'user_limit'
+
+        assert view() == 'rendered'
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты офлайн массовой генерации (batch_generate)
+"""
+
+import os
+import json
+import zipfile
+import tempfile
+from docx import Document
+from batch_generate import main, template_fingerprint, save_checkpoint
+
+
+def _template(directory):
+    path = os.path.join(directory, 'template.docx')
+    doc = Document()
+    doc.add_paragraph('Клиент: {{ фамилия }}, город: {{ адрес.город }}')
+    doc.save(path)
+    return path
+
+
+def test_jsonl_resume_keeps_errors_and_unique_names():
+    """Продолжение учитывает ошибки из контрольной точки; одинаковые имена не перезаписываются"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        template = _template(temp_dir)
+        contexts = os.path.join(temp_dir, 'contexts.jsonl')
+        with open(contexts, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'фамилия': 'Иванов', 'адрес': {'город': 'Москва'}}, ensure_ascii=False) + '\n')
+            f.write('{broken\n')
+            f.write(json.dumps({'фамилия': 'иванов', 'адрес': {'город': 'Тверь'}}, ensure_ascii=False) + '\n')
+        output = os.path.join(temp_dir, 'out')
+        argv = [template, contexts, '-o', output, '-j', '1', '--name-pattern', '{фамилия}.docx']
+
+        assert main(argv) == 1
+        assert sorted(name for name in os.listdir(output) if name.endswith('.docx')) == \
+            ['Иванов.docx', 'иванов_000002.docx']
+        assert Document(os.path.join(output, 'иванов_000002.docx')).paragraphs[0].text == \
+            'Клиент: иванов, город: Тверь'
+
+        # Прерванный запуск: обработаны две записи, одна с ошибкой
+        os.unlink(os.path.join(output, 'иванов_000002.docx'))
+        save_checkpoint(os.path.join(output, '.checkpoint.json'), template_fingerprint(template, contexts), 2, 1)
+        assert main(argv) == 1
+        assert os.path.exists(os.path.join(output, 'иванов_000002.docx'))
+        with open(os.path.join(output, 'errors.jsonl'), encoding='utf-8') as f:
+            assert [json.loads(line)['index'] for line in f] == [1]
+
+        # --restart начинает журнал ошибок заново
+        assert main(argv + ['--restart']) == 1
+        with open(os.path.join(output, 'errors.jsonl'), encoding='utf-8') as f:
+            assert [json.loads(line)['index'] for line in f] == [1]
+
+
+def test_csv_to_zip():
+    """CSV с вложенными колонками → ZIP со всеми документами, промежуточная директория удаляется"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        template = _template(temp_dir)
+        contexts = os.path.join(temp_dir, 'contexts.csv')
+        with open(contexts, 'w', encoding='utf-8', newline='') as f:
+            f.write('фамилия,адрес.город\nПетров,Казань\nПетров,Омск\n')
+        output = os.path.join(temp_dir, 'out.zip')
+
+        assert main([template, contexts, '-o', output, '-j', '1', '--name-pattern', '{фамилия}']) == 0
+        assert not os.path.exists(f"{output}.parts")
+        with zipfile.ZipFile(output) as zf:
+            assert zf.namelist() == ['Петров.docx', 'Петров_000001.docx']
+            document = Document(zf.open('Петров_000001.docx'))
+        assert document.paragraphs[0].text == 'Клиент: Петров, город: Омск'
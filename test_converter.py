@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты конвертера {var} → {{var}} (convert_brackets_final)
+"""
+
+import os
+import json
+import tempfile
+from docx import Document
+from jinja2 import Template
+from convert_brackets_final import convert_docx, collect_inputs, load_manifest, main
+
+
+def _save_temp(doc):
+    temp_file = tempfile.NamedTemporaryFile(suffix='.docx', delete=False)
+    temp_file.close()
+    doc.save(temp_file.name)
+    return temp_file.name
+
+
+def test_split_runs_keep_formatting():
+    """Метка разбита на несколько run'ов — форматирование каждого run сохраняется"""
+    doc = Document()
+    paragraph = doc.add_paragraph()
+    paragraph.add_run('Клиент: ')
+    bold = paragraph.add_run('{Фамилия')
+    bold.bold = True
+    paragraph.add_run(' клиента}')
+    italic = paragraph.add_run(', дата')
+    italic.italic = True
+    temp_path = _save_temp(doc)
+
+    try:
+        changes, replacements = convert_docx(temp_path)
+        assert changes == 1
+        assert replacements == {'Фамилия клиента': 'Фамилия_клиента'}
+
+        result = Document(temp_path).paragraphs[0]
+        assert result.text == 'Клиент: {{Фамилия_клиента}}, дата'
+        assert result.runs[1].text == '{{Фамилия_клиента}}'
+        assert result.runs[1].bold
+        assert result.runs[3].italic
+    finally:
+        os.unlink(temp_path)
+
+
+def test_headers_tables_and_jinja_tags():
+    """Колонтитулы и таблицы конвертируются, Jinja2-теги не затрагиваются"""
+    doc = Document()
+    doc.sections[0].header.paragraphs[0].text = 'Договор № {номер-договора}'
+    doc.add_paragraph('{% if vip %}{{ уже_готово }}{% endif %}')
+    doc.add_paragraph("{% set opts = {'a': 1} %}{{ {'b': 2}['b'] }} {{ opts['a'] }} {имя}")
+    table = doc.add_table(rows=1, cols=1)
+    table.cell(0, 0).text = '{адрес}'
+    temp_path = _save_temp(doc)
+
+    try:
+        changes, replacements = convert_docx(temp_path)
+        assert changes == 3
+        assert set(replacements.values()) == {'номер_договора', 'адрес', 'имя'}
+
+        result = Document(temp_path)
+        assert result.sections[0].header.paragraphs[0].text == 'Договор № {{номер_договора}}'
+        assert result.paragraphs[0].text == '{% if vip %}{{ уже_готово }}{% endif %}'
+        # Литералы словарей внутри {% set %} и {{ }} остаются как есть, шаблон компилируется
+        dict_literals = result.paragraphs[1].text
+        assert dict_literals == "{% set opts = {'a': 1} %}{{ {'b': 2}['b'] }} {{ opts['a'] }} {{имя}}"
+        assert Template(dict_literals).render(имя='x') == '2 1 x'
+        assert result.tables[0].cell(0, 0).text == '{{адрес}}'
+    finally:
+        os.unlink(temp_path)
+
+
+def _batch_tree(root):
+    """partners/a/Договор.docx и partners/b/Договор.docx — одинаковые имена в разных папках"""
+    for folder, text in (('a', '{адрес}'), ('b', '{номер-договора}')):
+        os.makedirs(os.path.join(root, 'partners', folder))
+        doc = Document()
+        doc.add_paragraph(text)
+        doc.save(os.path.join(root, 'partners', folder, 'Договор.docx'))
+
+
+def test_batch_keeps_relative_paths_and_manifest():
+    """Результаты по относительным путям; --force дополняет манифест, смена вывода — повторная конвертация"""
+    with tempfile.TemporaryDirectory() as root:
+        _batch_tree(root)
+        pattern = os.path.join(root, 'partners', '**', '*.docx')
+        output_dir = os.path.join(root, 'out')
+        pairs = collect_inputs([pattern], output_dir)
+        assert [os.path.relpath(output, output_dir) for _, output in pairs] == [
+            os.path.join('a', 'Договор.docx'), os.path.join('b', 'Договор.docx'),
+        ]
+
+        args = [pattern, '-o', output_dir, '-e', os.path.join(root, 'examples'), '-j', '1']
+        assert main(args) == 0
+        assert Document(os.path.join(output_dir, 'b', 'Договор.docx')).paragraphs[0].text == '{{номер_договора}}'
+        with open(os.path.join(root, 'examples', 'a', 'Договор_шаблон.json'), encoding='utf-8') as f:
+            assert json.load(f) == {'адрес': '<адрес>'}
+
+        manifest_path = os.path.join(output_dir, '.convert_manifest.json')
+        assert len(load_manifest(manifest_path)) == 2
+
+        # --force по одному файлу не стирает запись второго
+        only_a = os.path.join(root, 'partners', 'a', '*.docx')
+        assert main([only_a, '-o', os.path.join(output_dir, 'a'), '--no-examples', '--force',
+                     '--manifest', manifest_path, '-j', '1']) == 0
+        assert len(load_manifest(manifest_path)) == 2
+
+        # Тот же вход в другую директорию вывода — не «без изменений»
+        other_dir = os.path.join(root, 'other')
+        assert main([pattern, '-o', other_dir, '--no-examples', '--manifest', manifest_path, '-j', '1']) == 0
+        assert os.path.exists(os.path.join(other_dir, 'a', 'Договор.docx'))
+        assert os.path.exists(os.path.join(other_dir, 'b', 'Договор.docx'))
+
+
+def test_colliding_outputs_are_skipped():
+    """Два аргумента-директории с одинаковыми относительными путями не перезаписывают результат"""
+    with tempfile.TemporaryDirectory() as root:
+        _batch_tree(root)
+        pairs = collect_inputs(
+            [os.path.join(root, 'partners', 'a'), os.path.join(root, 'partners', 'b')], os.path.join(root, 'out')
+        )
+        assert pairs == []
+
+
+if __name__ == '__main__':
+    test_split_runs_keep_formatting()
+    test_headers_tables_and_jinja_tags()
+    test_batch_keeps_relative_paths_and_manifest()
+    test_colliding_outputs_are_skipped()
+    print("✅ Все тесты конвертера пройдены!")
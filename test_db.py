@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты построения поисковых запросов (db)
+"""
+
+from db import _websearch_prefix_tsquery
+
+
+def test_prefix_tsquery_keeps_websearch_operators():
+    """Префикс только у последнего слова; исключения, фразы и or сохраняются"""
+    assert _websearch_prefix_tsquery('Иван мар') == 'иван & мар:*'
+    assert _websearch_prefix_tsquery('договор -аренда') == 'договор:* & !аренда'
+    assert _websearch_prefix_tsquery('мар -"договор аренды"') == 'мар:* & !(договор <-> аренды)'
+    assert _websearch_prefix_tsquery('"иван петров" or мар') == 'иван <-> петров | мар:*'
+    assert _websearch_prefix_tsquery('"иван петров"') == 'иван <-> петров'
+    assert _websearch_prefix_tsquery('договор or') == 'договор:*'
+    assert _websearch_prefix_tsquery('or -') == ''
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты двухуровневого хранилища сгенерированных документов (document_store)
+"""
+
+import os
+import time
+import tempfile
+from document_store import TieredDocumentStore
+from local_cache import LocalFileCache
+from storage import FilesystemStorage
+
+
+def _store(temp_dir, **cache_options):
+    storage = FilesystemStorage(os.path.join(temp_dir, 'storage'))
+    hot = LocalFileCache(os.path.join(temp_dir, 'hot'), min_age=0, **cache_options)
+    return TieredDocumentStore(storage, hot), storage
+
+
+def _document(temp_dir, name, size=1000):
+    path = os.path.join(temp_dir, name)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return path
+
+
+def test_recent_documents_read_from_hot_tier_and_promoted_after_expiry():
+    """Новый документ читается с диска; после срока — из хранилища и снова с диска"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store, storage = _store(temp_dir, ttl=3600)
+        output = _document(temp_dir, 'filled.docx')
+
+        assert store.put('generated/1_filled.docx', output)
+        assert os.path.exists(output) and storage.file_exists('generated/1_filled.docx')
+
+        path = store.get_path('generated/1_filled.docx')
+        assert path.startswith(os.path.join(temp_dir, 'hot'))
+        assert store.stats() == {'hot': 1, 'cold': 0, 'hot_hit_ratio': 1.0}
+
+        # Документ не читали дольше срока: горячий уровень его не отдаёт
+        past = time.time() - 7200
+        os.utime(path, (past, past))
+        assert store.get_path('generated/1_filled.docx') == path
+        assert store.get_path('generated/1_filled.docx') == path
+        assert store.stats() == {'hot': 2, 'cold': 1, 'hot_hit_ratio': 0.6667}
+
+        assert store.get_path('generated/missing.docx') is None
+
+        assert store.delete('generated/1_filled.docx')
+        assert not os.path.exists(path) and not storage.file_exists('generated/1_filled.docx')
+
+
+def test_hot_tier_size_budget_and_ttl_eviction():
+    """Сверх бюджета и по сроку с диска уходят старые документы, в хранилище они остаются"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store, storage = _store(temp_dir, max_bytes=2500, ttl=3600)
+        for index in range(3):
+            store.put(f'generated/{index}.docx', _document(temp_dir, f'{index}.docx'))
+            path = store.hot.path_for(f'generated/{index}.docx')
+            if os.path.exists(path):
+                past = time.time() - 600 * (3 - index)
+                os.utime(path, (past, past))
+
+        assert store.hot.get('generated/0.docx') is None
+        assert store.hot.get('generated/2.docx') is not None
+
+        expired = time.time() - 7200
+        os.utime(store.hot.path_for('generated/2.docx'), (expired, expired))
+        store.hot.evict()
+        assert not os.path.exists(store.hot.path_for('generated/2.docx'))
+        assert all(storage.file_exists(f'generated/{index}.docx') for index in range(3))
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты отдачи файлов через nginx (download_offload)
+"""
+
+import os
+import tempfile
+from flask import Response
+from download_offload import ACCEL_HEADER, accel_response, accel_uri, s3_accel_uri
+
+
+def test_accel_uri_maps_files_to_internal_locations():
+    """Файл в известной директории — URI location (самое длинное совпадение), вне — None"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output = os.path.join(temp_dir, 'output')
+        hot = os.path.join(output, 'hot')
+        os.makedirs(hot)
+        locations = {'output': output, 'hot': hot, 'cache': None}
+
+        assert accel_uri(os.path.join(output, 'отчёт 1.docx'), locations, '/_protected/') == \
+            '/_protected/output/%D0%BE%D1%82%D1%87%D1%91%D1%82%201.docx'
+        assert accel_uri(os.path.join(hot, 'ab', 'doc.docx'), locations, '/_protected') == '/_protected/hot/ab/doc.docx'
+        assert accel_uri(os.path.join(output, '..', 'secret.txt'), locations, '/_protected') is None
+        assert accel_uri(output, locations, '/_protected') is None
+
+
+def test_accel_response_headers_and_s3_uri():
+    """Пустой ответ с X-Accel-Redirect и Content-Disposition; ссылка S3 — в internal URI"""
+    response = accel_response(Response, '/_protected/output/a.docx', 'application/pdf', download_name='Договор.pdf')
+    assert response.headers[ACCEL_HEADER] == '/_protected/output/a.docx'
+    assert response.mimetype == 'application/pdf'
+    assert response.get_data() == b''
+    disposition = response.headers['Content-Disposition']
+    assert disposition.startswith('attachment;') and "filename*=UTF-8''%D0%94" in disposition
+
+    inline = accel_response(Response, '/_protected/cache/i.png', 'image/png', as_attachment=False)
+    assert 'Content-Disposition' not in inline.headers
+
+    url = 'http://minio:9000/templates/snippets/1_a.docx?X-Amz-Signature=abc&X-Amz-Expires=60'
+    assert s3_accel_uri(url, '/_protected') == \
+        '/_protected/s3/templates/snippets/1_a.docx?X-Amz-Signature=abc&X-Amz-Expires=60'
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты JSON Patch (json_patch) для перегенерации из истории
+"""
+
+import pytest
+from json_patch import apply_patch, JsonPatchError, JsonPatchTestFailed
+
+
+def test_apply_patch_operations():
+    """Все операции RFC 6902, исходный документ не меняется"""
+    context = {
+        'номер': '001/2026',
+        'items': [{'name': 'Товар 1'}, {'name': 'Товар 2'}],
+        'a/b': {'~': 1},
+    }
+    patched = apply_patch(context, [
+        {'op': 'test', 'path': '/номер', 'value': '001/2026'},
+        {'op': 'replace', 'path': '/номер', 'value': '002/2026'},
+        {'op': 'add', 'path': '/items/-', 'value': {'name': 'Товар 3'}},
+        {'op': 'remove', 'path': '/items/0'},
+        {'op': 'copy', 'from': '/items/0', 'path': '/first'},
+        {'op': 'move', 'from': '/a~1b/~0', 'path': '/moved'},
+    ])
+
+    assert patched == {
+        'номер': '002/2026',
+        'items': [{'name': 'Товар 2'}, {'name': 'Товар 3'}],
+        'a/b': {},
+        'first': {'name': 'Товар 2'},
+        'moved': 1,
+    }
+    assert context['номер'] == '001/2026' and len(context['items']) == 2
+
+
+def test_apply_patch_errors():
+    """Несуществующий путь — ошибка патча, неверный test — отдельное исключение"""
+    with pytest.raises(JsonPatchError):
+        apply_patch({'a': 1}, [{'op': 'replace', 'path': '/b', 'value': 2}])
+    with pytest.raises(JsonPatchError):
+        apply_patch({'a': [1]}, [{'op': 'add', 'path': '/a/5', 'value': 2}])
+    with pytest.raises(JsonPatchError):
+        apply_patch({'a': 1}, {'op': 'remove', 'path': '/a'})
+    with pytest.raises(JsonPatchTestFailed):
+        apply_patch({'a': 1}, [{'op': 'test', 'path': '/a', 'value': 2}])
+
+    # test сравнивает и тип: true не равно 1, 0 не равно false, [1] не равно [true]
+    for document, value in (({'a': True}, 1), ({'a': 0}, False), ({'a': [1]}, [True]), ({'a': {'b': 1}}, {'b': '1'})):
+        with pytest.raises(JsonPatchTestFailed):
+            apply_patch(document, [{'op': 'test', 'path': '/a', 'value': value}])
+    assert apply_patch({'a': 1}, [{'op': 'test', 'path': '/a', 'value': 1.0}]) == {'a': 1}
+
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты нагрузочного сценария (loadtest): статистика и прогон против локального HTTP-сервера
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from loadtest import RouteStats, main, parse_mix, percentile
+
+
+def test_percentiles_and_route_stats():
+    """Перцентили с интерполяцией; 429 — отказ, а не ошибка"""
+    assert percentile([], 50) is None
+    assert percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.5
+    assert percentile([1.0, 2.0, 3.0, 4.0], 100) == 4.0
+    assert parse_mix('generate=3, history') == {'generate': 3.0, 'history': 1.0}
+
+    stats = RouteStats()
+    for latency, status in [(0.1, 200), (0.2, 200), (0.3, 429), (0.4, 500), (0.5, None)]:
+        stats.record(latency, status)
+    summary = stats.summary(elapsed=2.0)
+    assert summary['requests'] == 5
+    assert summary['throughput'] == 1.0
+    assert summary['error_rate'] == 0.4 and summary['rejected_rate'] == 0.2
+    assert summary['statuses'] == {'200': 2, '429': 1, '500': 1, 'connection': 1}
+    assert summary['p50_ms'] == 300.0 and summary['max_ms'] == 500.0
+
+
+class _FakeApp(BaseHTTPRequestHandler):
+    """Маршруты приложения с минимальными ответами (сессия — cookie)"""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def _reply(self, status, payload=None, headers=None):
+        body = json.dumps(payload or {}).encode('utf-8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/register':
+            self._reply(302, headers={'Location': '/', 'Set-Cookie': 'session=abc; HttpOnly; Path=/'})
+        elif 'session=abc' not in self.headers.get('Cookie', ''):
+            self._reply(401)
+        elif self.path == '/parse-template':
+            self._reply(200, {'success': True, 'template_file': 'token'})
+        elif self.path == '/snippets/categories':
+            self._reply(200, {'success': True, 'category_id': 1})
+        elif self.path == '/snippets/items':
+            self._reply(200, {'success': True, 'snippet_id': 7})
+        elif self.path == '/generate':
+            self._reply(200, {'success': True})
+        else:
+            self._reply(429)
+
+    def do_GET(self):
+        self._reply(200, {'success': True})
+
+    def log_message(self, *args):
+        pass
+
+
+def test_run_against_local_server(tmp_path):
+    """Полный прогон: подготовка пользователей, смесь операций, отчёт по маршрутам"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _FakeApp)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    report_path = tmp_path / 'report.json'
+    try:
+        exit_code = main([
+            '--base-url', f'http://127.0.0.1:{server.server_port}',
+            '-c', '3', '-d', '0.5', '--warmup', '0.1',
+            '--mix', 'generate=2,preview=1,history=1', '--rows', '0,5',
+            '--report', str(report_path),
+        ])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert exit_code == 0
+    report = json.loads(report_path.read_text(encoding='utf-8'))
+    assert set(report['routes']) == {'POST /generate', 'POST /generate?preview=1', 'GET /history'}
+    assert report['routes']['POST /generate']['error_rate'] == 0.0
+    assert report['routes']['POST /generate?preview=1']['rejected_rate'] == 1.0
+    assert report['total']['requests'] > 0
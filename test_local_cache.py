@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты локального кэша объектов S3 (local_cache)
+"""
+
+import os
+import time
+import tempfile
+from local_cache import LocalFileCache
+
+
+def _downloader(calls, size=1024):
+    def download(key, path):
+        calls.append(key)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return True
+    return download
+
+
+def test_fetch_downloads_once_and_keeps_meta():
+    """Повторное обращение не ходит в S3, предобработка хранится рядом с файлом"""
+    cache = LocalFileCache(tempfile.mkdtemp())
+    calls = []
+    first = cache.fetch('templates/abc_договор.docx', _downloader(calls))
+    second = cache.fetch('templates/abc_договор.docx', _downloader(calls))
+
+    assert first == second and os.path.exists(first)
+    assert first.endswith('.docx')
+    assert calls == ['templates/abc_договор.docx']
+
+    assert cache.get_meta('templates/abc_договор.docx', 'variables') is None
+    cache.set_meta('templates/abc_договор.docx', 'variables', {'фамилия': {'type': 'simple'}})
+    assert cache.get_meta('templates/abc_договор.docx', 'variables') == {'фамилия': {'type': 'simple'}}
+
+    assert cache.fetch('missing.docx', lambda key, path: False) is None
+
+
+def test_evicts_least_recently_used_over_budget():
+    """Сверх бюджета вытесняются давно не использованные файлы"""
+    cache = LocalFileCache(tempfile.mkdtemp(), max_bytes=2500, min_age=0)
+    calls = []
+    old = cache.fetch('a.docx', _downloader(calls))
+    past = time.time() - 3600
+    os.utime(old, (past, past))
+    cache.fetch('b.docx', _downloader(calls))
+    cache.fetch('c.docx', _downloader(calls))
+
+    assert not os.path.exists(old)
+    assert cache.get('b.docx') and cache.get('c.docx')
+    assert cache.size() <= 2500
+
+
+def test_writes_within_budget_do_not_scan_directory():
+    """Обход директории — при первой записи, сверх оценки бюджета и по интервалу"""
+    cache = LocalFileCache(tempfile.mkdtemp(), max_bytes=2500, min_age=0, scan_interval=3600)
+    scans = []
+    entries = cache._entries
+    cache._entries = lambda: scans.append(1) or entries()
+
+    calls = []
+    cache.fetch('a.docx', _downloader(calls))
+    cache.fetch('b.docx', _downloader(calls))
+    assert len(scans) == 1
+
+    cache.fetch('c.docx', _downloader(calls))
+    assert len(scans) == 2 and cache.size() <= 2500
+
+    cache.scan_interval = 0
+    cache.put('d.docx', cache.path_for('c.docx'), move=False)
+    assert len(scans) == 4
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты изображений в контексте генерации (media)
+"""
+
+import os
+import zipfile
+import tempfile
+import pytest
+from docx import Document
+from PIL import Image
+import media
+from rendering import render_document
+
+
+def test_refs_fit_and_resize():
+    """Ссылки в контексте, размер варианта без увеличения, уменьшение с пережатием"""
+    context = {
+        'logo': {'$image': 3, 'width_mm': 40},
+        'items': [{'stamp': {'$image': 5}}, {'stamp': {'$image': 5}}],
+    }
+    assert media.find_image_refs(context) == [(3, 40.0, None), (5, None, None)]
+    with pytest.raises(media.InvalidImage):
+        media.find_image_refs({'logo': {'$image': 'x'}})
+
+    # 40 мм при 200 dpi — 315 пикселей, высота по пропорциям
+    assert media.fit((1000, 500), width_mm=40) == ((315, 158), (40.0, 20.0))
+    # Оригинал меньше нужного — не увеличивается
+    assert media.fit((100, 50), height_mm=50) == ((100, 50), (100.0, 50.0))
+
+    directory = tempfile.mkdtemp()
+    source = os.path.join(directory, 'logo.png')
+    Image.new('RGBA', (1000, 500), (200, 0, 0, 128)).save(source)
+    assert media.inspect_image(source)['content_type'] == 'image/png'
+
+    output = os.path.join(directory, 'variant.png')
+    media.resize_image(source, output, (315, 158))
+    with Image.open(output) as variant:
+        assert variant.size == (315, 158) and variant.mode == 'RGBA'
+    assert media.variant_key('ab' * 32, (315, 158), '.png') == f"media/{'ab' * 32}/315x158.png"
+
+
+def test_render_embeds_repeated_image_once():
+    """Изображение, выведенное много раз, попадает в пакет DOCX один раз"""
+    directory = tempfile.mkdtemp()
+    image_path = os.path.join(directory, 'stamp.png')
+    Image.new('RGB', (120, 120), (0, 0, 200)).save(image_path)
+
+    template = Document()
+    template.add_paragraph('{{ stamp }} {{ stamp }}')
+    template.add_paragraph('{% for row in rows %}{{ row.stamp }}{% endfor %}')
+    template_path = os.path.join(directory, 'template.docx')
+    template.save(template_path)
+
+    ref = {'$image': 1, 'width_mm': 20}
+    context = {'stamp': ref, 'rows': [{'stamp': ref}, {'stamp': ref}]}
+    resolved = {(1, 20.0, None): (image_path, (20.0, 20.0))}
+    render_context = media.substitute_images(context, resolved)
+    assert context['stamp'] == ref
+
+    doc = render_document(template_path, render_context, images=True)
+    output_path = os.path.join(directory, 'output.docx')
+    doc.save(output_path)
+
+    with zipfile.ZipFile(output_path) as zf:
+        media_files = [name for name in zf.namelist() if name.startswith('word/media/')]
+        document_xml = zf.read('word/document.xml').decode('utf-8')
+    assert len(media_files) == 1
+    assert document_xml.count('<pic:pic') == 4
+
+
+def test_forged_image_path_is_rejected_and_not_bound():
+    """Служебный ключ из JSON отклоняется; словарь с путём не становится изображением"""
+    forged = {'logo': {'$image_path': '/etc/passwd', 'width_mm': 10, 'height_mm': 10}}
+    with pytest.raises(media.InvalidImage):
+        media.find_image_refs(forged)
+    with pytest.raises(media.InvalidImage):
+        media.find_image_refs({'rows': [{'cell': {'$image_path': '/etc/hosts'}}]})
+
+    directory = tempfile.mkdtemp()
+    template = Document()
+    template.add_paragraph('{{ logo }}')
+    template_path = os.path.join(directory, 'template.docx')
+    template.save(template_path)
+
+    doc = render_document(template_path, forged, images=True)
+    output_path = os.path.join(directory, 'output.docx')
+    doc.save(output_path)
+    with zipfile.ZipFile(output_path) as zf:
+        assert not [name for name in zf.namelist() if name.startswith('word/media/')]
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты доступа к метрикам Prometheus (/metrics)
+"""
+
+from app import create_app
+
+
+def test_metrics_allowed_only_for_direct_loopback_or_token():
+    """Без токена — прямой запрос с разрешённого адреса; через прокси и извне — 403; с токеном — только по нему"""
+    client = create_app({'METRICS_ALLOWED_IPS': '127.0.0.1, 10.0.0.0/8'}).test_client()
+    assert client.get('/metrics').status_code == 200
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '10.1.2.3'}).status_code == 200
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '192.168.1.5'}).status_code == 403
+    assert client.get('/metrics', headers={'X-Forwarded-For': '203.0.113.9'}).status_code == 403
+
+    client = create_app({'METRICS_TOKEN': 'secret'}).test_client()
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    response = client.get('/metrics', headers={'Authorization': 'Bearer secret'},
+                          environ_base={'REMOTE_ADDR': '192.168.1.5'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
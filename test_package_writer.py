@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты сохранения DOCX с копированием неизменённых частей (package_writer)
+"""
+
+import os
+import struct
+import zipfile
+import tempfile
+from io import BytesIO
+from PIL import Image
+from docx import Document
+from docx.shared import Mm
+from package_writer import save_package
+from rendering import render_document
+
+
+def _template_with_image(path):
+    doc = Document()
+    doc.add_paragraph('Клиент: {{ name }}')
+    image = BytesIO()
+    Image.new('RGB', (64, 64), (200, 30, 30)).save(image, 'PNG')
+    image.seek(0)
+    doc.add_picture(image, width=Mm(20))
+    doc.save(path)
+
+
+def _raw_entries(path):
+    """{имя записи: (CRC, метод сжатия, сжатые байты)}"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    with zipfile.ZipFile(path) as archive:
+        entries = {}
+        for info in archive.infolist():
+            name_length, extra_length = struct.unpack('<2H', data[info.header_offset + 26:info.header_offset + 30])
+            start = info.header_offset + 30 + name_length + extra_length
+            entries[info.filename] = (info.CRC, info.compress_type, data[start:start + info.compress_size])
+        return entries
+
+
+def test_unchanged_parts_copied_as_is():
+    """Изображение и неизменённые части копируются сжатыми байтами, изменённое тело — пережато"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        template_path = os.path.join(temp_dir, 'template.docx')
+        output_path = os.path.join(temp_dir, 'result.docx')
+        _template_with_image(template_path)
+
+        doc = render_document(template_path, {'name': 'ООО «Ромашка»'})
+        stats = save_package(doc.docx, output_path, template_path, compresslevel=1)
+        assert stats['copied'] > 0 and stats['compressed'] >= 1
+
+        template_entries = _raw_entries(template_path)
+        result_entries = _raw_entries(output_path)
+        media = [name for name in template_entries if name.startswith('word/media/')]
+        assert media and all(result_entries[name] == template_entries[name] for name in media)
+        assert result_entries['word/document.xml'][0] != template_entries['word/document.xml'][0]
+
+        with zipfile.ZipFile(output_path) as archive:
+            assert archive.testzip() is None
+        result = Document(output_path)
+        assert result.paragraphs[0].text == 'Клиент: ООО «Ромашка»'
+        assert len(result.inline_shapes) == 1
+
+
+def test_template_save_to_stream():
+    """SnippetAwareTemplate.save: шаблон и результат в потоках (как в batch_generate)"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        template_path = os.path.join(temp_dir, 'template.docx')
+        _template_with_image(template_path)
+        with open(template_path, 'rb') as f:
+            template_bytes = f.read()
+
+    doc = render_document(BytesIO(template_bytes), {'name': 'Иванов'})
+    output = BytesIO()
+    doc.save(output)
+    output.seek(0)
+    assert Document(output).paragraphs[0].text == 'Клиент: Иванов'
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты HTML-превью документа (preview)
+"""
+
+import os
+import tempfile
+from docx import Document
+from docx.enum.text import WD_BREAK
+from preview import document_pages, document_to_html
+from rendering import render_document
+
+
+def _build_template():
+    doc = Document()
+    doc.sections[0].header.paragraphs[0].text = 'Колонтитул {{ номер }}'
+    doc.add_heading('Договор № {{ номер }}', level=1)
+    paragraph = doc.add_paragraph()
+    paragraph.add_run('Заказчик: ').bold = True
+    paragraph.add_run('{{ заказчик }}')
+    doc.add_paragraph('Первый пункт', style='List Bullet')
+    doc.add_paragraph('Второй пункт', style='List Number')
+
+    table = doc.add_table(rows=2, cols=2)
+    merged = table.cell(0, 0).merge(table.cell(0, 1))
+    merged.text = 'Итого'
+    table.cell(1, 0).text = '<цена>'
+    table.cell(1, 1).add_table(rows=1, cols=1).cell(0, 0).text = 'Вложенная'
+
+    doc.add_paragraph().add_run().add_break(WD_BREAK.PAGE)
+    doc.add_paragraph('Вторая страница')
+
+    path = os.path.join(tempfile.mkdtemp(), 'template.docx')
+    doc.save(path)
+    return path
+
+
+def test_document_pages_covers_runs_lists_tables_and_headers():
+    """Рендеринг без переноса тела в документ и постраничный HTML"""
+    path = _build_template()
+    doc = render_document(path, {'номер': '7/2026', 'заказчик': 'ООО «Пример»'}, detach_body=True)
+    pages, truncated = document_pages(doc.docx, body=doc.body)
+
+    assert not truncated
+    assert len(pages) == 2
+    first = pages[0]
+    assert '<h1>Договор № 7/2026</h1>' in first
+    assert '<strong>Заказчик: </strong>ООО «Пример»' in first
+    assert '<ul><li>Первый пункт</li></ul><ol><li>Второй пункт</li></ol>' in first
+    assert '<td colspan="2">' in first
+    assert '&lt;цена&gt;' in first
+    assert first.count('<table') == 2
+    assert 'Колонтитул 7/2026' in first and 'Колонтитул 7/2026' in pages[1]
+    assert 'Вторая страница' in pages[1]
+
+    # Предел числа страниц
+    pages, truncated = document_pages(doc.docx, body=doc.body, max_pages=1)
+    assert len(pages) == 1 and truncated
+
+
+def test_document_to_html_without_pages():
+    """Превью фрагмента — HTML тела без разметки страниц"""
+    html = document_to_html(Document(_build_template()))
+    assert 'docx-page' not in html
+    assert 'Вторая страница' in html
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты пула рендеринга (render_pool): замена процессов по RSS и по таймауту
+"""
+
+import os
+import time
+import multiprocessing
+import pytest
+import render_pool
+
+_ballast = []
+
+
+def _bloat_task(megabytes):
+    """Задача, после которой RSS процесса остаётся раздутым"""
+    _ballast.append(bytearray(megabytes * render_pool.MB))
+    return len(_ballast)
+
+
+def _hang_task(seconds):
+    time.sleep(seconds)
+    return 'done'
+
+
+def _pid_task():
+    return os.getpid()
+
+
+@pytest.fixture
+def pool():
+    # fork: процессы пула наследуют тестовые задачи из TASKS
+    render_pool.TASKS.update(bloat=_bloat_task, hang=_hang_task, pid=_pid_task)
+    pools = []
+
+    def create(size=1, **options):
+        pools.append(render_pool.RenderPool(size, context=multiprocessing.get_context('fork'),
+                                            initializer=None, **options))
+        return pools[-1]
+
+    yield create
+    for created in pools:
+        created.close()
+    for name in ('bloat', 'hang', 'pid'):
+        render_pool.TASKS.pop(name)
+
+
+def test_worker_over_rss_threshold_is_replaced_alone(pool):
+    """Процесс, перешедший порог RSS, заменяется после задачи; остальные продолжают работать"""
+    workers = pool(size=2)
+    baseline = max(workers.run('pid', (), 10)[1]['rss'] for _ in range(2))
+    workers.max_rss_bytes = baseline + 50 * render_pool.MB
+    before = workers.pids()
+
+    _, stats = workers.run('bloat', (100,), 10)
+    assert stats['rss'] > workers.max_rss_bytes
+
+    after = workers.pids()
+    assert len(after) == 2
+    assert stats['pid'] not in after
+    assert len(set(before) & set(after)) == 1
+    assert not os.path.exists(f"/proc/{stats['pid']}")
+
+
+def test_timed_out_render_kills_stuck_worker(pool):
+    """Зависшая задача: ошибка по таймауту, процесс завершён и заменён, слот пула свободен"""
+    workers = pool(size=1)
+    stuck_pid = workers.pids()[0]
+
+    started = time.monotonic()
+    with pytest.raises(render_pool.RenderError, match='timed out'):
+        workers.run('hang', (60,), 0.5)
+    assert time.monotonic() - started < 10
+
+    result, stats = workers.run('pid', (), 10)
+    assert result == stats['pid'] != stuck_pid
+    assert workers.pids() == [result]
+
+    # Ошибка задачи не заменяет процесс
+    with pytest.raises(render_pool.RenderError):
+        workers.run('bloat', ('boom',), 10)
+    assert workers.pids() == [result]
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты вставки фрагментов по индексу SNIPPET-меток (rendering)
+"""
+
+import os
+import tempfile
+from docx import Document
+from rendering import apply_snippets, build_marker_index, extract_document_text, insert_snippet_into_doc
+
+
+def _snippet(text):
+    doc = Document()
+    doc.add_paragraph(text)
+    doc.add_table(rows=1, cols=1).cell(0, 0).text = text + ' (таблица)'
+    return doc
+
+
+def test_marker_index_covers_nested_tables_and_headers():
+    """Метки в теле, вложенной таблице и колонтитуле; вставка в порядке документа"""
+    doc = Document()
+    doc.sections[0].header.paragraphs[0].text = '{{SNIPPET:шапка}}'
+    doc.add_paragraph('До')
+    doc.add_paragraph('{{SNIPPET:условия}}')
+    inner = doc.add_table(rows=1, cols=1).cell(0, 0).add_table(rows=1, cols=1)
+    inner.cell(0, 0).paragraphs[0].text = 'Метка {{SNIPPET:реквизиты}} в ячейке'
+    doc.add_paragraph('{{SNIPPET:лишнее}}')
+    doc.add_paragraph('После')
+
+    index = build_marker_index(doc)
+    assert list(index) == ['условия', 'реквизиты', 'лишнее', 'шапка']
+
+    applied = apply_snippets(doc, {
+        'шапка': _snippet('Логотип'),
+        'условия': _snippet('Условия оплаты'),
+        'реквизиты': _snippet('ИНН 7700000000'),
+        'лишнее': None,
+        'нет_в_документе': _snippet('x'),
+    })
+    assert applied == ['условия', 'реквизиты', 'лишнее', 'шапка']
+
+    text = extract_document_text(doc)
+    assert 'SNIPPET' not in text
+    assert text.index('До') < text.index('Условия оплаты') < text.index('ИНН 7700000000') < text.index('После')
+    assert 'Логотип' in doc.sections[0].header.paragraphs[0].text
+    assert build_marker_index(doc) == {}
+
+
+def test_insert_snippet_into_doc_many_markers():
+    """Документ с множеством меток: каждая заменяется своим фрагментом"""
+    directory = tempfile.mkdtemp()
+    doc = Document()
+    for i in range(300):
+        doc.add_paragraph(f'Пункт {i}')
+        doc.add_paragraph(f'{{{{SNIPPET:m{i}}}}}')
+    path = os.path.join(directory, 'doc.docx')
+    doc.save(path)
+
+    snippet_path = os.path.join(directory, 'snippet.docx')
+    _snippet('Фрагмент').save(snippet_path)
+
+    assert insert_snippet_into_doc(path, 'm150', snippet_path)
+    assert not insert_snippet_into_doc(path, 'm150', snippet_path)
+
+    doc = Document(path)
+    applied = apply_snippets(doc, {f'm{i}': snippet_path for i in range(300)})
+    assert len(applied) == 299
+    text = extract_document_text(doc)
+    assert 'SNIPPET' not in text and text.count('Фрагмент (таблица)') == 300
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты JSON-слоя (serialization)
+"""
+
+import io
+import gzip
+import pytest
+from werkzeug.datastructures import MultiDict, FileStorage
+import serialization
+
+
+def test_read_json_field_accepts_gzip_part():
+    """Сжатая файловая часть и поле формы дают одинаковый результат"""
+    raw = '{"номер_договора": "001/2026", "позиции": [1, 2, 3]}'
+    upload = FileStorage(io.BytesIO(gzip.compress(raw.encode('utf-8'))), filename='data.json.gz')
+
+    from_file = serialization.read_json_field(MultiDict(), MultiDict({'data': upload}), 'data')
+    from_form = serialization.read_json_field(MultiDict({'data': raw}), MultiDict(), 'data')
+
+    assert from_file == from_form
+    assert from_file[0]['позиции'] == [1, 2, 3]
+
+    bomb = FileStorage(io.BytesIO(gzip.compress(b' ' * 4096)), filename='data.json.gz')
+    with pytest.raises(serialization.PayloadTooLarge):
+        serialization.read_json_field(MultiDict(), MultiDict({'data': bomb}), 'data', max_decompressed=1024)
+
+
+def test_iter_object_splices_stored_json():
+    """Сохранённый JSON вставляется в ответ как есть, результат — валидный JSON"""
+    stored = serialization.dumps({'items': ['x' * 100] * 2000})
+    body = b''.join(serialization.iter_object({'success': True}, {'json_data': stored, 'empty': None}))
+
+    assert serialization.loads(body) == {
+        'success': True,
+        'json_data': serialization.loads(stored),
+        'empty': None,
+    }
+
+
+def test_iter_object_replaces_invalid_stored_json():
+    """Запись истории с не-JSON текстом не портит ответ: null и поле ошибки"""
+    rows = {'ok': '{"a": [1, 2]}', 'legacy': "{'a': 1}", 'truncated': '{"a": [1, 2', 'bytes': b'\xff'}
+    assert {key: serialization.is_json(raw) for key, raw in rows.items()} == {
+        'ok': True, 'legacy': False, 'truncated': False, 'bytes': False,
+    }
+
+    body = b''.join(serialization.iter_object({'success': True}, {'json_data': rows['legacy']}, validate=True))
+    assert serialization.loads(body) == {
+        'success': True, 'json_data_error': serialization.INVALID_JSON_ERROR, 'json_data': None,
+    }
+    body = b''.join(serialization.iter_object({'success': True}, {'json_data': rows['ok']}, validate=True))
+    assert serialization.loads(body) == {'success': True, 'json_data': {'a': [1, 2]}}
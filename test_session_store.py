@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты общего хранилища шаблонов сессии (session_store)
+"""
+
+import os
+import time
+import tempfile
+from local_cache import LocalFileCache
+from session_store import SessionTemplateStore, parse_token, session_key
+from storage import FilesystemStorage
+
+
+def _template(directory, content=b'PK template'):
+    path = os.path.join(directory, f'upload_{len(os.listdir(directory))}.docx')
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+def test_put_restores_object_removed_by_cleanup():
+    """Шаблон, удалённый из общего хранилища, загружается снова, хотя он есть в кэше узла; существующий — освежается"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        uploads = os.path.join(temp_dir, 'uploads')
+        os.makedirs(uploads)
+        storage = FilesystemStorage(os.path.join(temp_dir, 'storage'))
+        store = SessionTemplateStore(storage, LocalFileCache(os.path.join(temp_dir, 'cache'), min_age=0))
+
+        token = store.put(_template(uploads), 'договор.docx')
+        digest, filename = parse_token(token)
+        assert filename == 'договор.docx' and storage.file_exists(session_key(digest))
+
+        assert store.cleanup(0) == 1
+        assert not storage.file_exists(session_key(digest))
+
+        source = _template(uploads)
+        assert store.put(source, 'договор.docx') == token
+        assert storage.file_exists(session_key(digest))
+        assert not os.path.exists(source)
+
+        # Повторная загрузка существующего шаблона продлевает его жизнь
+        object_path = storage.path_for(session_key(digest))
+        os.utime(object_path, (time.time() - 7200, time.time() - 7200))
+        store.put(_template(uploads), 'договор.docx')
+        assert store.cleanup(3600) == 0
+        assert storage.file_exists(session_key(digest))
+
+
+def test_other_node_reads_template_from_shared_storage():
+    """Узел без локальной копии скачивает шаблон; cleanup не трогает шаблоны из истории"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        uploads = os.path.join(temp_dir, 'uploads')
+        os.makedirs(uploads)
+        storage = FilesystemStorage(os.path.join(temp_dir, 'storage'))
+        first = SessionTemplateStore(storage, LocalFileCache(os.path.join(temp_dir, 'node1'), min_age=0))
+        second = SessionTemplateStore(storage, LocalFileCache(os.path.join(temp_dir, 'node2'), min_age=0))
+
+        token = first.put(_template(uploads), 'a.docx')
+        path = second.get_path(token)
+        with open(path, 'rb') as f:
+            assert f.read() == b'PK template'
+
+        assert second.cleanup(0, keep={parse_token(token)[0]}) == 0
+        assert storage.file_exists(session_key(parse_token(token)[0]))
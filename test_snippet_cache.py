@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты кэша разобранных фрагментов (snippet_cache)
+"""
+
+import os
+import tempfile
+from docx import Document
+from docx.enum.style import WD_STYLE_TYPE
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from PIL import Image
+import snippet_cache
+from rendering import apply_snippets
+
+
+def _build_snippet(directory):
+    """Фрагмент со своим стилем, списком, изображением и внешней ссылкой"""
+    doc = Document()
+    doc.styles.add_style('Ответственность', WD_STYLE_TYPE.PARAGRAPH)
+    doc.add_paragraph('Стороны несут ответственность', style='Ответственность')
+
+    item = doc.add_paragraph('Пункт списка')
+    num_pr = item._p.get_or_add_pPr().get_or_add_numPr()
+    num_pr.get_or_add_numId().val = 3
+    num_pr.get_or_add_ilvl().val = 0
+
+    image_path = os.path.join(directory, 'stamp.png')
+    Image.new('RGB', (40, 40), (200, 0, 0)).save(image_path)
+    doc.add_picture(image_path)
+
+    rid = doc.part.relate_to('https://example.com/terms', RT.HYPERLINK, is_external=True)
+    hyperlink = OxmlElement('w:hyperlink')
+    hyperlink.set(qn('r:id'), rid)
+    doc.add_paragraph()._p.append(hyperlink)
+
+    path = os.path.join(directory, 'snippet.docx')
+    doc.save(path)
+    return path
+
+
+def test_snippet_parsed_once_and_dependencies_imported():
+    """Повторная вставка берётся из кэша; стиль, список, изображение и ссылка переносятся"""
+    snippet_cache.clear()
+    directory = tempfile.mkdtemp()
+    snippet_path = _build_snippet(directory)
+
+    target = Document()
+    target.add_paragraph('{{SNIPPET:a}}')
+    target.add_paragraph('{{SNIPPET:b}}')
+    nums_before = len(list(target.part.numbering_part.element.iter(qn('w:num'))))
+
+    assert apply_snippets(target, {'a': snippet_path, 'b': snippet_path}) == ['a', 'b']
+    info = snippet_cache.cache_info()
+    assert (info['misses'], info['hits'], info['entries']) == (1, 1, 1)
+
+    # Стиль перенесён один раз, список получил новый numId
+    style_ids = [style.get(qn('w:styleId')) for style in target.styles.element.iter(qn('w:style'))]
+    assert style_ids.count('Ответственность') == 1
+    nums = list(target.part.numbering_part.element.iter(qn('w:num')))
+    assert len(nums) == nums_before + 1
+    new_num_id = nums[-1].get(qn('w:numId'))
+    used = {node.get(qn('w:val')) for node in target.element.body.iter(qn('w:numId'))}
+    assert used == {new_num_id}
+
+    # Изображение — одна часть пакета, ссылки указывают на связи документа
+    embeds = {node.get(qn('r:embed')) for node in target.element.body.iter(qn('a:blip'))}
+    assert len(embeds) == 1
+    assert target.part.rels[embeds.pop()].reltype == RT.IMAGE
+    link_ids = {node.get(qn('r:id')) for node in target.element.body.iter(qn('w:hyperlink'))}
+    assert {target.part.rels[rid].target_ref for rid in link_ids} == {'https://example.com/terms'}
+
+    output_path = os.path.join(directory, 'output.docx')
+    target.save(output_path)
+    reopened = Document(output_path)
+    assert [p.text for p in reopened.paragraphs].count('Стороны несут ответственность') == 2
+
+
+def test_cache_budget_evicts_least_recently_used(monkeypatch):
+    """Фрагменты сверх бюджета вытесняются, давно не использованные — первыми"""
+    snippet_cache.clear()
+    directory = tempfile.mkdtemp()
+    paths = []
+    for i in range(3):
+        doc = Document()
+        doc.add_paragraph(f'Фрагмент {i} ' * 200)
+        paths.append(os.path.join(directory, f'{i}.docx'))
+        doc.save(paths[-1])
+
+    size = snippet_cache.load(paths[0]).size
+    snippet_cache.clear()
+    monkeypatch.setattr(snippet_cache, 'SNIPPET_CACHE_MAX_MB', (size * 2.5) / snippet_cache.MB)
+
+    for path in paths:
+        snippet_cache.load(path)
+    info = snippet_cache.cache_info()
+    assert info['entries'] == 2 and info['evictions'] == 1
+    snippet_cache.load(paths[0])
+    assert snippet_cache.cache_info()['misses'] == 4
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты хранилища объектов на файловой системе (storage)
+"""
+
+import os
+import tempfile
+from storage import FilesystemStorage, create_storage
+
+
+def _file(directory, name, content):
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+def test_filesystem_storage_roundtrip_and_listing():
+    """Загрузка, скачивание, список по префиксу, удаление; ключ не выходит за корень"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        storage = FilesystemStorage(os.path.join(temp_dir, 'storage'))
+        source = _file(temp_dir, 'source.docx', b'template')
+
+        assert storage.upload_file(source, 'snippets/abc_договор.docx')
+        assert storage.upload_file(source, 'sessions/1234.docx')
+        assert storage.upload_file(source, 'root.docx')
+        assert storage.file_exists('snippets/abc_договор.docx')
+        assert not storage.file_exists('snippets/missing.docx')
+
+        local_path = storage.local_path('snippets/abc_договор.docx')
+        assert local_path.startswith(storage.root) and local_path.endswith('abc_договор.docx')
+
+        target = os.path.join(temp_dir, 'downloaded.docx')
+        assert storage.download_file('snippets/abc_договор.docx', target)
+        with open(target, 'rb') as f:
+            assert f.read() == b'template'
+        assert not storage.download_file('snippets/missing.docx', target)
+
+        listed = storage.list_files(prefix='snippets/')
+        assert [item['Key'] for item in listed] == ['snippets/abc_договор.docx']
+        assert listed[0]['Size'] == len(b'template') and listed[0]['LastModified'].tzinfo is not None
+        assert [item['Key'] for item in storage.list_files()] == ['root.docx', 'sessions/1234.docx', 'snippets/abc_договор.docx']
+
+        assert not storage.upload_file(source, '../escape.docx')
+        assert not storage.upload_file(source, '/etc/passwd')
+        assert storage.local_path('snippets/../root.docx') is None
+
+        assert storage.delete_file('snippets/abc_договор.docx')
+        assert storage.delete_file('snippets/abc_договор.docx')
+        assert storage.list_files(prefix='snippets/') == []
+
+
+def test_filesystem_storage_dedup_with_hardlinks():
+    """Одинаковое содержимое хранится один раз; удаление последней ссылки освобождает его"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.environ['STORAGE_PATH'] = os.path.join(temp_dir, 'storage')
+        os.environ['STORAGE_DEDUP'] = '1'
+        try:
+            storage = create_storage('filesystem')
+        finally:
+            del os.environ['STORAGE_PATH'], os.environ['STORAGE_DEDUP']
+        assert storage.dedup
+
+        first = _file(temp_dir, 'a.docx', b'same content')
+        assert storage.upload_file(first, 'generated/a.docx')
+        assert storage.upload_file(first, 'generated/b.docx')
+        a_stat = os.stat(storage.local_path('generated/a.docx'))
+        assert a_stat.st_ino == os.stat(storage.local_path('generated/b.docx')).st_ino
+        assert a_stat.st_nlink == 3
+
+        # Замена объекта другим содержимым не трогает второй объект
+        assert storage.upload_file(_file(temp_dir, 'c.docx', b'other'), 'generated/a.docx')
+        assert os.stat(storage.local_path('generated/b.docx')).st_nlink == 2
+
+        assert storage.delete_file('generated/b.docx')
+        assert storage.delete_file('generated/a.docx')
+        blobs = [name for _, _, names in os.walk(os.path.join(storage.root, '.blobs')) for name in names]
+        assert blobs == []
+        assert storage.list_files() == []
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты извлечения переменных шаблона по AST Jinja2 (template_variables)
+"""
+
+import os
+import tempfile
+from docx import Document
+import template_variables
+from template_variables import extract_template_variables, parse_variables
+
+
+def test_parse_variables_types_and_order():
+    """elif, and/not, вложенные циклы, фильтры со скобками, порядок появления"""
+    source = (
+        "{{ номер }} {{ client.name }} {{ client.address.city }} {{ '{' ~ total|round(2) ~ '}' }}"
+        "{% if with_vat and not hide %}{{ vat }}{% elif mode == 'short' %}-{% endif %}"
+        "{% for item in items %}{{ loop.index }} {{ item.name }}"
+        "{% for part in item.parts %}{{ part.sku }}{% endfor %}{% endfor %}"
+        "{% set label = номер %}{{ label }}"
+        "{_{SNIPPET:условия}_}"
+    )
+    variables = parse_variables([source])
+
+    assert variables.pop('__snippets__') == [{'name': 'условия', 'position': 1}]
+    assert list(variables) == ['номер', 'client', 'total', 'with_vat', 'hide', 'vat', 'mode', 'items']
+    assert [v['position'] for v in variables.values()] == list(range(1, 9))
+    assert variables['client']['fields'] == ['name', 'address.city']
+    assert variables['with_vat']['type'] == 'boolean' and variables['hide']['type'] == 'boolean'
+    assert variables['mode']['type'] == 'simple'
+    assert variables['items'] == {
+        'type': 'array',
+        'fields': ['name', 'parts'],
+        'nested': {'parts': {'type': 'array', 'fields': ['sku']}},
+        'position': 8,
+    }
+
+
+def test_extract_from_docx_with_header_and_cache():
+    """Тело, таблицы и колонтитулы; повторный вызов берётся из кэша по хешу"""
+    doc = Document()
+    doc.sections[0].header.paragraphs[0].text = '{{ организация }}'
+    doc.add_paragraph('{% if оплачено %}Оплачено{% endif %} {{ сумма }}')
+    table = doc.add_table(rows=3, cols=1)
+    table.cell(0, 0).text = '{%tr for row in rows %}'
+    table.cell(1, 0).text = '{{ row.name }}'
+    table.cell(2, 0).text = '{%tr endfor %}'
+    path = os.path.join(tempfile.mkdtemp(), 'template.docx')
+    doc.save(path)
+
+    variables = extract_template_variables(path)
+    assert variables['оплачено']['type'] == 'boolean'
+    assert variables['rows']['fields'] == ['name']
+    assert variables['организация']['type'] == 'simple'
+
+    variables['rows']['fields'].append('changed')
+    assert len(template_variables._cache) >= 1
+    assert extract_template_variables(path)['rows']['fields'] == ['name']
@@ -0,0 +1,127 @@
+"""
+Прогрев воркера после старта.
+
+Самые используемые шаблоны библиотеки и часто выбираемые фрагменты
+скачиваются из S3 в локальный кэш, для шаблонов заранее извлекаются
+переменные — первые пользователи после деплоя не платят за это сами.
+Прогрев ограничен по времени; пока он идёт, /ready отвечает 503.
+
+Запускается из хука post_worker_init (gunicorn.conf.py).
+"""
+import time
+import logging
+import threading
+from datetime import datetime
+import metrics
+from template_variables import VARIABLES_META
+
+logger = logging.getLogger(__name__)
+
+metrics.describe('warmup_duration_seconds', 'Duration of the last worker warm-up')
+metrics.describe('warmup_items_total', 'Items preloaded during warm-up, by kind')
+
+STATE_PENDING = 'pending'
+STATE_RUNNING = 'running'
+STATE_DONE = 'done'
+
+
+class WarmupState:
+    """Состояние прогрева воркера (для /ready)"""
+
+    def __init__(self):
+        self.state = STATE_PENDING
+        self.started_at = None
+        self.finished_at = None
+        self.templates = 0
+        self.snippets = 0
+        self.error = None
+
+    @property
+    def ready(self):
+        return self.state == STATE_DONE
+
+    def to_dict(self):
+        return {
+            'state': self.state,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'templates': self.templates,
+            'snippets': self.snippets,
+            'error': self.error,
+        }
+
+
+def preload_template(template, cache, s3_client, extract_variables):
+    """
+    Шаблон в локальный кэш вместе с извлечёнными переменными.
+
+    Returns:
+        str: путь к файлу в кэше или None
+    """
+    path = cache.fetch(template['s3_key'], s3_client.download_file)
+    if path is not None and cache.get_meta(template['s3_key'], VARIABLES_META) is None:
+        cache.set_meta(template['s3_key'], VARIABLES_META, extract_variables(path))
+    return path
+
+
+def run_warmup(app, state):
+    """Прогрев в рамках бюджета времени WARMUP_BUDGET"""
+    # Импорт здесь: модуль app импортирует warmup
+    from app import get_file_cache, get_s3_client, extract_template_variables
+    import db
+
+    config = app.config
+    deadline = time.monotonic() + config['WARMUP_BUDGET']
+    state.state = STATE_RUNNING
+    state.started_at = datetime.now()
+
+    try:
+        with app.app_context():
+            cache = get_file_cache()
+            s3 = get_s3_client()
+
+            for template in db.get_most_used_templates(config['WARMUP_TEMPLATES']):
+                if time.monotonic() >= deadline:
+                    break
+                if preload_template(template, cache, s3, extract_template_variables):
+                    state.templates += 1
+
+            for snippet in db.get_most_used_snippets(config['WARMUP_SNIPPETS']):
+                if time.monotonic() >= deadline:
+                    break
+                if cache.fetch(snippet['s3_key'], s3.download_file):
+                    state.snippets += 1
+    except Exception as e:
+        # Прогрев — оптимизация: ошибка не должна держать воркер неготовым
+        state.error = str(e)
+        logger.error(f"Warm-up failed: {e}")
+    finally:
+        state.finished_at = datetime.now()
+        state.state = STATE_DONE
+        duration = (state.finished_at - state.started_at).total_seconds()
+        metrics.set_gauge('warmup_duration_seconds', round(duration, 3))
+        metrics.inc('warmup_items_total', state.templates, labels={'kind': 'template'})
+        metrics.inc('warmup_items_total', state.snippets, labels={'kind': 'snippet'})
+        if time.monotonic() >= deadline:
+            logger.warning(f"Warm-up stopped by budget after {duration:.1f}s")
+        logger.info(
+            f"Warm-up finished in {duration:.1f}s: "
+            f"templates={state.templates} snippets={state.snippets}"
+        )
+
+
+def _disabled(config):
+    """Прогрев выключен: WARMUP_BUDGET=0 или нечего прогревать"""
+    return config['WARMUP_BUDGET'] <= 0 or (config['WARMUP_TEMPLATES'] <= 0 and config['WARMUP_SNIPPETS'] <= 0)
+
+
+def start(app):
+    """Запуск прогрева в фоновом потоке; /ready ждёт его завершения"""
+    state = app.extensions['warmup']
+    if state.state != STATE_PENDING:
+        return state
+    if _disabled(app.config):
+        state.state = STATE_DONE
+        return state
+    threading.Thread(target=run_warmup, args=(app, state), name='warmup', daemon=True).start()
+    return state